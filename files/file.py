@@ -23,6 +23,7 @@ import shutil
 import stat
 import grp
 import pwd
+import threading
 try:
     import selinux
     HAVE_SELINUX=True
@@ -79,6 +80,8 @@ options:
     version_added: "1.1"
     description:
       - recursively set the specified file attributes (applies only to state=directory)
+      - The number of entries below C(path) that were and weren't changed is returned
+        in C(recurse_changed) and C(recurse_unchanged).
   force:
     required: false
     default: "no"
@@ -126,27 +129,191 @@ def get_state(path):
 
     return 'absent'
 
-def recursive_set_attributes(module, path, follow, file_args):
-    changed = False
-    for root, dirs, files in os.walk(path):
-        for fsobj in dirs + files:
-            fsname = os.path.join(root, fsobj)
-            if not os.path.islink(fsname):
-                tmp_file_args = file_args.copy()
-                tmp_file_args['path']=fsname
-                changed |= module.set_fs_attributes_if_different(tmp_file_args, changed)
-            else:
-                tmp_file_args = file_args.copy()
-                tmp_file_args['path']=fsname
-                changed |= module.set_fs_attributes_if_different(tmp_file_args, changed)
+# directories are handed out to this many threads when recursing
+RECURSE_THREADS = 4
+
+def resolve_owner(module, path, owner, group):
+    ''' look up the uid and gid once, -1 leaves them alone like chown does '''
+
+    uid = gid = -1
+    if owner is not None:
+        try:
+            uid = int(owner)
+        except ValueError:
+            try:
+                uid = pwd.getpwnam(owner).pw_uid
+            except KeyError:
+                module.fail_json(path=path, msg='chown failed: failed to look up user %s' % owner)
+    if group is not None:
+        try:
+            gid = int(group)
+        except ValueError:
+            try:
+                gid = grp.getgrnam(group).gr_gid
+            except KeyError:
+                module.fail_json(path=path, msg='chgrp failed: failed to look up group %s' % group)
+    return (uid, gid)
+
+class RecursiveAttributes(object):
+    '''
+    Set owner, group and mode on everything below a directory. Every entry
+    is lstat'ed once and only changed when it differs; directories are
+    walked on a pool of threads and each one is walked only once, even when
+    following symlinks leads back to it.
+    '''
+
+    def __init__(self, module, file_args, follow):
+        self.module = module
+        self.follow = follow
+        (self.uid, self.gid) = resolve_owner(module, file_args['path'], file_args['owner'], file_args['group'])
+
+        self.mode = file_args['mode']
+        if self.mode is not None and not isinstance(self.mode, int):
+            try:
+                self.mode = int(self.mode, 8)
+            except ValueError:
+                # symbolic modes depend on the entry, see entry_mode()
+                pass
+
+        # selinux contexts go through the module one entry at a time,
+        # module methods may call fail_json so they stay on this thread
+        self.secontext = None
+        self.threads = RECURSE_THREADS
+        if [c for c in file_args.get('secontext') or [] if c is not None]:
+            self.secontext = file_args['secontext']
+            self.threads = 1
+
+        self.cond = threading.Condition()
+        self.queue = []
+        self.pending = 0
+        self.visited = set()
+        self.changed = 0
+        self.unchanged = 0
+        self.errors = []
+
+    def entry_mode(self, st):
+        if self.mode is None or isinstance(self.mode, int):
+            return self.mode
+        return self.module._symbolic_mode_to_octal(st, self.mode)
+
+    def set_attributes(self, path, st, follow):
+        ''' returns whether path was changed, st describes it, or its target if follow '''
+
+        changed = False
+        if (self.uid != -1 and st.st_uid != self.uid) or (self.gid != -1 and st.st_gid != self.gid):
+            if not self.module.check_mode:
                 if follow:
-                    fsname = os.path.join(root, os.readlink(fsname))
-                    if os.path.isdir(fsname):
-                        changed |= recursive_set_attributes(module, fsname, follow, file_args)
-                    tmp_file_args = file_args.copy()
-                    tmp_file_args['path']=fsname
-                    changed |= module.set_fs_attributes_if_different(tmp_file_args, changed)
-    return changed
+                    os.chown(path, self.uid, self.gid)
+                else:
+                    os.lchown(path, self.uid, self.gid)
+            changed = True
+
+        # the mode of a symlink itself can't be changed on most systems
+        if follow or not stat.S_ISLNK(st.st_mode):
+            mode = self.entry_mode(st)
+            if mode is not None and stat.S_IMODE(st.st_mode) != mode:
+                if not self.module.check_mode:
+                    os.chmod(path, mode)
+                changed = True
+
+        if self.secontext is not None:
+            changed = self.module.set_context_if_different(path, self.secontext, changed)
+        return changed
+
+    def push(self, path, st):
+        self.cond.acquire()
+        try:
+            key = (st.st_dev, st.st_ino)
+            if key in self.visited:
+                return
+            self.visited.add(key)
+            self.queue.append(path)
+            self.pending += 1
+            self.cond.notify()
+        finally:
+            self.cond.release()
+
+    def visit(self, root):
+        changed = 0
+        unchanged = 0
+        try:
+            for name in os.listdir(root):
+                path = os.path.join(root, name)
+                st = os.lstat(path)
+                entry_changed = self.set_attributes(path, st, False)
+                if stat.S_ISDIR(st.st_mode):
+                    self.push(path, st)
+                elif stat.S_ISLNK(st.st_mode) and self.follow:
+                    try:
+                        target_st = os.stat(path)
+                    except OSError:
+                        # dangling link
+                        target_st = None
+                    if target_st is not None:
+                        entry_changed |= self.set_attributes(path, target_st, True)
+                        if stat.S_ISDIR(target_st.st_mode):
+                            self.push(path, target_st)
+                if entry_changed:
+                    changed += 1
+                else:
+                    unchanged += 1
+        finally:
+            self.cond.acquire()
+            self.changed += changed
+            self.unchanged += unchanged
+            self.cond.release()
+
+    def error(self, msg):
+        self.cond.acquire()
+        self.errors.append(msg)
+        self.cond.release()
+
+    def work(self):
+        while True:
+            self.cond.acquire()
+            try:
+                while not self.queue and self.pending and not self.errors:
+                    self.cond.wait()
+                if self.errors or not self.pending:
+                    return
+                path = self.queue.pop()
+            finally:
+                self.cond.release()
+
+            try:
+                try:
+                    self.visit(path)
+                except (IOError, OSError), e:
+                    self.error('%s: %s' % (getattr(e, 'filename', None) or path, e.strerror))
+                except Exception, e:
+                    # e.g. an invalid symbolic mode
+                    self.error('%s: %s' % (path, str(e)))
+            finally:
+                self.cond.acquire()
+                self.pending -= 1
+                self.cond.notifyAll()
+                self.cond.release()
+
+    def run(self, path):
+        self.push(path, os.stat(path))
+
+        workers = []
+        for i in range(self.threads - 1):
+            t = threading.Thread(target=self.work)
+            t.setDaemon(True)
+            t.start()
+            workers.append(t)
+        self.work()
+        for t in workers:
+            t.join()
+
+        if self.errors:
+            self.module.fail_json(path=path, msg='failed to set attributes recursively: %s' % '; '.join(self.errors))
+        return (self.changed, self.unchanged)
+
+def recursive_set_attributes(module, path, follow, file_args):
+    ''' returns (changed, unchanged), the number of entries below path that were/weren't changed '''
+    return RecursiveAttributes(module, file_args, follow).run(path)
 
 def main():
 
@@ -303,7 +470,9 @@ def main():
         changed = module.set_fs_attributes_if_different(file_args, changed)
 
         if recurse:
-            changed |= recursive_set_attributes(module, file_args['path'], follow, file_args)
+            (recurse_changed, recurse_unchanged) = recursive_set_attributes(module, file_args['path'], follow, file_args)
+            changed |= recurse_changed > 0
+            module.exit_json(path=path, changed=changed, recurse_changed=recurse_changed, recurse_unchanged=recurse_unchanged)
 
         module.exit_json(path=path, changed=changed)
 
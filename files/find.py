@@ -25,6 +25,21 @@ import stat
 import fnmatch
 import time
 import re
+import mmap
+import threading
+
+try:
+    from hashlib import sha1
+except ImportError:
+    from sha import sha as sha1
+
+try:
+    from scandir import scandir
+    HAS_SCANDIR = True
+except ImportError:
+    # python 3.5 has it as os.scandir
+    scandir = getattr(os, 'scandir', None)
+    HAS_SCANDIR = scandir is not None
 
 DOCUMENTATION = '''
 ---
@@ -57,6 +72,13 @@ options:
         default: null
         description:
             - One or more re patterns which should be matched against the file content
+            - The pattern is matched at the start of every line, as with python's C(re.match).
+    read_limit:
+        required: false
+        default: null
+        version_added: "2.1"
+        description:
+            - Only search the first this many bytes of each file for C(contains).
     paths:
         required: true
         aliases: [ "name", "path" ]
@@ -113,6 +135,31 @@ options:
         choices: [ True, False ]
         description:
             - If false the patterns are file globs (shell) if true they are python regexes
+    max_depth:
+        required: false
+        default: null
+        version_added: "2.1"
+        description:
+            - With C(recurse), do not descend more than this many levels below the given paths.
+              The entries directly in a path are at depth 1.
+    limit:
+        required: false
+        default: null
+        version_added: "2.1"
+        description:
+            - Stop looking once this many matches have been found. With more than one thread
+              there is no guarantee which matches these are.
+    threads:
+        required: false
+        default: 4
+        version_added: "2.1"
+        description:
+            - Number of threads walking the directory tree. Subdirectories are handed out
+              to whichever thread is free, which mostly helps on network and cold filesystems.
+notes:
+    - Hidden directories are not descended into unless C(hidden) is set.
+    - If the C(scandir) python package is installed (or on python 3.5+), the file type
+      from the directory entry is used so entries that can't match are never stat'ed.
 '''
 
 
@@ -131,6 +178,9 @@ EXAMPLES = '''
 
 # find /var/log files equal or greater than 10 megabytes ending with .old or .log.gz via regex
 - find: paths="/var/tmp" patterns="^.*?\.(?:old|log\.gz)$" size="10m" use_regex=True
+
+# find at most 100 core files no more than 3 levels below /srv
+- find: paths="/srv" patterns="core.*" recurse=yes max_depth=3 limit=100
 '''
 
 RETURN = '''
@@ -160,22 +210,26 @@ examined:
     sample: 34
 '''
 
-def pfilter(f, patterns=None, use_regex=False):
-    '''filter using glob patterns'''
+def compile_patterns(patterns, use_regex=False):
+    '''compile the shell or regex patterns once, None matches everything'''
 
-    if patterns is None:
-        return True
+    if not patterns or patterns == ['*']:
+        return None
 
     if use_regex:
-        for p in patterns:
-            r =  re.compile(p)
-            if r.match(f):
-                return True
-    else:
+        return [re.compile(p) for p in patterns]
+    return [re.compile(fnmatch.translate(p)) for p in patterns]
+
 
-        for p in patterns:
-            if fnmatch.fnmatch(f, p):
-                return True
+def pfilter(f, patterns=None):
+    '''filter using compiled patterns'''
+
+    if patterns is None:
+        return True
+
+    for p in patterns:
+        if p.match(f):
+            return True
 
     return False
 
@@ -200,23 +254,133 @@ def sizefilter(st, size):
 
     return False
 
-def contentfilter(fsname, pattern):
-    '''filter files which contain the given expression'''
-    if pattern is None: return True
+# files are searched through mmap in windows of this size, a match may
+# run up to OVERLAP bytes into the next window and still be found
+WINDOW = 4 * 1024 * 1024
+OVERLAP = 64 * 1024
+
+def compile_content(pattern):
+    '''
+    returns (anchored, line): anchored finds the lines that may match
+    in a whole buffer, line is matched on each of them on its own
+    '''
+    if pattern is None:
+        return None
+    return (re.compile('^(?:%s)' % pattern, re.M), re.compile(pattern))
+
+
+def search_lines(content, data, start, stop, limit):
+    '''
+    whether a line starting in data[start:stop] matches content like
+    re.match on that line alone, lines are cut at limit
+    '''
+    (anchored, line) = content
+    pos = start
+    while pos < stop:
+        m = anchored.search(data, pos, stop)
+        if m is None:
+            return False
+        # \s, [^x] or \n may have matched across lines
+        line_start = m.start()
+        line_end = data.find('\n', line_start, limit)
+        if line_end == -1:
+            line_end = limit
+        else:
+            line_end += 1
+        if line.match(data[line_start:line_end]):
+            return True
+        pos = line_end
+    return False
+
 
-    try:
-       f = open(fsname)
-       prog = re.compile(pattern)
-       for line in f:
-           if prog.match (line):
-               f.close()
-               return True
+def contentfilter(fsname, prog, read_limit=None, checksum=False):
+    '''
+    search fsname for prog, optionally computing its sha1 in the same pass
+    returns (found, checksum)
+    '''
 
-       f.close() 
-    except:
-       pass
+    digest = None
+    if checksum:
+        digest = sha1()
+
+    f = open(fsname, 'rb')
+    try:
+        size = os.fstat(f.fileno()).st_size
+        end = size
+        if read_limit is not None:
+            end = min(size, read_limit)
+
+        if size == 0:
+            # /proc, /sys and some fuse files have content but no size
+            if read_limit is None:
+                data = f.read()
+            else:
+                data = f.read(read_limit)
+            found = prog is None or search_lines(prog, data, 0, len(data), len(data))
+            if digest:
+                digest.update(data)
+                digest.update(f.read())
+        elif size < WINDOW and not checksum:
+            data = f.read(end)
+            found = prog is None or search_lines(prog, data, 0, len(data), len(data))
+            if digest:
+                digest.update(data)
+                digest.update(f.read())
+        else:
+            found = prog is None
+            m = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+            try:
+                pos = 0
+                while pos < size:
+                    if found and not digest:
+                        break
+                    window_end = min(pos + WINDOW, size)
+                    if not found and pos < end:
+                        found = search_lines(prog, m, pos, min(window_end + OVERLAP, end), end)
+                    if digest:
+                        digest.update(m[pos:window_end])
+                    pos = window_end
+            finally:
+                m.close()
+    finally:
+        f.close()
+
+    if digest:
+        digest = digest.hexdigest()
+    return (found, digest)
+
+
+def checksum_files(results, threads=1):
+    '''add the sha1 checksum of the regular files in results, on a pool of threads'''
+
+    todo = [r for r in results if r.get('isreg') and 'checksum' not in r]
+    lock = threading.Lock()
+
+    def work():
+        while True:
+            lock.acquire()
+            try:
+                if not todo:
+                    return
+                r = todo.pop()
+            finally:
+                lock.release()
+            try:
+                r['checksum'] = contentfilter(r['path'], None, checksum=True)[1]
+            except (EnvironmentError, ValueError):
+                # mmap.error, or the file shrank under mmap
+                pass
+
+    workers = []
+    for i in range(min(threads, len(todo)) - 1):
+        t = threading.Thread(target=work)
+        t.setDaemon(True)
+        t.start()
+        workers.append(t)
+    work()
+    for t in workers:
+        t.join()
 
-    return False
 
 def statinfo(st):
     return {
@@ -251,6 +415,202 @@ def statinfo(st):
     }
 
 
+def list_dir(path):
+    '''
+    returns [(name, kind)] for the entries of path, kind is one of
+    dir, file, link or other as told by the directory entry, or None
+    if it can only be found out with a stat
+    '''
+
+    if not HAS_SCANDIR:
+        return [(name, None) for name in os.listdir(path)]
+
+    entries = []
+    for entry in scandir(path):
+        if entry.is_symlink():
+            kind = 'link'
+        elif entry.is_dir(follow_symlinks=False):
+            kind = 'dir'
+        elif entry.is_file(follow_symlinks=False):
+            kind = 'file'
+        else:
+            kind = 'other'
+        entries.append((entry.name, kind))
+    return entries
+
+
+def stat_kind(st):
+    if stat.S_ISDIR(st.st_mode):
+        return 'dir'
+    if stat.S_ISREG(st.st_mode):
+        return 'file'
+    if stat.S_ISLNK(st.st_mode):
+        return 'link'
+    return 'other'
+
+
+class Walker(object):
+    '''
+    Walk directory trees on a pool of threads. Names are filtered before
+    anything is stat'ed, and check(path, st) is only called for entries of
+    the wanted type whose name matches; it returns the result or None.
+    '''
+
+    def __init__(self, check, patterns, file_type, recurse, hidden, follow,
+                 max_depth=None, limit=None, threads=1):
+        self.check = check
+        self.patterns = patterns
+        self.wanted = {'file': 'file', 'directory': 'dir'}[file_type]
+        self.recurse = recurse
+        self.hidden = hidden
+        self.follow = follow
+        self.max_depth = max_depth
+        self.limit = limit
+        self.threads = max(1, threads)
+
+        self.cond = threading.Condition()
+        self.queue = []
+        self.pending = 0
+        self.done = False
+        self.visited = set()
+
+        self.results = []
+        self.examined = 0
+        self.msg = ''
+
+    def skipped(self, path):
+        self.cond.acquire()
+        try:
+            self.msg += "%s was skipped as it does not seem to be a valid file or it cannot be accessed\n" % path
+        finally:
+            self.cond.release()
+
+    def found(self, result):
+        self.cond.acquire()
+        try:
+            if self.done:
+                return
+            self.results.append(result)
+            if self.limit and len(self.results) >= self.limit:
+                self.done = True
+                self.cond.notifyAll()
+        finally:
+            self.cond.release()
+
+    def push(self, path, depth):
+        if self.follow:
+            # following links can lead back to a directory already walked
+            try:
+                st = os.stat(path)
+            except OSError:
+                self.skipped(path)
+                return
+            key = (st.st_dev, st.st_ino)
+        self.cond.acquire()
+        try:
+            if self.follow:
+                if key in self.visited:
+                    return
+                self.visited.add(key)
+            self.queue.append((path, depth))
+            self.pending += 1
+            self.cond.notify()
+        finally:
+            self.cond.release()
+
+    def visit(self, root, depth):
+        try:
+            entries = list_dir(root)
+        except OSError:
+            self.skipped(root)
+            return
+
+        self.cond.acquire()
+        self.examined += len(entries)
+        self.cond.release()
+
+        descend = self.recurse and (self.max_depth is None or depth < self.max_depth)
+        for (name, kind) in entries:
+            if self.done:
+                return
+            if name.startswith('.') and not self.hidden:
+                continue
+
+            fsname = os.path.normpath(os.path.join(root, name))
+            st = None
+            is_link = False
+            try:
+                if kind is None:
+                    st = os.lstat(fsname)
+                    kind = stat_kind(st)
+                if kind == 'link':
+                    # links are matched against what they point to
+                    is_link = True
+                    st = os.stat(fsname)
+                    kind = stat_kind(st)
+            except OSError:
+                self.skipped(fsname)
+                continue
+
+            if kind == self.wanted and pfilter(name, self.patterns):
+                try:
+                    if st is None:
+                        st = os.stat(fsname)
+                except OSError:
+                    self.skipped(fsname)
+                    continue
+                try:
+                    result = self.check(fsname, st)
+                except (EnvironmentError, ValueError):
+                    # mmap.error isn't an IOError on python 2, and mmap
+                    # raises ValueError if the file shrank since fstat
+                    self.skipped(fsname)
+                    continue
+                if result is not None:
+                    self.found(result)
+
+            if kind == 'dir' and descend and (self.follow or not is_link):
+                self.push(fsname, depth + 1)
+
+    def work(self):
+        while True:
+            self.cond.acquire()
+            try:
+                while not self.queue and self.pending and not self.done:
+                    self.cond.wait()
+                if self.done or not self.pending:
+                    return
+                (path, depth) = self.queue.pop()
+            finally:
+                self.cond.release()
+
+            try:
+                self.visit(path, depth)
+            finally:
+                self.cond.acquire()
+                self.pending -= 1
+                if not self.pending:
+                    self.cond.notifyAll()
+                self.cond.release()
+
+    def run(self, paths):
+        for path in paths:
+            self.push(path, 1)
+
+        workers = []
+        for i in range(self.threads - 1):
+            t = threading.Thread(target=self.work)
+            t.setDaemon(True)
+            t.start()
+            workers.append(t)
+        self.work()
+        for t in workers:
+            t.join()
+
+        self.results.sort(key=lambda r: r['path'])
+        return self.results
+
+
 def main():
     module = AnsibleModule(
         argument_spec = dict(
@@ -266,14 +626,16 @@ def main():
             follow        = dict(default="False", type='bool'),
             get_checksum  = dict(default="False", type='bool'),
             use_regex     = dict(default="False", type='bool'),
+            max_depth     = dict(default=None, type='int'),
+            limit         = dict(default=None, type='int'),
+            threads       = dict(default=4, type='int'),
+            read_limit    = dict(default=None, type='int'),
         ),
         supports_check_mode=True,
     )
 
     params = module.params
 
-    filelist = []
-
     if params['age'] is None:
         age = None
     else:
@@ -296,51 +658,57 @@ def main():
         else:
             module.fail_json(size=params['size'], msg="failed to process size")
 
+    try:
+        patterns = compile_patterns(params['patterns'], params['use_regex'])
+    except re.error, e:
+        module.fail_json(patterns=params['patterns'], msg="failed to compile patterns: %s" % e)
+
+    try:
+        content = compile_content(params['contains'])
+    except re.error, e:
+        module.fail_json(contains=params['contains'], msg="failed to compile contains: %s" % e)
+
     now = time.time()
+
+    def check(fsname, st):
+        if not agefilter(st, now, age, params['age_stamp']):
+            return None
+
+        r = {'path': fsname}
+        if stat.S_ISREG(st.st_mode):
+            if not sizefilter(st, size):
+                return None
+            if content is not None:
+                # hash while searching, rather than reading the file again later
+                (found, checksum) = contentfilter(fsname, content, params['read_limit'], params['get_checksum'])
+                if not found:
+                    return None
+                if checksum:
+                    r['checksum'] = checksum
+
+        r.update(statinfo(st))
+        return r
+
+    ''' ignore followlinks for python version < 2.6 '''
+    walker = Walker(check, patterns, params['file_type'], params['recurse'],
+                    params['hidden'], params['follow'] and sys.version_info >= (2,6,0),
+                    max_depth=params['max_depth'], limit=params['limit'],
+                    threads=params['threads'])
+
     msg = ''
-    looked = 0
+    paths = []
     for npath in params['paths']:
         if os.path.isdir(npath):
-
-            ''' ignore followlinks for python version < 2.6 '''
-            for root,dirs,files in (sys.version_info < (2,6,0) and os.walk(npath)) or \
-                                    os.walk( npath, followlinks=params['follow']):
-                looked = looked + len(files) + len(dirs)
-                for fsobj in (files + dirs):
-                    fsname=os.path.normpath(os.path.join(root, fsobj))
-
-                    if os.path.basename(fsname).startswith('.') and not params['hidden']:
-                       continue
-
-                    try:
-                        st = os.stat(fsname)
-                    except:
-                        msg+="%s was skipped as it does not seem to be a valid file or it cannot be accessed\n" % fsname
-                        continue
-
-                    r = {'path': fsname}
-                    if stat.S_ISDIR(st.st_mode) and params['file_type'] == 'directory':
-                        if pfilter(fsobj, params['patterns'], params['use_regex']) and agefilter(st, now, age, params['age_stamp']):
-
-                            r.update(statinfo(st))
-                            filelist.append(r)
-
-                    elif stat.S_ISREG(st.st_mode) and params['file_type'] == 'file':
-                        if pfilter(fsobj, params['patterns'], params['use_regex']) and \
-                           agefilter(st, now, age, params['age_stamp']) and \
-                           sizefilter(st, size) and \
-                           contentfilter(fsname, params['contains']):
-
-                            r.update(statinfo(st))
-                            if params['get_checksum']:
-                                r['checksum'] = module.sha1(fsname)
-                            filelist.append(r)
-
-                if not params['recurse']:
-                    break
+            paths.append(npath)
         else:
             msg+="%s was skipped as it does not seem to be a valid directory or it cannot be accessed\n" % npath
 
+    filelist = walker.run(paths)
+    if params['get_checksum']:
+        checksum_files(filelist, params['threads'])
+    msg += walker.msg
+    looked = walker.examined
+
     matched = len(filelist)
     module.exit_json(files=filelist, changed=False, msg=msg, matched=matched, examined=looked)
 
@@ -118,6 +118,17 @@ options:
      description:
        - Create a backup file including the timestamp information so you can
          get the original file back if you somehow clobbered it incorrectly.
+  lines:
+    required: false
+    version_added: "2.1"
+    description:
+      - A list of rules to apply in one go instead of C(line)/C(regexp). Each rule is a
+        dictionary that may contain C(line), C(regexp), C(state), C(backrefs),
+        C(insertafter) and C(insertbefore), with the same meaning as the options of that
+        name, which also provide the defaults.
+      - The file is read once, every rule is matched against it as it was read (lines
+        added or replaced by one rule are not seen by the others), and it is written and
+        validated at most once. Lines inserted at the same place keep the order of the rules.
   others:
      description:
        - All arguments accepted by the M(file) module also work here.
@@ -145,6 +156,16 @@ EXAMPLES = r"""
 
 # Validate the sudoers file before saving
 - lineinfile: dest=/etc/sudoers state=present regexp='^%ADMIN ALL\=' line='%ADMIN ALL=(ALL) NOPASSWD:ALL' validate='visudo -cf %s'
+
+# Several settings at once, with a single rewrite and validation
+- lineinfile:
+    dest: /etc/ssh/sshd_config
+    validate: 'sshd -t -f %s'
+    lines:
+      - { regexp: '^PermitRootLogin ', line: 'PermitRootLogin no' }
+      - { regexp: '^PasswordAuthentication ', line: 'PasswordAuthentication no' }
+      - { regexp: '^X11Forwarding ', line: 'X11Forwarding no', insertafter: '^#X11Forwarding ' }
+      - { regexp: '^Protocol 1', state: absent }
 """
 
 def write_changes(module,lines,dest):
@@ -322,6 +343,176 @@ def absent(module, dest, regexp, line, backup):
     module.exit_json(changed=changed, found=len(found), msg=msg, backup=backupdest)
 
 
+RULE_KEYS = ('line', 'regexp', 'state', 'backrefs', 'insertafter', 'insertbefore')
+
+def compile_rules(module, rules):
+    '''
+    check the rules of a lines= batch, fill in the module level defaults
+    and compile their expressions
+    '''
+
+    params = module.params
+    compiled = []
+    for rule in rules:
+        if not isinstance(rule, dict):
+            module.fail_json(msg='every item of lines= must be a dictionary: %s' % rule)
+        unknown = [k for k in rule if k not in RULE_KEYS]
+        if unknown:
+            module.fail_json(msg='unsupported keys in lines= item: %s' % ', '.join(unknown))
+
+        r = dict(rule)
+        r.setdefault('state', params['state'])
+        r['backrefs'] = module.boolean(r.get('backrefs', params['backrefs']))
+        if 'insertafter' not in r and 'insertbefore' not in r:
+            r['insertafter'], r['insertbefore'] = params['insertafter'], params['insertbefore']
+        r.setdefault('insertafter', None)
+        r.setdefault('insertbefore', None)
+        r.setdefault('regexp', None)
+        r.setdefault('line', None)
+
+        if r['state'] not in ('present', 'absent'):
+            module.fail_json(msg='state must be present or absent in lines= item: %s' % rule)
+        if r['state'] == 'present':
+            if r['backrefs'] and r['regexp'] is None:
+                module.fail_json(msg='regexp= is required with backrefs=true: %s' % rule)
+            if r['line'] is None:
+                module.fail_json(msg='line= is required with state=present: %s' % rule)
+            if r['insertafter'] is not None and r['insertbefore'] is not None:
+                module.fail_json(msg='insertafter and insertbefore are mutually exclusive: %s' % rule)
+            if r['insertafter'] is None and r['insertbefore'] is None:
+                r['insertafter'] = 'EOF'
+        elif r['regexp'] is None and r['line'] is None:
+            module.fail_json(msg='one of line= or regexp= is required with state=absent: %s' % rule)
+
+        try:
+            r['mre'] = None
+            if r['regexp'] is not None:
+                r['mre'] = re.compile(r['regexp'])
+            r['insre'] = None
+            if r['state'] == 'present' and not r['backrefs']:
+                if r['insertafter'] not in (None, 'BOF', 'EOF'):
+                    r['insre'] = re.compile(r['insertafter'])
+                elif r['insertbefore'] not in (None, 'BOF'):
+                    r['insre'] = re.compile(r['insertbefore'])
+        except re.error, e:
+            module.fail_json(msg='invalid regular expression in lines= item %s: %s' % (rule, e))
+
+        r['index'] = -1
+        r['match'] = None
+        r['anchor'] = -1
+        r['removed'] = []
+        compiled.append(r)
+    return compiled
+
+def batch(module, dest, rules, create, backup):
+
+    rules = compile_rules(module, rules)
+    present_rules = [r for r in rules if r['state'] == 'present']
+
+    if not os.path.exists(dest):
+        if not present_rules:
+            module.exit_json(changed=False, msg="file not present")
+        if not create:
+            module.fail_json(rc=257, msg='Destination %s does not exist !' % dest)
+        destpath = os.path.dirname(dest)
+        if not os.path.exists(destpath) and not module.check_mode:
+            os.makedirs(destpath)
+        lines = []
+    else:
+        f = open(dest, 'rb')
+        lines = f.readlines()
+        f.close()
+
+    # one pass over the file, noting for every rule the last matching
+    # line and insert* anchor, and the lines it removes
+    for lineno, cur_line in enumerate(lines):
+        stripped = cur_line.rstrip('\r\n')
+        for r in rules:
+            if r['mre'] is not None:
+                match_found = r['mre'].search(cur_line)
+            else:
+                match_found = r['line'] == stripped
+            if match_found:
+                if r['state'] == 'absent':
+                    r['removed'].append(lineno)
+                else:
+                    r['index'] = lineno
+                    r['match'] = match_found
+            elif r['insre'] is not None and r['insre'].search(cur_line):
+                if r['insertafter']:
+                    r['anchor'] = lineno + 1
+                else:
+                    r['anchor'] = lineno
+
+    replaced = {}
+    removed = set()
+    inserts = {}
+    appended = []
+    for r in rules:
+        if r['state'] == 'absent':
+            removed.update(r['removed'])
+            continue
+
+        if r['index'] != -1:
+            if r['backrefs']:
+                new_line = r['match'].expand(r['line'])
+            else:
+                new_line = r['line']
+            if not new_line.endswith(os.linesep):
+                new_line += os.linesep
+            replaced[r['index']] = new_line
+        elif r['backrefs']:
+            # as with a single line, never generate a line without
+            # the regexp matching to populate the backrefs
+            pass
+        elif r['insertbefore'] == 'BOF' or r['insertafter'] == 'BOF':
+            inserts.setdefault(0, []).append(r['line'] + os.linesep)
+        elif r['insertafter'] == 'EOF' or r['anchor'] == -1:
+            appended.append(r['line'] + os.linesep)
+        else:
+            inserts.setdefault(r['anchor'], []).append(r['line'] + os.linesep)
+
+    added = len(appended)
+    replaced_count = 0
+    new_lines = []
+    for lineno, cur_line in enumerate(lines):
+        if lineno in inserts:
+            new_lines.extend(inserts[lineno])
+            added += len(inserts[lineno])
+        if lineno in removed:
+            continue
+        if lineno in replaced and replaced[lineno] != cur_line:
+            cur_line = replaced[lineno]
+            replaced_count += 1
+        new_lines.append(cur_line)
+    if len(lines) in inserts:
+        appended = inserts[len(lines)] + appended
+        added += len(inserts[len(lines)])
+    if appended:
+        # If the file is not empty then ensure there's a newline before the added lines
+        if len(new_lines)>0 and not (new_lines[-1].endswith('\n') or new_lines[-1].endswith('\r')):
+            new_lines.append(os.linesep)
+        new_lines.extend(appended)
+
+    changed = bool(added or replaced_count or removed)
+    msg = ''
+    if changed:
+        msg = '%s line(s) added, %s replaced, %s removed' % (added, replaced_count, len(removed))
+
+    backupdest = ""
+    if changed and not module.check_mode:
+        if backup and os.path.exists(dest):
+            backupdest = module.backup_local(dest)
+        write_changes(module, new_lines, dest)
+
+    if module.check_mode and not os.path.exists(dest):
+        module.exit_json(changed=changed, msg=msg, backup=backupdest)
+
+    msg, changed = check_file_attrs(module, changed, msg)
+    module.exit_json(changed=changed, msg=msg, backup=backupdest,
+                     added=added, replaced=replaced_count, removed=len(removed))
+
+
 def main():
     module = AnsibleModule(
         argument_spec=dict(
@@ -335,8 +526,9 @@ def main():
             create=dict(default=False, type='bool'),
             backup=dict(default=False, type='bool'),
             validate=dict(default=None, type='str'),
+            lines=dict(default=None, type='list'),
         ),
-        mutually_exclusive=[['insertbefore', 'insertafter']],
+        mutually_exclusive=[['insertbefore', 'insertafter'], ['lines', 'line'], ['lines', 'regexp']],
         add_file_common_args=True,
         supports_check_mode=True
     )
@@ -351,7 +543,9 @@ def main():
     if os.path.isdir(dest):
         module.fail_json(rc=256, msg='Destination %s is a directory !' % dest)
 
-    if params['state'] == 'present':
+    if params['lines'] is not None:
+        batch(module, dest, params['lines'], create, backup)
+    elif params['state'] == 'present':
         if backrefs and params['regexp'] is None:
             module.fail_json(msg='regexp= is required with backrefs=true')
 
@@ -63,6 +63,17 @@ options:
     description:
       - Create a backup file including the timestamp information so you can
         get the original file back if you somehow clobbered it incorrectly.
+  stream:
+    required: false
+    default: "no"
+    choices: [ "yes", "no" ]
+    version_added: "2.1"
+    description:
+      - Process the file a few lines at a time instead of reading it into memory,
+        writing the result to a temporary file next to it. For large files.
+      - A match must then lie within a single line (and its newline); C(\\A) and
+        C(\\Z) match at the start and end of every chunk of lines.
+      - In check mode, stops at the first change.
   others:
     description:
       - All arguments accepted by the M(file) module also work here.
@@ -75,8 +86,13 @@ EXAMPLES = r"""
 - replace: dest=/home/jdoe/.ssh/known_hosts regexp='^old\.host\.name[^\n]*\n' owner=jdoe group=jdoe mode=644
 
 - replace: dest=/etc/apache/ports regexp='^(NameVirtualHost|Listen)\s+80\s*$' replace='\1 127.0.0.1:8080' validate='/usr/sbin/apache2ctl -f %s -t'
+
+- replace: dest=/srv/data/export.csv regexp='^(\d+),N/A,' replace='\1,,' stream=yes
 """
 
+# lines are read this many bytes at a time with stream=yes
+STREAM_CHUNK = 1024 * 1024
+
 def write_changes(module,contents,dest):
 
     tmpfd, tmpfile = tempfile.mkstemp()
@@ -84,18 +100,81 @@ def write_changes(module,contents,dest):
     f.write(contents)
     f.close()
 
+    install_changes(module, tmpfile, dest)
+
+def discard_changes(tmpfile):
+    if os.path.exists(tmpfile):
+        os.remove(tmpfile)
+
+def install_changes(module,tmpfile,dest):
+
     validate = module.params.get('validate', None)
     valid = not validate
-    if validate:
-        if "%s" not in validate:
-            module.fail_json(msg="validate must contain %%s: %s" % (validate))
-        (rc, out, err) = module.run_command(validate % tmpfile)
-        valid = rc == 0
-        if rc != 0:
-            module.fail_json(msg='failed to validate: '
-                                 'rc:%s error:%s' % (rc,err))
-    if valid:
-        module.atomic_move(tmpfile, dest)
+    try:
+        if validate:
+            if "%s" not in validate:
+                discard_changes(tmpfile)
+                module.fail_json(msg="validate must contain %%s: %s" % (validate))
+            (rc, out, err) = module.run_command(validate % tmpfile)
+            valid = rc == 0
+            if rc != 0:
+                # it may sit in an include dir next to dest, don't leave it there
+                discard_changes(tmpfile)
+                module.fail_json(msg='failed to validate: '
+                                     'rc:%s error:%s' % (rc,err))
+        if valid:
+            module.atomic_move(tmpfile, dest)
+    except Exception:
+        discard_changes(tmpfile)
+        raise
+
+def stream_changes(module, mre, replace, dest):
+    '''
+    substitute a chunk of whole lines at a time into a temporary file
+    next to dest. Returns (replacements, tmpfile); tmpfile is None if
+    nothing changed or in check mode, where we stop at the first change.
+    '''
+
+    out = None
+    tmpfile = None
+    if not module.check_mode:
+        # dotted, so that include dirs like /etc/sudoers.d skip it
+        tmpfd, tmpfile = tempfile.mkstemp(prefix='.%s.' % os.path.basename(dest),
+                suffix='.ansible_tmp', dir=os.path.dirname(os.path.realpath(dest)))
+        out = os.fdopen(tmpfd, 'wb')
+
+    count = 0
+    changed = False
+    try:
+        f = open(dest, 'rb')
+        try:
+            while True:
+                chunk = ''.join(f.readlines(STREAM_CHUNK))
+                if not chunk:
+                    break
+                (new_chunk, n) = mre.subn(replace, chunk)
+                count += n
+                if n and new_chunk != chunk:
+                    changed = True
+                    if out is None:
+                        break
+                if out is not None:
+                    out.write(new_chunk)
+        finally:
+            f.close()
+            if out is not None:
+                out.close()
+    except:
+        if tmpfile is not None:
+            os.remove(tmpfile)
+        raise
+
+    if not changed:
+        # leave the original alone
+        if tmpfile is not None:
+            os.remove(tmpfile)
+        return (0, None)
+    return (count, tmpfile)
 
 def check_file_attrs(module, changed, message):
 
@@ -117,6 +196,7 @@ def main():
             replace=dict(default='', type='str'),
             backup=dict(default=False, type='bool'),
             validate=dict(default=None, type='str'),
+            stream=dict(default=False, type='bool'),
         ),
         add_file_common_args=True,
         supports_check_mode=True
@@ -130,12 +210,34 @@ def main():
 
     if not os.path.exists(dest):
         module.fail_json(rc=257, msg='Destination %s does not exist !' % dest)
-    else:
-        f = open(dest, 'rb')
-        contents = f.read()
-        f.close()
 
     mre = re.compile(params['regexp'], re.MULTILINE)
+
+    if params['stream']:
+        (count, tmpfile) = stream_changes(module, mre, params['replace'], dest)
+        changed = count > 0
+        msg = ''
+        if changed and module.check_mode:
+            msg = 'at least %s replacements made' % count
+        elif changed:
+            msg = '%s replacements made' % count
+            if params['backup']:
+                try:
+                    module.backup_local(dest)
+                except:
+                    discard_changes(tmpfile)
+                    raise
+            if params['follow'] and os.path.islink(dest):
+                dest = os.path.realpath(dest)
+            install_changes(module, tmpfile, dest)
+
+        msg, changed = check_file_attrs(module, changed, msg)
+        module.exit_json(changed=changed, msg=msg)
+
+    f = open(dest, 'rb')
+    contents = f.read()
+    f.close()
+
     result = re.subn(mre, params['replace'], contents, 0)
 
     if result[1] > 0 and contents != result[0]:
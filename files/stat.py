@@ -25,9 +25,24 @@ options:
   path:
     description:
       - The full path of the file/object to get the facts of
-    required: true
+      - Either this or C(paths) is required.
+    required: false
     default: null
     aliases: []
+  paths:
+    description:
+      - A list of paths or shell globs to get the facts of in one go. The results are
+        returned in C(stats), a dictionary keyed by path. Globs that match nothing are left out,
+        plain paths that don't exist have C(exists=False).
+    required: false
+    default: null
+    version_added: "2.1"
+  threads:
+    description:
+      - With C(paths), the number of files looked at concurrently.
+    required: false
+    default: 8
+    version_added: "2.1"
   follow:
     description:
       - Whether to follow symlinks
@@ -55,6 +70,14 @@ options:
     default: sha1
     aliases: [ 'checksum_algo' ]
     version_added: "2.0"
+  checksum_cache:
+    description:
+      - Cache the checksums in the C(user.ansible.checksum) extended attribute of the file,
+        so they are only computed again once its mtime, size or inode change. Needs a
+        filesystem with user xattrs and write access to the file.
+    required: false
+    default: no
+    version_added: "2.1"
 author: "Bruce Pennypacker (@bpennypacker)"
 '''
 
@@ -95,9 +118,23 @@ EXAMPLES = '''
 
 # Use sha256 to calculate checksum
 - stat: path=/path/to/something checksum_algorithm=sha256
+
+# Only hash a large artifact again when it has changed
+- stat: path=/srv/images/base.qcow2 checksum_cache=yes
+
+# Check all the configuration files of a service at once
+- stat: paths=/etc/httpd/conf/httpd.conf,/etc/httpd/conf.d/*.conf get_md5=no
+  register: confs
+- fail: msg="{{ item.key }} is world writable"
+  when: item.value.woth
+  with_dict: confs.stats
 '''
 
 RETURN = '''
+stats:
+    description: dictionary of the stat data of each path, as in C(stat), when C(paths) is used
+    returned: success, with paths
+    type: dictionary
 stat:
     description: dictionary containing all the stat data
     returned: success
@@ -285,25 +322,172 @@ import sys
 from stat import *
 import pwd
 import grp
+import glob
+import threading
 
-def main():
-    module = AnsibleModule(
-        argument_spec = dict(
-            path = dict(required=True),
-            follow = dict(default='no', type='bool'),
-            get_md5 = dict(default='yes', type='bool'),
-            get_checksum = dict(default='yes', type='bool'),
-            checksum_algorithm = dict(default='sha1', type='str', choices=['sha1', 'sha224', 'sha256', 'sha384', 'sha512'], aliases=['checksum_algo'])
-        ),
-        supports_check_mode = True
-    )
+def digest_file(path, algorithms, bufsize=1024*1024):
+    '''
+    returns {algorithm: hexdigest} for path, reading it only once.
+    Algorithms the host can't use (md5 on FIPS-140 systems) map to None.
+    '''
 
-    path = module.params.get('path')
-    path = os.path.expanduser(path)
-    follow = module.params.get('follow')
-    get_md5 = module.params.get('get_md5')
-    get_checksum = module.params.get('get_checksum')
-    checksum_algorithm = module.params.get('checksum_algorithm')
+    digests = {}
+    for algorithm in algorithms:
+        try:
+            digests[algorithm] = AVAILABLE_HASH_ALGORITHMS[algorithm]()
+        except (KeyError, ValueError):
+            digests[algorithm] = None
+
+    f = open(path, 'rb')
+    try:
+        block = f.read(bufsize)
+        while block:
+            for digest in digests.values():
+                if digest is not None:
+                    digest.update(block)
+            block = f.read(bufsize)
+    finally:
+        f.close()
+
+    result = {}
+    for (algorithm, digest) in digests.items():
+        if digest is not None:
+            digest = digest.hexdigest()
+        result[algorithm] = digest
+    return result
+
+# checksums are cached in this attribute along with the mtime, size and
+# inode of the file they were computed for, a mismatch invalidates them
+CHECKSUM_XATTR = 'user.ansible.checksum'
+
+def checksum_cache_key(st):
+    mtime_ns = getattr(st, 'st_mtime_ns', None)
+    if mtime_ns is None:
+        mtime_ns = int(st.st_mtime * 1000000000)
+    return '%d:%d:%d' % (mtime_ns, st.st_size, st.st_ino)
+
+def read_checksum_cache(module, path, st):
+    '''returns the cached {algorithm: hexdigest} still valid for st'''
+
+    value = None
+    try:
+        if hasattr(os, 'getxattr'):
+            value = os.getxattr(path, CHECKSUM_XATTR).decode('ascii')
+        else:
+            getfattr = module.get_bin_path('getfattr')
+            if getfattr:
+                (rc, out, err) = module.run_command([getfattr, '--absolute-names', '--only-values',
+                                                     '-n', CHECKSUM_XATTR, path])
+                if rc == 0:
+                    value = out
+    except (IOError, OSError):
+        pass
+    if not value:
+        return {}
+
+    fields = value.strip().split()
+    if not fields or fields[0] != checksum_cache_key(st):
+        return {}
+    return dict(field.split('=', 1) for field in fields[1:] if '=' in field)
+
+def write_checksum_cache(module, path, st, digests):
+    '''
+    store digests, which include whatever was cached already, for the file
+    st describes, failures are ignored
+    '''
+
+    cached = dict((k, v) for (k, v) in digests.items() if v)
+    value = ' '.join([checksum_cache_key(st)] + ['%s=%s' % item for item in sorted(cached.items())])
+    try:
+        if hasattr(os, 'setxattr'):
+            os.setxattr(path, CHECKSUM_XATTR, value.encode('ascii'))
+        else:
+            setfattr = module.get_bin_path('setfattr')
+            if setfattr:
+                module.run_command([setfattr, '-n', CHECKSUM_XATTR, '-v', value, path])
+    except (IOError, OSError):
+        pass
+
+def cached_digest_file(module, path, algorithms, use_cache=False):
+    '''digest_file, answered from the xattr cache when use_cache is set'''
+
+    if not use_cache:
+        return digest_file(path, algorithms)
+
+    st = os.stat(path)
+    digests = read_checksum_cache(module, path, st)
+    missing = [a for a in algorithms if a not in digests]
+    if missing:
+        digests.update(digest_file(path, missing))
+        write_checksum_cache(module, path, st, digests)
+    return dict((a, digests.get(a)) for a in algorithms)
+
+# user and group names are looked up once per id
+_pw_names = {}
+_gr_names = {}
+
+def owner_names(uid, gid):
+    if uid not in _pw_names:
+        try:
+            _pw_names[uid] = pwd.getpwuid(uid).pw_name
+        except KeyError:
+            _pw_names[uid] = None
+    if gid not in _gr_names:
+        try:
+            _gr_names[gid] = grp.getgrgid(gid).gr_name
+        except KeyError:
+            _gr_names[gid] = None
+    return (_pw_names[uid], _gr_names[gid])
+
+def run_threads(func, items, threads):
+    '''call func on every item, from up to threads threads'''
+
+    items = list(items)
+    lock = threading.Lock()
+
+    def work():
+        while True:
+            lock.acquire()
+            try:
+                if not items:
+                    return
+                item = items.pop()
+            finally:
+                lock.release()
+            func(item)
+
+    workers = []
+    for i in range(min(threads, len(items)) - 1):
+        t = threading.Thread(target=work)
+        t.setDaemon(True)
+        t.start()
+        workers.append(t)
+    work()
+    for t in workers:
+        t.join()
+
+def expand_paths(paths):
+    '''expand the globs in paths, keeping their order and dropping duplicates'''
+
+    result = []
+    seen = set()
+    for path in paths:
+        path = os.path.expanduser(path)
+        if glob.has_magic(path):
+            matches = sorted(glob.glob(path))
+        else:
+            matches = [path]
+        for match in matches:
+            if match not in seen:
+                seen.add(match)
+                result.append(match)
+    return result
+
+def stat_path(path, follow):
+    '''
+    returns (st, d) with the stat data of path, st is None if it doesn't exist
+    raises OSError for other failures
+    '''
 
     try:
         if follow:
@@ -312,10 +496,8 @@ def main():
             st = os.lstat(path)
     except OSError, e:
         if e.errno == errno.ENOENT:
-            d = { 'exists' : False }
-            module.exit_json(changed=False, stat=d)
-
-        module.fail_json(msg = e.strerror)
+            return (None, { 'exists' : False })
+        raise
 
     mode = st.st_mode
 
@@ -356,28 +538,102 @@ def main():
     if S_ISLNK(mode):
         d['lnk_source'] = os.path.realpath(path)
 
-    if S_ISREG(mode) and get_md5 and os.access(path,os.R_OK):
-        # Will fail on FIPS-140 compliant systems
+    (pw_name, gr_name) = owner_names(st.st_uid, st.st_gid)
+    if pw_name is not None:
+        d['pw_name']   = pw_name
+        if gr_name is not None:
+            d['gr_name'] = gr_name
+
+    return (st, d)
+
+def main():
+    module = AnsibleModule(
+        argument_spec = dict(
+            path = dict(default=None),
+            paths = dict(default=None, type='list'),
+            threads = dict(default=8, type='int'),
+            follow = dict(default='no', type='bool'),
+            get_md5 = dict(default='yes', type='bool'),
+            get_checksum = dict(default='yes', type='bool'),
+            checksum_algorithm = dict(default='sha1', type='str', choices=['sha1', 'sha224', 'sha256', 'sha384', 'sha512'], aliases=['checksum_algo']),
+            checksum_cache = dict(default='no', type='bool'),
+        ),
+        required_one_of = [['path', 'paths']],
+        mutually_exclusive = [['path', 'paths']],
+        supports_check_mode = True
+    )
+
+    follow = module.params.get('follow')
+    get_md5 = module.params.get('get_md5')
+    get_checksum = module.params.get('get_checksum')
+    checksum_algorithm = module.params.get('checksum_algorithm')
+    checksum_cache = module.params.get('checksum_cache')
+    threads = max(1, module.params.get('threads'))
+
+    if module.params.get('paths') is None:
+        paths = [os.path.expanduser(module.params.get('path'))]
+    else:
+        paths = expand_paths(module.params.get('paths'))
+
+    stats = {}
+    failures = {}
+    def collect(path):
         try:
-            d['md5']       = module.md5(path)
-        except ValueError:
-            d['md5']       = None
+            stats[path] = stat_path(path, follow)
+        except OSError, e:
+            failures[path] = e.strerror
 
-    if S_ISREG(mode) and get_checksum and os.access(path,os.R_OK):
-        d['checksum']      = module.digest_from_file(path, checksum_algorithm)
+    run_threads(collect, paths, threads)
+    if failures:
+        if len(paths) == 1:
+            module.fail_json(msg = failures[paths[0]])
+        module.fail_json(msg = "Could not stat %s" % ', '.join(sorted(failures)), failures = failures)
 
-    try:
-        pw = pwd.getpwuid(st.st_uid)
+    algorithms = []
+    if get_md5:
+        algorithms.append('md5')
+    if get_checksum:
+        algorithms.append(checksum_algorithm)
 
-        d['pw_name']   = pw.pw_name
+    # hard links to the same file are only hashed once
+    inodes = {}
+    if algorithms:
+        for path in paths:
+            (st, d) = stats[path]
+            if st is not None and S_ISREG(st.st_mode) and os.access(path,os.R_OK):
+                inodes.setdefault((st.st_dev, st.st_ino), path)
 
-        grp_info = grp.getgrgid(st.st_gid)
-        d['gr_name'] = grp_info.gr_name
-    except:
-        pass
+    digests = {}
+    hash_failures = {}
+    def hash_inode(inode):
+        path = inodes[inode]
+        try:
+            digests[inode] = cached_digest_file(module, path, algorithms, checksum_cache)
+        except IOError, e:
+            hash_failures[path] = str(e)
+
+    run_threads(hash_inode, inodes, threads)
+    if hash_failures:
+        module.fail_json(msg="Could not hash file %s" % ', '.join(sorted(hash_failures)), failures = hash_failures)
 
+    results = {}
+    for path in paths:
+        (st, d) = stats[path]
+        if st is not None and (st.st_dev, st.st_ino) in digests:
+            file_digests = digests[(st.st_dev, st.st_ino)]
+            if get_md5:
+                # Will be None on FIPS-140 compliant systems
+                d['md5']       = file_digests['md5']
+            if get_checksum:
+                if file_digests[checksum_algorithm] is None:
+                    module.fail_json(msg="Could not hash file '%s' with algorithm '%s'. Available algorithms: %s" %
+                                     (path, checksum_algorithm, ', '.join(AVAILABLE_HASH_ALGORITHMS)))
+                d['checksum']      = file_digests[checksum_algorithm]
+        results[path] = d
 
-    module.exit_json(changed=False, stat=d)
+    if module.params.get('paths') is None:
+        module.exit_json(changed=False, stat=results[paths[0]])
+    module.exit_json(changed=False, stats=results)
 
 # import module snippets
 from ansible.module_utils.basic import *
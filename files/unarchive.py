@@ -59,17 +59,38 @@ options:
     choices: [ "yes", "no" ]
     default: "no"
     version_added: "2.0"
+  stream:
+    description:
+      - If set to True and I(src) is a URL of a tar archive, pipe the download straight into
+        tar instead of saving it first. The archive is always unpacked then, it is only
+        reported as changed if C(dest) didn't already match what the same archive unpacked
+        before.
+      - Needs GNU tar, the archive is downloaded first otherwise. A .zip archive is always
+        downloaded first.
+    required: false
+    choices: [ "yes", "no" ]
+    default: "no"
+    version_added: "2.1"
 author: "Dylan Martin (@pileofrogs)"
 todo:
-    - detect changed/unchanged for .zip files
     - handle common unarchive args, like preserve owner/timestamp etc...
 notes:
     - requires C(tar)/C(unzip) command on target host
     - can handle I(gzip), I(bzip2) and I(xz) compressed as well as uncompressed tar files
-    - detects type of archive automatically
-    - uses tar's C(--diff arg) to calculate if changed or not. If this C(arg) is not
-      supported, it will always unpack the archive
-    - does not detect if a .zip file is different from destination - always unzips
+    - with GNU tar, decompresses with C(pigz), C(lbzip2)/C(pbzip2) or C(xz -T0) when they are
+      installed
+    - when only some of the files in a tar or .zip archive differ from C(dest), only those are
+      written. The members of a .zip archive are unpacked in parallel (needs python 2.6)
+    - detects type of archive automatically from its first bytes
+    - after unpacking, a manifest with the checksum of the archive and the size, mtime
+      and mode of everything unpacked is kept in C(.<dest name>.ansible_unarchive) next to
+      C(dest). Unpacking the same archive again only checks C(dest) against it. An
+      archive whose size, mtime and inode are the ones recorded in the manifest is not
+      read again to compute its checksum.
+    - without a manifest, uses tar's C(--diff arg) to calculate if changed or not. If this
+      C(arg) is not supported, it will always unpack the archive
+    - without a manifest, a .zip file is considered unpacked when every file in it exists
+      in the destination with the same size and modification time
     - existing files/directories in the destination which are not in the archive
       are not touched.  This is the same behavior as a normal archive extraction
     - existing files/directories in the destination which are not in the archive
@@ -85,12 +106,27 @@ EXAMPLES = '''
 
 # Unarchive a file that needs to be downloaded (added in 2.0)
 - unarchive: src=https://example.com/example.zip dest=/usr/local/bin copy=no
+
+# Unpack a large tarball while it downloads
+- unarchive: src=https://example.com/dataset.tar.gz dest=/srv/data copy=no stream=yes
 '''
 
 import re
 import os
+import shutil
+import stat
+import subprocess
+import tarfile
+import tempfile
+import threading
+import time
 from zipfile import ZipFile
 
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
 # String from tar that shows the tar contents are different from the
 # filesystem
 DIFFERENCE_RE = re.compile(r': (.*) differs$')
@@ -98,9 +134,180 @@ DIFFERENCE_RE = re.compile(r': (.*) differs$')
 # saving to a tempfile (64k)
 BUFSIZE = 65536
 
+# archive formats by the bytes they start with, tar has its magic at 257
+MAGIC = (
+    ('\x1f\x8b', 'gz'),
+    ('BZh', 'bz2'),
+    ('\xfd7zXZ\x00', 'xz'),
+    ('PK\x03\x04', 'zip'),
+    ('PK\x05\x06', 'zip'),
+)
+TAR_MAGIC_OFFSET = 257
+MANIFEST_SUFFIX = '.ansible_unarchive'
+# manifests of this many archives are kept per dest
+MANIFEST_ENTRIES = 16
+# multi-threaded programs GNU tar can decompress with, by compression flag,
+# xz itself is used with -T0 when it supports threads
+PARALLEL_DECOMPRESSORS = {
+    'z': ('pigz',),
+    'j': ('lbzip2', 'pbzip2'),
+}
+# members of a .zip archive unpacked at once
+ZIP_THREADS = 4
+
 class UnarchiveError(Exception):
     pass
 
+def detect_format(src):
+    ''' returns gz, bz2, xz, zip or tar, from the first bytes of src, or None '''
+    f = open(src, 'rb')
+    try:
+        head = f.read(TAR_MAGIC_OFFSET + 5)
+    finally:
+        f.close()
+    return format_of(head)
+
+def format_of(head):
+    for (magic, fmt) in MAGIC:
+        if head.startswith(magic):
+            return fmt
+    if head[TAR_MAGIC_OFFSET:TAR_MAGIC_OFFSET + 5] == 'ustar':
+        return 'tar'
+    return None
+
+def manifest_path(dest):
+    dest = dest.rstrip(os.sep) or os.sep
+    return os.path.join(os.path.dirname(dest), '.%s%s' % (os.path.basename(dest), MANIFEST_SUFFIX))
+
+def read_manifest(dest):
+    try:
+        f = open(manifest_path(dest))
+        try:
+            return json.loads(f.read())
+        finally:
+            f.close()
+    except (IOError, ValueError):
+        return {}
+
+def archive_key(path):
+    ''' mtime (ns), size and inode of the archive at path, as the manifest records them '''
+    st = os.stat(path)
+    mtime_ns = getattr(st, 'st_mtime_ns', None)
+    if mtime_ns is None:
+        mtime_ns = int(st.st_mtime * 1000000000)
+    return '%d:%d:%d' % (mtime_ns, st.st_size, st.st_ino)
+
+def manifest_checksum(manifest, archive):
+    ''' the checksum recorded for the archive with key archive, None if there is none '''
+    for (checksum, entry) in manifest.items():
+        if entry.get('archive') == archive:
+            return checksum
+    return None
+
+def write_manifest(dest, checksum, members, archive=None):
+    '''
+    remember members as unpacked from the archive with checksum, and the
+    archive_key() of the archive when there is one, failures are ignored
+    '''
+    manifest = read_manifest(dest)
+    manifest[checksum] = dict(written=time.time(), members=members)
+    if archive is not None:
+        manifest[checksum]['archive'] = archive
+    for old in sorted(manifest, key=lambda k: manifest[k].get('written', 0))[:-MANIFEST_ENTRIES]:
+        del manifest[old]
+
+    path = manifest_path(dest)
+    try:
+        fd, tmp = tempfile.mkstemp(prefix=os.path.basename(path), dir=os.path.dirname(path))
+        f = os.fdopen(fd, 'w')
+        try:
+            f.write(json.dumps(manifest))
+        finally:
+            f.close()
+        os.rename(tmp, path)
+    except (IOError, OSError):
+        pass
+
+def stat_member(path):
+    ''' [type, size, mtime, mode] of path as the manifest records it, None if missing '''
+    try:
+        st = os.lstat(path)
+    except OSError:
+        return None
+    if stat.S_ISDIR(st.st_mode):
+        # the mtime of a directory changes with its contents
+        return ['d', 0, 0, stat.S_IMODE(st.st_mode)]
+    if stat.S_ISLNK(st.st_mode):
+        return ['l', 0, int(st.st_mtime), 0]
+    return ['f', st.st_size, int(st.st_mtime), stat.S_IMODE(st.st_mode)]
+
+def snapshot_members(dest, names):
+    members = {}
+    for name in names:
+        members[name] = stat_member(os.path.join(dest, name))
+    return members
+
+def matches_manifest(dest, members, mode):
+    '''
+    whether everything in members is still in dest as it was unpacked,
+    the mode is ignored if it is going to be set anyway
+    '''
+    for (name, recorded) in members.items():
+        if recorded is None:
+            continue
+        current = stat_member(os.path.join(dest, name))
+        if current is None:
+            return False
+        if mode is not None:
+            current[3] = recorded[3]
+        if current != recorded:
+            return False
+    return True
+
+def parallel_decompressor(module, zipflag):
+    ''' the program for tar --use-compress-program, or None '''
+    for name in PARALLEL_DECOMPRESSORS.get(zipflag, ()):
+        path = module.get_bin_path(name)
+        if path:
+            return path
+    if zipflag == 'J':
+        path = module.get_bin_path('xz')
+        if path:
+            rc, out, err = module.run_command([path, '--help'])
+            if rc == 0 and '--threads' in out:
+                return '%s -T0' % path
+    return None
+
+def makedirs(path):
+    try:
+        os.makedirs(path)
+    except OSError, e:
+        # another thread may have created it
+        if e.errno != errno.EEXIST or not os.path.isdir(path):
+            raise
+
+def tar_member_differs(path, member, umask, as_root):
+    ''' whether extracting member would change path '''
+    try:
+        st = os.lstat(path)
+    except OSError:
+        return True
+    if member.isdir():
+        return not stat.S_ISDIR(st.st_mode)
+    if member.issym():
+        return not stat.S_ISLNK(st.st_mode) or os.readlink(path) != member.linkname
+    if not member.isfile() or not stat.S_ISREG(st.st_mode):
+        return True
+    if st.st_size != member.size or int(st.st_mtime) != int(member.mtime):
+        return True
+    # tar only restores the owner and the whole mode as root
+    mode = stat.S_IMODE(member.mode)
+    if not as_root:
+        mode &= ~umask
+    if stat.S_IMODE(st.st_mode) != mode:
+        return True
+    return as_root and (st.st_uid, st.st_gid) != (member.uid, member.gid)
+
 # class to handle .zip files
 class ZipArchive(object):
 
@@ -116,21 +323,174 @@ class ZipArchive(object):
         if self._files_in_archive and not force_refresh:
             return self._files_in_archive
 
-        archive = ZipFile(self.src)
         try:
-            self._files_in_archive = archive.namelist()
+            archive = ZipFile(self.src)
+            try:
+                self._infolist = archive.infolist()
+            finally:
+                archive.close()
         except:
             raise UnarchiveError('Unable to list files in the archive')
+        self._files_in_archive = [info.filename for info in self._infolist]
 
         return self._files_in_archive
 
+    def differs(self, info):
+        # unzip restores size and mtime (local time, 2 second resolution)
+        try:
+            st = os.lstat(os.path.join(self.dest, info.filename))
+        except OSError:
+            return True
+        if info.filename.endswith('/'):
+            return not stat.S_ISDIR(st.st_mode)
+        if stat.S_ISLNK(info.external_attr >> 16):
+            # the size of a link is the length of its target
+            return not stat.S_ISLNK(st.st_mode) or st.st_size != info.file_size
+        mtime = time.mktime(info.date_time + (0, 0, -1))
+        return st.st_size != info.file_size or abs(st.st_mtime - mtime) > 2
+
     def is_unarchived(self, mode, owner, group):
-        return dict(unarchived=False)
+        self.files_in_archive
+        for info in self._infolist:
+            if not info.filename.endswith('/') and self.differs(info):
+                return dict(unarchived=False)
+        return dict(unarchived=True)
 
     def unarchive(self):
-        cmd = '%s -o "%s" -d "%s"' % (self.cmd_path, self.src, self.dest)
-        rc, out, err = self.module.run_command(cmd)
-        return dict(cmd=cmd, rc=rc, out=out, err=err)
+        if not hasattr(ZipFile, 'open'):
+            # zipfile can only read whole members into memory before 2.6
+            cmd = '%s -o "%s" -d "%s"' % (self.cmd_path, self.src, self.dest)
+            rc, out, err = self.module.run_command(cmd)
+            return dict(cmd=cmd, rc=rc, out=out, err=err)
+
+        self.files_in_archive
+        pending = []
+        for info in self._infolist:
+            parts = info.filename.split('/')
+            if info.filename.startswith('/') or '..' in parts:
+                return dict(rc=1, out='', err='refusing to unpack %s outside of dest' % info.filename)
+            if self.differs(info):
+                pending.append(info)
+
+        errors = []
+        lock = threading.Lock()
+        umask = os.umask(0)
+        os.umask(umask)
+
+        def worker():
+            archive = ZipFile(self.src)
+            try:
+                while True:
+                    lock.acquire()
+                    try:
+                        if not pending or errors:
+                            return
+                        info = pending.pop()
+                    finally:
+                        lock.release()
+                    try:
+                        self.extract(archive, info, umask)
+                    except Exception, e:
+                        # encrypted or corrupt members raise zipfile's
+                        # own errors, which must not end the thread quietly
+                        lock.acquire()
+                        errors.append('%s: %s' % (info.filename, e))
+                        lock.release()
+            finally:
+                archive.close()
+
+        extracted = len(pending)
+        # directories first, the workers only ever create parents. links
+        # last, so that no member can be written through one of them
+        links = []
+        for info in pending[:]:
+            if info.filename.endswith('/'):
+                try:
+                    makedirs(self.member_path(info))
+                except (OSError, UnarchiveError), e:
+                    return dict(rc=1, out='', err='%s: %s' % (info.filename, e))
+                pending.remove(info)
+            elif stat.S_ISLNK(info.external_attr >> 16):
+                links.append(info)
+                pending.remove(info)
+        pending.reverse()
+        threads = []
+        for i in range(min(ZIP_THREADS, len(pending))):
+            t = threading.Thread(target=worker)
+            t.start()
+            threads.append(t)
+        for t in threads:
+            t.join()
+
+        if not errors and links:
+            archive = ZipFile(self.src)
+            try:
+                for info in links:
+                    try:
+                        self.extract(archive, info, umask)
+                    except Exception, e:
+                        errors.append('%s: %s' % (info.filename, e))
+            finally:
+                archive.close()
+
+        if errors:
+            return dict(rc=1, out='', err='\n'.join(errors))
+        return dict(rc=0, out='', err='', extracted=extracted)
+
+    def member_path(self, info):
+        ''' the path of info in dest, refusing to go through a symlink or out of dest '''
+        dest = os.path.realpath(self.dest)
+        path = os.path.join(dest, info.filename)
+        parent = os.path.dirname(path.rstrip('/'))
+        current = parent
+        while len(current) > len(dest):
+            try:
+                if stat.S_ISLNK(os.lstat(current).st_mode):
+                    raise UnarchiveError('refusing to unpack through the symlink %s' % current)
+            except OSError:
+                # not created yet
+                pass
+            current = os.path.dirname(current)
+        real = os.path.realpath(parent)
+        if real != dest and not real.startswith(dest + os.sep):
+            raise UnarchiveError('refusing to unpack %s outside of dest' % info.filename)
+        return path
+
+    def extract(self, archive, info, umask):
+        path = self.member_path(info)
+        parent = os.path.dirname(path)
+        makedirs(parent)
+        # the unix mode, if the archive was made on unix
+        mode = info.external_attr >> 16
+        if stat.S_ISLNK(mode):
+            target = archive.read(info.filename)
+            if os.path.lexists(path):
+                os.unlink(path)
+            os.symlink(target, path)
+            return
+
+        # unpacked next to path and renamed, so path is never half written
+        fd, tmp = tempfile.mkstemp(prefix='.%s.' % os.path.basename(path), dir=parent)
+        try:
+            out = os.fdopen(fd, 'wb')
+            try:
+                member = archive.open(info)
+                try:
+                    shutil.copyfileobj(member, out, BUFSIZE)
+                finally:
+                    member.close()
+            finally:
+                out.close()
+            if stat.S_IMODE(mode):
+                os.chmod(tmp, stat.S_IMODE(mode) & ~(stat.S_ISUID | stat.S_ISGID))
+            else:
+                os.chmod(tmp, 0666 & ~umask)
+            mtime = time.mktime(info.date_time + (0, 0, -1))
+            os.utime(tmp, (mtime, mtime))
+            os.rename(tmp, path)
+        except:
+            os.unlink(tmp)
+            raise
 
     def can_handle_archive(self):
         if not self.cmd_path:
@@ -156,13 +516,35 @@ class TgzArchive(object):
             self.cmd_path = self.module.get_bin_path('tar')
         self.zipflag = 'z'
         self._files_in_archive = []
+        self._members = {}
+        self._gnu_tar = None
+        self._compress_program = None
+
+    # tarfile modes for the compression flags, xz needs the tar command
+    tarfile_modes = {'': 'r:', 'z': 'r:gz', 'j': 'r:bz2'}
 
     @property
     def files_in_archive(self, force_refresh=False):
         if self._files_in_archive and not force_refresh:
             return self._files_in_archive
 
-        cmd = '%s -t%sf "%s"' % (self.cmd_path, self.zipflag, self.src)
+        if self.zipflag in self.tarfile_modes:
+            try:
+                archive = tarfile.open(self.src, self.tarfile_modes[self.zipflag])
+                try:
+                    for member in archive:
+                        self._files_in_archive.append(member.name)
+                        self._members[member.name] = member
+                finally:
+                    archive.close()
+                return self._files_in_archive
+            except (tarfile.TarError, IOError, EOFError):
+                # extensions tarfile can't read (some GNU/pax headers on
+                # older pythons) may still be fine for the tar command
+                self._files_in_archive = []
+                self._members = {}
+
+        cmd = self.tar_command('t', self.src)
         rc, out, err = self.module.run_command(cmd)
         if rc != 0:
             raise UnarchiveError('Unable to list files in the archive')
@@ -203,10 +585,68 @@ class TgzArchive(object):
                 unarchived = True
         return dict(unarchived=unarchived, rc=rc, out=out, err=err, cmd=cmd)
 
+    def is_gnu_tar(self):
+        if self._gnu_tar is None:
+            rc, out, err = self.module.run_command([self.cmd_path, '--version'])
+            self._gnu_tar = (rc == 0 and 'GNU tar' in out)
+        return self._gnu_tar
+
+    def compress_program(self):
+        if self._compress_program is None:
+            self._compress_program = ''
+            if self.zipflag and self.is_gnu_tar():
+                self._compress_program = parallel_decompressor(self.module, self.zipflag) or ''
+        return self._compress_program
+
+    def tar_command(self, flags, archive):
+        program = self.compress_program()
+        if program:
+            return '%s --use-compress-program="%s" -%sf "%s"' % (self.cmd_path, program, flags, archive)
+        return '%s -%s%sf "%s"' % (self.cmd_path, flags, self.zipflag, archive)
+
+    def changed_members(self):
+        ''' the names of the members that differ from dest, None to unpack everything '''
+        if not self.is_gnu_tar():
+            return None
+        try:
+            self.files_in_archive
+        except UnarchiveError:
+            return None
+        if not self._members:
+            return None
+        umask = os.umask(0)
+        os.umask(umask)
+        as_root = (os.geteuid() == 0)
+        changed = []
+        for (name, member) in self._members.items():
+            if '\n' in name or name.startswith('-'):
+                # can't be passed to tar -T as is
+                return None
+            if tar_member_differs(os.path.join(self.dest, name), member, umask, as_root):
+                changed.append(name)
+        if not changed or len(changed) == len(self._members):
+            return None
+        return sorted(changed)
+
     def unarchive(self):
-        cmd = '%s -x%sf "%s"' % (self.cmd_path, self.zipflag, self.src)
-        rc, out, err = self.module.run_command(cmd, cwd=self.dest)
-        return dict(cmd=cmd, rc=rc, out=out, err=err)
+        cmd = self.tar_command('x', self.src)
+        changed = self.changed_members()
+        if changed is None:
+            rc, out, err = self.module.run_command(cmd, cwd=self.dest)
+            return dict(cmd=cmd, rc=rc, out=out, err=err)
+
+        fd, names = tempfile.mkstemp()
+        try:
+            f = os.fdopen(fd, 'w')
+            try:
+                f.write('\n'.join(changed) + '\n')
+            finally:
+                f.close()
+            cmd += ' --no-recursion -T "%s"' % names
+            rc, out, err = self.module.run_command(cmd, cwd=self.dest)
+        finally:
+            os.unlink(names)
+        return dict(cmd=cmd, rc=rc, out=out, err=err, extracted=len(changed))
 
     def can_handle_archive(self):
         if not self.cmd_path:
@@ -243,8 +683,18 @@ class TarXzArchive(TgzArchive):
         self.zipflag = 'J'
 
 
-# try handlers in order and return the one that works or bail if none work
+TAR_HANDLERS = {'gz': TgzArchive, 'tar': TarArchive, 'bz2': TarBzipArchive, 'xz': TarXzArchive}
+
+# pick the handler for the format of src, or try handlers in order and
+# return the one that works or bail if none work
 def pick_handler(src, dest, module):
+    handlers = dict(TAR_HANDLERS, zip=ZipArchive)
+    fmt = detect_format(src)
+    if fmt is not None:
+        obj = handlers[fmt](src, dest, module)
+        if obj.cmd_path:
+            return obj
+
     handlers = [TgzArchive, ZipArchive, TarArchive, TarBzipArchive, TarXzArchive]
     for handler in handlers:
         obj = handler(src, dest, module)
@@ -252,6 +702,99 @@ def pick_handler(src, dest, module):
             return obj
     module.fail_json(msg='Failed to find handler for "%s". Make sure the required command to extract the file is installed.' % src)
 
+def stream_unarchive(module, url, dest, file_args):
+    '''
+    unpack the tar archive at url into dest while it downloads, returns
+    (handler, checksum, res_args), or None if it has to be downloaded first
+    '''
+    try:
+        rsp, info = fetch_url(module, url)
+        if info['status'] != 200:
+            module.fail_json(msg="Failure downloading %s, %s" % (url, info['msg']))
+        head = rsp.read(BUFSIZE)
+    except Exception, e:
+        module.fail_json(msg="Failure downloading %s, %s" % (url, e))
+    handler_class = TAR_HANDLERS.get(format_of(head))
+    if handler_class is None:
+        return None
+    handler = handler_class(url, dest, module)
+    if not handler.cmd_path or not handler.is_gnu_tar():
+        return None
+
+    # the archives dest still matches, if this is one of them nothing changes
+    unpacked = []
+    for (checksum, entry) in read_manifest(dest).items():
+        if matches_manifest(dest, entry['members'], file_args['mode']):
+            unpacked.append(checksum)
+
+    # GNU tar lists what it unpacks on stdout, which goes to a file so that
+    # neither pipe can fill up while the archive is written to tar
+    cmd = handler.tar_command('xv', '-')
+    digest = AVAILABLE_HASH_ALGORITHMS['sha1']()
+    out = tempfile.TemporaryFile()
+    err = tempfile.TemporaryFile()
+    try:
+        proc = subprocess.Popen(cmd, shell=True, cwd=dest, stdin=subprocess.PIPE, stdout=out, stderr=err)
+        try:
+            try:
+                while head:
+                    digest.update(head)
+                    proc.stdin.write(head)
+                    head = rsp.read(BUFSIZE)
+            except IOError, e:
+                # tar exited early, its own error says why
+                if e.errno != errno.EPIPE:
+                    raise
+        finally:
+            proc.stdin.close()
+            rc = proc.wait()
+        out.seek(0)
+        err.seek(0)
+        extract_results = dict(cmd=cmd, rc=rc, out=out.read(), err=err.read())
+    finally:
+        out.close()
+        err.close()
+
+    res_args = dict(handler=handler.__class__.__name__, dest=dest, src=url,
+                    extract_results=extract_results)
+    if rc != 0 or head:
+        module.fail_json(msg="failed to unpack %s to %s" % (url, dest), **res_args)
+
+    names = []
+    for line in extract_results['out'].splitlines():
+        name = line.rstrip('/')
+        if name:
+            names.append(name)
+    handler._files_in_archive = names
+    checksum = digest.hexdigest()
+    res_args['changed'] = checksum not in unpacked
+    res_args['check_results'] = dict(unarchived=not res_args['changed'])
+    return (handler, checksum, res_args)
+
+def finish(module, handler, checksum, res_args, file_args, from_manifest, archive=None):
+    dest = res_args['dest']
+
+    try:
+        files_in_archive = handler.files_in_archive
+    except UnarchiveError, e:
+        module.fail_json(msg="Unable to list the files unpacked from %s: %s" % (res_args['src'], str(e)), **res_args)
+
+    # do we need to change perms?
+    for filename in files_in_archive:
+        file_args['path'] = os.path.join(dest, filename)
+        try:
+            res_args['changed'] = module.set_fs_attributes_if_different(file_args, res_args['changed'])
+        except (IOError, OSError), e:
+            module.fail_json(msg="Unexpected error when accessing exploded file: %s" % str(e))
+
+    if res_args['changed'] or not from_manifest:
+        write_manifest(dest, checksum, snapshot_members(dest, files_in_archive), archive)
+
+    if module.params['list_files']:
+        res_args['files'] = files_in_archive
+
+    module.exit_json(**res_args)
+
 
 def main():
     module = AnsibleModule(
@@ -263,6 +806,7 @@ def main():
             copy              = dict(default=True, type='bool'),
             creates           = dict(required=False),
             list_files          = dict(required=False, default=False, type='bool'),
+            stream            = dict(required=False, default=False, type='bool'),
         ),
         add_file_common_args=True,
     )
@@ -272,6 +816,17 @@ def main():
     copy   = module.params['copy']
     file_args = module.load_file_common_arguments(module.params)
 
+    # is dest OK to receive tar file?
+    if not os.path.isdir(dest):
+        module.fail_json(msg="Destination '%s' is not a directory" % dest)
+
+    streamed = None
+    if not copy and '://' in src and module.params['stream'] and not os.path.exists(src):
+        streamed = stream_unarchive(module, src, dest, file_args)
+    if streamed:
+        (handler, checksum, res_args) = streamed
+        finish(module, handler, checksum, res_args, file_args, False)
+
     # did tar file arrive?
     if not os.path.exists(src):
         if copy:
@@ -307,17 +862,26 @@ def main():
     except Exception, e:
         module.fail_json(msg="Source '%s' not readable" % src)
 
-    # is dest OK to receive tar file?
-    if not os.path.isdir(dest):
-        module.fail_json(msg="Destination '%s' is not a directory" % dest)
-
     handler = pick_handler(src, dest, module)
 
     res_args = dict(handler=handler.__class__.__name__, dest=dest, src=src)
 
-    # do we need to do unpack?
-    res_args['check_results'] = handler.is_unarchived(file_args['mode'],
-            file_args['owner'], file_args['group'])
+    # do we need to do unpack? if this archive was unpacked here before,
+    # looking at dest is enough. An archive that wasn't touched since is
+    # found by its stat, only a changed or new one is read for the checksum
+    manifest = read_manifest(dest)
+    archive = archive_key(src)
+    checksum = manifest_checksum(manifest, archive)
+    if checksum is None:
+        checksum = module.sha1(src)
+    unpacked = manifest.get(checksum)
+    from_manifest = bool(unpacked) and matches_manifest(dest, unpacked['members'], file_args['mode'])
+    if from_manifest:
+        res_args['check_results'] = dict(unarchived=True, manifest=manifest_path(dest))
+        handler._files_in_archive = sorted(unpacked['members'])
+    else:
+        res_args['check_results'] = handler.is_unarchived(file_args['mode'],
+                file_args['owner'], file_args['group'])
     if res_args['check_results']['unarchived']:
         res_args['changed'] = False
     else:
@@ -331,18 +895,9 @@ def main():
         else:
             res_args['changed'] = True
 
-    # do we need to change perms?
-    for filename in handler.files_in_archive:
-        file_args['path'] = os.path.join(dest, filename)
-        try:
-            res_args['changed'] = module.set_fs_attributes_if_different(file_args, res_args['changed'])
-        except (IOError, OSError), e:
-            module.fail_json(msg="Unexpected error when accessing exploded file: %s" % str(e))
-
-    if module.params['list_files']:
-        res_args['files'] = handler.files_in_archive
-
-    module.exit_json(**res_args)
+    # the manifest is written again unless it already records this archive
+    finish(module, handler, checksum, res_args, file_args,
+           from_manifest and unpacked.get('archive') == archive, archive)
 
 # import module snippets
 from ansible.module_utils.basic import *
@@ -94,6 +94,16 @@ options:
        - Path to a .deb package on the remote machine.
      required: false
      version_added: "1.6"
+  package_index:
+    description:
+      - Path of a file used to keep the installed and candidate version of
+        every package between runs. When I(state=present) and every package
+        is already installed according to this index, the module returns
+        without building the apt cache. The index is rebuilt whenever
+        C(/var/lib/dpkg/status), the apt lists or the apt preferences change.
+    required: false
+    default: null
+    version_added: "2.1"
 requirements: [ python-apt, aptitude ]
 author: "Matthew Williams (@mgwilliams)"
 notes:
@@ -137,6 +147,9 @@ EXAMPLES = '''
 
 # Install the build dependencies for package "foo"
 - apt: pkg=foo state=build-dep
+
+# Skip building the apt cache when "foo" and "bar" are already installed
+- apt: name=foo,bar state=present package_index=/var/cache/apt/ansible-index.json
 '''
 
 RETURN = '''
@@ -168,9 +181,17 @@ import warnings
 warnings.filterwarnings('ignore', "apt API not stable yet", FutureWarning)
 
 import os
+import re
+import bisect
 import datetime
 import fnmatch
 import itertools
+import tempfile
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
 
 # APT related constants
 APT_ENV_VARS = dict(
@@ -184,6 +205,8 @@ APT_GET_ZERO = "\n0 upgraded, 0 newly installed"
 APTITUDE_ZERO = "\n0 packages upgraded, 0 newly installed"
 APT_LISTS_PATH = "/var/lib/apt/lists"
 APT_UPDATE_SUCCESS_STAMP_PATH = "/var/lib/apt/periodic/update-success-stamp"
+DPKG_STATUS_PATH = "/var/lib/dpkg/status"
+APT_PREFERENCES_PATHS = ("/etc/apt/preferences", "/etc/apt/preferences.d")
 
 HAS_PYTHON_APT = True
 try:
@@ -293,6 +316,85 @@ def package_status(m, pkgname, version, cache, state):
 
     return package_is_installed, package_is_upgradable, has_files
 
+def package_index_key(default_release):
+    # anything that can change an installed or candidate version
+    key = [default_release]
+    for path in (DPKG_STATUS_PATH, APT_LISTS_PATH) + APT_PREFERENCES_PATHS:
+        try:
+            key.append(os.stat(path).st_mtime)
+        except OSError:
+            key.append(None)
+    return key
+
+def read_package_index(path, key):
+    try:
+        f = open(path)
+        try:
+            data = json.loads(f.read())
+        finally:
+            f.close()
+    except (IOError, ValueError):
+        return None
+    if not isinstance(data, dict) or data.get('key') != key:
+        return None
+    return data.get('packages')
+
+def write_package_index(m, path, key, cache):
+    packages = {}
+    for pkg in cache:
+        try:
+            is_installed = pkg._pkg.current_state == apt_pkg.CURSTATE_INSTALLED
+            installed = pkg.installed
+            candidate = pkg.candidate
+        except AttributeError:
+            # python-apt too old for the version objects, don't index
+            return
+        installed_version = None
+        if is_installed and installed is not None:
+            installed_version = installed.version
+        candidate_version = arch = None
+        if candidate is not None:
+            candidate_version = candidate.version
+            arch = candidate.architecture
+        packages[pkg.name] = [installed_version, candidate_version, arch]
+
+    # the index only saves time, failing to write it is not an error
+    try:
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)))
+        try:
+            os.write(fd, json.dumps(dict(key=key, packages=packages)))
+        finally:
+            os.close(fd)
+        os.rename(tmp, path)
+    except (IOError, OSError):
+        pass
+
+def packages_satisfied(pkgspec, index):
+    # True when every spec is installed according to the index.  Wildcards
+    # and virtual packages need the real cache to be answered.
+    for package in pkgspec:
+        if frozenset('*?[]!').intersection(package):
+            return False
+        name, version = package_split(package)
+        entry = index.get(name)
+        if not entry or entry[0] is None:
+            return False
+        if version and entry[0] != version:
+            return False
+    return True
+
+def get_cache_mtime():
+    try:
+        return os.stat(APT_UPDATE_SUCCESS_STAMP_PATH).st_mtime
+    except:
+        # Looks like the update-success-stamp is not available
+        # Fallback: Checking the mtime of the lists
+        try:
+            return os.stat(APT_LISTS_PATH).st_mtime
+        except:
+            # No mtime could be read. We update the cache to be safe
+            return False
+
 def expand_dpkg_options(dpkg_options_compressed):
     options_list = dpkg_options_compressed.split(',')
     dpkg_options = ""
@@ -301,6 +403,44 @@ def expand_dpkg_options(dpkg_options_compressed):
                        % (dpkg_options, dpkg_option)
     return dpkg_options.strip()
 
+# sorted package names per cache, built once per run
+_pkg_names = {}
+
+def sorted_package_names(cache, multiarch):
+    # handle multiarch pkgnames, the idea is that "apt*" should
+    # only select native packages. But "apt*:i386" should still work
+    if id(cache) not in _pkg_names:
+        all_names = [pkg.name for pkg in cache]
+        all_names.sort()
+        native_names = [name for name in all_names if not ':' in name]
+        _pkg_names[id(cache)] = (native_names, all_names)
+    return _pkg_names[id(cache)][multiarch]
+
+def match_pkgname_patterns(patterns, cache):
+    # returns {pattern: [matching names]}.  Patterns with a literal prefix
+    # (like "php5-*") only look at the slice of the sorted names sharing
+    # it, the others are all matched in a single pass over the names.
+    matches = {}
+    unprefixed = {}
+    for pattern in patterns:
+        names = sorted_package_names(cache, ':' in pattern)
+        matcher = re.compile(fnmatch.translate(pattern)).match
+        prefix = re.split(r'[*?[]', pattern, 1)[0]
+        if prefix:
+            lo = bisect.bisect_left(names, prefix)
+            hi = bisect.bisect_left(names, prefix[:-1] + chr(ord(prefix[-1]) + 1), lo)
+            matches[pattern] = [name for name in names[lo:hi] if matcher(name)]
+        else:
+            unprefixed.setdefault(id(names), (names, []))[1].append((pattern, matcher))
+            matches[pattern] = []
+
+    for names, matchers in unprefixed.values():
+        for name in names:
+            for pattern, matcher in matchers:
+                if matcher(name):
+                    matches[pattern].append(name)
+    return matches
+
 def expand_pkgspec_from_fnmatches(m, pkgspec, cache):
     # Note: apt-get does implicit regex matching when an exact package name
     # match is not found.  Something like this:
@@ -310,25 +450,22 @@ def expand_pkgspec_from_fnmatches(m, pkgspec, cache):
     # We have decided not to do similar implicit regex matching but might take
     # a PR to add some sort of explicit regex matching:
     # https://github.com/ansible/ansible-modules-core/issues/1258
+
+    # note that none of these chars is allowed in a (debian) pkgname
+    patterns = []
+    for pkgspec_pattern in pkgspec:
+        pkgname_pattern, version = package_split(pkgspec_pattern)
+        if frozenset('*?[]!').intersection(pkgname_pattern):
+            patterns.append(pkgname_pattern)
+    if patterns:
+        matched = match_pkgname_patterns(patterns, cache)
+
     new_pkgspec = []
     for pkgspec_pattern in pkgspec:
         pkgname_pattern, version = package_split(pkgspec_pattern)
 
-        # note that none of these chars is allowed in a (debian) pkgname
         if frozenset('*?[]!').intersection(pkgname_pattern):
-            # handle multiarch pkgnames, the idea is that "apt*" should
-            # only select native packages. But "apt*:i386" should still work
-            if not ":" in pkgname_pattern:
-                try:
-                    pkg_name_cache = _non_multiarch
-                except NameError:
-                    pkg_name_cache = _non_multiarch = [pkg.name for pkg in cache if not ':' in pkg.name]
-            else:
-                try:
-                    pkg_name_cache = _all_pkg_names
-                except NameError:
-                    pkg_name_cache = _all_pkg_names = [pkg.name for pkg in cache]
-            matches = fnmatch.filter(pkg_name_cache, pkgname_pattern)
+            matches = matched[pkgname_pattern]
 
             if len(matches) == 0:
                 m.fail_json(msg="No package(s) matching '%s' available" % str(pkgname_pattern))
@@ -555,7 +692,8 @@ def main():
             install_recommends = dict(default=None, aliases=['install-recommends'], type='bool'),
             force = dict(default='no', type='bool'),
             upgrade = dict(choices=['no', 'yes', 'safe', 'full', 'dist']),
-            dpkg_options = dict(default=DPKG_OPTIONS)
+            dpkg_options = dict(default=DPKG_OPTIONS),
+            package_index = dict(default=None),
         ),
         mutually_exclusive = [['package', 'upgrade', 'deb']],
         required_one_of = [['package', 'upgrade', 'update_cache', 'deb']],
@@ -596,6 +734,28 @@ def main():
     if p['state'] == 'removed':
         p['state'] = 'absent'
 
+    index_key = None
+    index = None
+    if p['package_index']:
+        p['package_index'] = os.path.expanduser(p['package_index'])
+        index_key = package_index_key(p['default_release'])
+        if p['package'] and p['state'] == 'present' and not p['upgrade'] and not p['deb']:
+            # answer a run that only has to confirm installed packages from
+            # the index, unless apt-get update is going to run first
+            cache_current = not p['update_cache']
+            if p['update_cache'] and p.get('cache_valid_time', False):
+                mtime = get_cache_mtime()
+                if mtime:
+                    tdelta = datetime.timedelta(seconds=p['cache_valid_time'])
+                    mtimestamp = datetime.datetime.fromtimestamp(mtime)
+                    if mtimestamp + tdelta >= datetime.datetime.now():
+                        cache_current = True
+                        updated_cache_time = int(time.mktime(mtimestamp.timetuple()))
+            if cache_current:
+                index = read_package_index(p['package_index'], index_key)
+                if index is not None and packages_satisfied(p['package'], index):
+                    module.exit_json(changed=False, cache_updated=False, cache_update_time=updated_cache_time)
+
     try:
         cache = apt.Cache()
         if p['default_release']:
@@ -611,16 +771,7 @@ def main():
             cache_valid = False
             now = datetime.datetime.now()
             if p.get('cache_valid_time', False):
-                try:
-                    mtime = os.stat(APT_UPDATE_SUCCESS_STAMP_PATH).st_mtime
-                except:
-                    # Looks like the update-success-stamp is not available
-                    # Fallback: Checking the mtime of the lists
-                    try:
-                        mtime = os.stat(APT_LISTS_PATH).st_mtime
-                    except:
-                        # No mtime could be read. We update the cache to be safe
-                        mtime = False
+                mtime = get_cache_mtime()
 
                 if mtime:
                     tdelta = datetime.timedelta(seconds=p['cache_valid_time'])
@@ -640,6 +791,13 @@ def main():
             updated_cache = False
             updated_cache_time = 0
 
+        if p['package_index'] and not module.check_mode:
+            key = package_index_key(p['default_release'])
+            if index is None or key != index_key:
+                index = read_package_index(p['package_index'], key)
+            if index is None:
+                write_package_index(module, p['package_index'], key, cache)
+
         force_yes = p['force']
 
         if p['upgrade']:
@@ -29,8 +29,15 @@ import rpm
 import platform
 import tempfile
 import shutil
+import time
+import fnmatch
 from distutils.version import LooseVersion
 
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
 try:
     from yum.misc import find_unfinished_transactions, find_ts_remaining
     from rpmUtils.miscutils import splitFilename
@@ -127,6 +134,16 @@ options:
     choices: ["yes", "no"]
     version_added: "2.1"
 
+  installed_cache:
+    description:
+      - Path of a file used to cache the list of installed packages between
+        runs. The cache is only used while the rpmdb is unchanged, so a run
+        where nothing was installed or removed since the last one doesn't
+        have to walk the rpmdb again.
+    required: false
+    default: null
+    version_added: "2.1"
+
 notes:
   - When used with a loop of package names in a playbook, ansible optimizes
     the call to the yum module.  Instead of calling the module with a single
@@ -149,6 +166,9 @@ notes:
     "@development-tools" and environment groups are "@^gnome-desktop-environment".
     Use the "yum group list" command to see which category of group the group
     you want to install falls into.'
+  - Package specs are resolved against the rpmdb in a single batched query
+    before falling back to per package provides lookups.  The time spent in
+    each phase (resolve, check_update, transaction) is returned in C(timing).
 # informational: requirements for nodes
 requirements: [ yum ]
 author:
@@ -189,8 +209,27 @@ EXAMPLES = '''
 BUFSIZE = 65536
 
 def_qf = "%{name}-%{version}-%{release}.%{arch}"
+batch_qf = "%{name}|%{epoch}|%{version}|%{release}|%{arch}"
+
+# files in %_dbpath whose change means the set of installed packages changed
+RPMDB_FILES = ('Packages', 'rpmdb.sqlite')
+
+# YumBase instances for this run, keyed on (conf_file, en_repos, dis_repos)
+_yum_bases = {}
+
+# installed package tuples for this run, keyed on the rpmdb stat
+_installed_pkgs = {}
 
-def yum_base(conf_file=None):
+def yum_base(conf_file=None, en_repos=None, dis_repos=None):
+
+    if en_repos is None:
+        en_repos = []
+    if dis_repos is None:
+        dis_repos = []
+
+    key = (conf_file, tuple(en_repos), tuple(dis_repos))
+    if key in _yum_bases:
+        return _yum_bases[key]
 
     my = yum.YumBase()
     my.preconf.debuglevel=0
@@ -204,9 +243,24 @@ def yum_base(conf_file=None):
             cachedir = yum.misc.getCacheDir()
             my.repos.setCacheDir(cachedir)
             my.conf.cache = 0
+    for rid in dis_repos:
+        my.repos.disableRepo(rid)
+    for rid in en_repos:
+        my.repos.enableRepo(rid)
 
+    _yum_bases[key] = my
     return my
 
+def reset_yum_bases():
+    """drop the YumBase instances of this run, their rpmdb is stale after a transaction"""
+
+    for my in _yum_bases.values():
+        try:
+            my.close()
+        except Exception:
+            pass
+    _yum_bases.clear()
+
 def ensure_yum_utils(module):
 
     repoquerybin = module.get_bin_path('repoquery', required=False)
@@ -235,12 +289,8 @@ def is_installed(module, repoq, pkgspec, conf_file, qf=def_qf, en_repos=None, di
 
         pkgs = []
         try:
-            my = yum_base(conf_file)
-            for rid in dis_repos:
-                my.repos.disableRepo(rid)
-            for rid in en_repos:
-                my.repos.enableRepo(rid)
-                
+            my = yum_base(conf_file, en_repos, dis_repos)
+
             e, m, u = my.rpmdb.matchPackageNames([pkgspec])
             pkgs = e + m
             if not pkgs:
@@ -278,11 +328,7 @@ def is_available(module, repoq, pkgspec, conf_file, qf=def_qf, en_repos=None, di
 
         pkgs = []
         try:
-            my = yum_base(conf_file)
-            for rid in dis_repos:
-                my.repos.disableRepo(rid)
-            for rid in en_repos:
-                my.repos.enableRepo(rid)
+            my = yum_base(conf_file, en_repos, dis_repos)
 
             e,m,u = my.pkgSack.matchPackageNames([pkgspec])
             pkgs = e + m
@@ -324,11 +370,7 @@ def is_update(module, repoq, pkgspec, conf_file, qf=def_qf, en_repos=None, dis_r
         updates = []
 
         try:
-            my = yum_base(conf_file)
-            for rid in dis_repos:
-                my.repos.disableRepo(rid)
-            for rid in en_repos:
-                my.repos.enableRepo(rid)
+            my = yum_base(conf_file, en_repos, dis_repos)
 
             pkgs = my.returnPackagesByDep(pkgspec) + my.returnInstalledPackagesByDep(pkgspec)
             if not pkgs:
@@ -372,11 +414,7 @@ def what_provides(module, repoq, req_spec, conf_file,  qf=def_qf, en_repos=None,
 
         pkgs = []
         try:
-            my = yum_base(conf_file)
-            for rid in dis_repos:
-                my.repos.disableRepo(rid)
-            for rid in en_repos:
-                my.repos.enableRepo(rid)
+            my = yum_base(conf_file, en_repos, dis_repos)
 
             pkgs = my.returnPackagesByDep(req_spec) + my.returnInstalledPackagesByDep(req_spec)
             if not pkgs:
@@ -414,6 +452,247 @@ def what_provides(module, repoq, req_spec, conf_file,  qf=def_qf, en_repos=None,
 
     return set()
 
+def pkg_name_forms(n, e, v, r, a):
+    """return every string yum accepts as a name for this package"""
+
+    return [n,
+            '%s.%s' % (n, a),
+            '%s-%s' % (n, v),
+            '%s-%s-%s' % (n, v, r),
+            '%s-%s-%s.%s' % (n, v, r, a),
+            '%s-%s:%s-%s.%s' % (n, e, v, r, a),
+            '%s:%s-%s-%s.%s' % (e, n, v, r, a)]
+
+def batch_installed(module, repoq, specs, conf_file, en_repos=None, dis_repos=None):
+    """
+    resolve many pkgspecs against the rpmdb in one query and return a
+    dict mapping each spec to the installed nevras it names.  Only name
+    matches are resolved here, specs missing from the result still need
+    the (per spec) provides checks.
+    """
+
+    if en_repos is None:
+        en_repos = []
+    if dis_repos is None:
+        dis_repos = []
+
+    specs = [ s for s in specs if s ]
+    if not specs:
+        return {}
+
+    if module.params.get('installed_cache'):
+        found = installed_packages(module, repoq, conf_file)
+    else:
+        found = query_installed(module, repoq, conf_file, specs, en_repos=en_repos, dis_repos=dis_repos)
+
+    return match_name_forms(found, specs)
+
+def match_name_forms(found, specs):
+    """
+    return a dict mapping each of specs to the nevras of the
+    (name, epoch, version, release, arch) tuples in found it names
+    """
+
+    # index every name form once, instead of testing each spec against each package
+    index = {}
+    for n, e, v, r, a in found:
+        nevra = '%s-%s-%s.%s' % (n, v, r, a)
+        for form in pkg_name_forms(n, e, v, r, a):
+            nevras = index.setdefault(form, [])
+            if nevra not in nevras:
+                nevras.append(nevra)
+
+    resolved = {}
+    for spec in specs:
+        if set(['*', '?', '[']).intersection(set(spec)):
+            nevras = []
+            for form in fnmatch.filter(index.keys(), spec):
+                for nevra in index[form]:
+                    if nevra not in nevras:
+                        nevras.append(nevra)
+        else:
+            nevras = index.get(spec, [])
+        if nevras:
+            resolved[spec] = nevras
+
+    return resolved
+
+def batch_available(module, repoq, specs, conf_file, en_repos=None, dis_repos=None):
+    """
+    resolve many pkgspecs against the enabled repos in one query and return
+    a dict mapping each spec to the available nevras it names.  Like
+    batch_installed only name matches are resolved, file and virtual
+    provides still need what_provides.
+    """
+
+    if en_repos is None:
+        en_repos = []
+    if dis_repos is None:
+        dis_repos = []
+
+    specs = [ s for s in specs if s ]
+    if not specs:
+        return {}
+
+    found = []
+    if not repoq:
+
+        try:
+            my = yum_base(conf_file, en_repos, dis_repos)
+
+            for po in my.pkgSack.returnPackages(patterns=specs):
+                found.append((po.name, po.epoch, po.version, po.release, po.arch))
+        except Exception, e:
+            module.fail_json(msg="Failure talking to yum: %s" % e)
+
+    else:
+        myrepoq = list(repoq)
+        r_cmd = ['--disablerepo', ','.join(dis_repos)]
+        myrepoq.extend(r_cmd)
+
+        r_cmd = ['--enablerepo', ','.join(en_repos)]
+        myrepoq.extend(r_cmd)
+
+        cmd = myrepoq + ["--qf", batch_qf] + specs
+        rc, out, err = module.run_command(cmd)
+        if rc != 0:
+            module.fail_json(msg='Error from repoquery: %s: %s' % (cmd, err))
+        for line in out.split('\n'):
+            fields = line.strip().split('|')
+            if len(fields) == 5:
+                found.append(tuple(fields))
+
+    return match_name_forms(found, specs)
+
+def batch_provided(module, repoq, specs, conf_file, en_repos=None, dis_repos=None):
+    """
+    return the subset of specs an installed package may provide.  With
+    repoquery one query covers all specs, its output can't be told apart
+    per spec so any match returns every spec for the per spec checks.
+    """
+
+    if en_repos is None:
+        en_repos = []
+    if dis_repos is None:
+        dis_repos = []
+
+    specs = [ s for s in specs if s ]
+    if not specs:
+        return set()
+
+    if not repoq:
+
+        provided = set()
+        try:
+            my = yum_base(conf_file, en_repos, dis_repos)
+
+            for spec in specs:
+                if my.returnInstalledPackagesByDep(spec):
+                    provided.add(spec)
+        except Exception, e:
+            module.fail_json(msg="Failure talking to yum: %s" % e)
+        return provided
+
+    cmd = repoq + ["--disablerepo=*", "--pkgnarrow=installed", "--qf", batch_qf, "--whatprovides"] + specs
+    rc, out, err = module.run_command(cmd)
+    if rc != 0:
+        module.fail_json(msg='Error from repoquery: %s: %s' % (cmd, err))
+    if out.strip():
+        return set(specs)
+    return set()
+
+def query_installed(module, repoq, conf_file, specs=None, en_repos=None, dis_repos=None):
+    """
+    return (name, epoch, version, release, arch) of the installed packages
+    matching specs by name, or of every installed package if specs is None
+    """
+
+    found = []
+    if not repoq:
+
+        try:
+            my = yum_base(conf_file, en_repos, dis_repos)
+
+            for po in my.rpmdb.returnPackages(patterns=specs):
+                found.append((po.name, po.epoch, po.version, po.release, po.arch))
+        except Exception, e:
+            module.fail_json(msg="Failure talking to yum: %s" % e)
+
+    else:
+
+        cmd = repoq + ["--disablerepo=*", "--pkgnarrow=installed", "--qf", batch_qf] + (specs or ['-a'])
+        rc, out, err = module.run_command(cmd)
+        if rc != 0:
+            module.fail_json(msg='Error from repoquery: %s: %s' % (cmd, err))
+        for line in out.split('\n'):
+            fields = line.strip().split('|')
+            if len(fields) == 5:
+                found.append(tuple(fields))
+
+    return found
+
+def rpmdb_stat():
+    """return [path, mtime, size] of the rpmdb, or None if it can't be found"""
+
+    dbpath = rpm.expandMacro('%_dbpath')
+    for name in RPMDB_FILES:
+        path = os.path.join(dbpath, name)
+        if os.path.exists(path):
+            st = os.stat(path)
+            return [path, st.st_mtime, st.st_size]
+    return None
+
+def installed_packages(module, repoq, conf_file):
+    """
+    return every installed package as a (name, epoch, version, release, arch)
+    tuple.  The list is kept in the installed_cache file, keyed on the stat
+    and checksum of the rpmdb, so an unchanged system skips the rpmdb walk.
+    """
+
+    key = rpmdb_stat()
+    if key is None:
+        return query_installed(module, repoq, conf_file)
+    if tuple(key) in _installed_pkgs:
+        return _installed_pkgs[tuple(key)]
+    stat_key = tuple(key)
+    key.append(module.sha1(key[0]))
+
+    cache_file = os.path.expanduser(module.params['installed_cache'])
+    pkgs = None
+    try:
+        f = open(cache_file)
+        try:
+            cached = json.loads(f.read())
+        finally:
+            f.close()
+        if cached.get('rpmdb') == key:
+            pkgs = [ tuple(p) for p in cached['packages'] ]
+    except (IOError, ValueError, KeyError, AttributeError):
+        pass
+
+    if pkgs is None:
+        pkgs = query_installed(module, repoq, conf_file)
+        if not module.check_mode:
+            # the cache only saves time, failing to write it is not an error
+            try:
+                fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(cache_file)))
+                try:
+                    os.write(fd, json.dumps(dict(rpmdb=key, packages=pkgs)))
+                finally:
+                    os.close(fd)
+                os.rename(tmp, cache_file)
+            except (IOError, OSError):
+                pass
+
+    _installed_pkgs[stat_key] = pkgs
+    return pkgs
+
+def record_phase(res, phase, started):
+    """store the wall clock time spent in a phase under res['timing']"""
+
+    res.setdefault('timing', {})[phase] = round(time.time() - started, 3)
+    return time.time()
+
 def transaction_exists(pkglist):
     """ 
     checks the package list to see if any packages are 
@@ -529,6 +808,26 @@ def install(module, items, repoq, yum_basecmd, conf_file, en_repos, dis_repos):
     res['rc'] = 0
     res['changed'] = False
     tempdir = tempfile.mkdtemp()
+    started = time.time()
+
+    # resolve every local rpm and plain pkgname against the rpmdb at once
+    # so the common "already installed" case doesn't cost a query per spec
+    local_nvras = {}
+    names = []
+    for spec in items:
+        if spec.endswith('.rpm') and '://' not in spec:
+            if not os.path.exists(spec):
+                res['msg'] += "No Package file matching '%s' found on system" % spec
+                module.fail_json(**res)
+            local_nvras[spec] = local_nvra(module, spec)
+            names.append(local_nvras[spec])
+        elif '://' not in spec and not spec.startswith('@') and not set(['*','?']).intersection(set(spec)):
+            names.append(spec)
+    installed = batch_installed(module, repoq, names, conf_file, en_repos=en_repos, dis_repos=dis_repos)
+    # and the pkgnames that aren't installed against the repos, also at once
+    missing = [ n for n in names if n not in installed and n not in local_nvras.values() ]
+    available = batch_available(module, repoq, missing, conf_file, en_repos=en_repos, dis_repos=dis_repos)
+    provided = batch_provided(module, repoq, missing, conf_file, en_repos=en_repos, dis_repos=dis_repos)
 
     for spec in items:
         pkg = None
@@ -537,13 +836,9 @@ def install(module, items, repoq, yum_basecmd, conf_file, en_repos, dis_repos):
         # localpkg
         if spec.endswith('.rpm') and '://' not in spec:
             # get the pkg name-v-r.arch
-            if not os.path.exists(spec):
-                res['msg'] += "No Package file matching '%s' found on system" % spec
-                module.fail_json(**res)
-
-            nvra = local_nvra(module, spec)
+            nvra = local_nvras[spec]
             # look for them in the rpmdb
-            if is_installed(module, repoq, nvra, conf_file, en_repos=en_repos, dis_repos=dis_repos):
+            if nvra in installed or is_installed(module, repoq, nvra, conf_file, en_repos=en_repos, dis_repos=dis_repos):
                 # if they are there, skip it
                 continue
             pkg = spec
@@ -579,12 +874,21 @@ def install(module, items, repoq, yum_basecmd, conf_file, en_repos, dis_repos):
             # most common case is the pkg is already installed and done
             # short circuit all the bs - and search for it as a pkg in is_installed
             # if you find it then we're done
-            if not set(['*','?']).intersection(set(spec)):
-                installed_pkgs = is_installed(module, repoq, spec, conf_file, en_repos=en_repos, dis_repos=dis_repos, is_pkg=True)
-                if installed_pkgs:
-                    res['results'].append('%s providing %s is already installed' % (installed_pkgs[0], spec))
-                    continue
+            if spec in installed:
+                res['results'].append('%s providing %s is already installed' % (installed[spec][0], spec))
+                continue
             
+            # a package name that is available and neither installed nor
+            # provided by an installed package: install it without looking
+            # at provides one spec at a time
+            if spec in available and spec not in provided:
+                conflicts = transaction_exists(available[spec])
+                if len(conflicts) > 0:
+                    res['msg'] += "The following packages have pending transactions: %s" % ", ".join(conflicts)
+                    module.fail_json(**res)
+                pkgs.append(spec)
+                continue
+
             # look up what pkgs provide this
             pkglist = what_provides(module, repoq, spec, conf_file, en_repos=en_repos, dis_repos=dis_repos)
             if not pkglist:
@@ -602,8 +906,9 @@ def install(module, items, repoq, yum_basecmd, conf_file, en_repos, dis_repos):
             # then nothing to do
 
             found = False
+            providers = batch_installed(module, repoq, list(pkglist), conf_file, en_repos=en_repos, dis_repos=dis_repos)
             for this in pkglist:
-                if is_installed(module, repoq, this, conf_file, en_repos=en_repos, dis_repos=dis_repos, is_pkg=True):
+                if this in providers:
                     found = True
                     res['results'].append('%s providing %s is already installed' % (this, spec))
                     break
@@ -628,6 +933,8 @@ def install(module, items, repoq, yum_basecmd, conf_file, en_repos, dis_repos):
 
         pkgs.append(pkg)
 
+    started = record_phase(res, 'resolve', started)
+
     if pkgs:
         cmd = yum_basecmd + ['install'] + pkgs
 
@@ -638,11 +945,13 @@ def install(module, items, repoq, yum_basecmd, conf_file, en_repos, dis_repos):
             except Exception, e:
                 module.fail_json(msg="Failure deleting temp directory %s, %s" % (tempdir, e))
 
-            module.exit_json(changed=True, results=res['results'], changes=dict(installed=pkgs))
+            module.exit_json(changed=True, results=res['results'], changes=dict(installed=pkgs), timing=res['timing'])
 
         changed = True
 
         rc, out, err = module.run_command(cmd)
+        reset_yum_bases()
+        started = record_phase(res, 'transaction', started)
 
         if (rc == 1):
             for spec in items:
@@ -688,6 +997,9 @@ def remove(module, items, repoq, yum_basecmd, conf_file, en_repos, dis_repos):
     res['msg'] = ''
     res['changed'] = False
     res['rc'] = 0
+    started = time.time()
+
+    installed = batch_installed(module, repoq, [ p for p in items if not p.startswith('@') ], conf_file, en_repos=en_repos, dis_repos=dis_repos)
 
     for pkg in items:
         is_group = False
@@ -695,20 +1007,24 @@ def remove(module, items, repoq, yum_basecmd, conf_file, en_repos, dis_repos):
         if pkg.startswith('@'):
             is_group = True
         else:
-            if not is_installed(module, repoq, pkg, conf_file, en_repos=en_repos, dis_repos=dis_repos):
+            if pkg not in installed and not is_installed(module, repoq, pkg, conf_file, en_repos=en_repos, dis_repos=dis_repos):
                 res['results'].append('%s is not installed' % pkg)
                 continue
 
         pkgs.append(pkg)
 
+    started = record_phase(res, 'resolve', started)
+
     if pkgs:
         # run an actual yum transaction
         cmd = yum_basecmd + ["remove"] + pkgs
 
         if module.check_mode:
-            module.exit_json(changed=True, results=res['results'], changes=dict(removed=pkgs))
+            module.exit_json(changed=True, results=res['results'], changes=dict(removed=pkgs), timing=res['timing'])
 
         rc, out, err = module.run_command(cmd)
+        reset_yum_bases()
+        started = record_phase(res, 'transaction', started)
 
         res['rc'] = rc
         res['results'].append(out)
@@ -747,6 +1063,7 @@ def latest(module, items, repoq, yum_basecmd, conf_file, en_repos, dis_repos):
     updates = {}
     update_all = False
     cmd = None
+    started = time.time()
 
     # determine if we're doing an update all
     if '*' in items:
@@ -754,6 +1071,7 @@ def latest(module, items, repoq, yum_basecmd, conf_file, en_repos, dis_repos):
 
     # run check-update to see if we have packages pending
     rc, out, err = module.run_command(yum_basecmd + ['check-update'])
+    started = record_phase(res, 'check_update', started)
     if rc == 0 and update_all:
         res['results'].append('Nothing to do here, all packages are up to date')
         return res
@@ -782,18 +1100,28 @@ def latest(module, items, repoq, yum_basecmd, conf_file, en_repos, dis_repos):
     else:
         will_update = set()
         will_update_from_other_package = dict()
+        # classify every pkgname as installed, available or provided by an
+        # installed package in three queries instead of several per spec
+        specs = [ s for s in items if not s.startswith('@') ]
+        installed = batch_installed(module, repoq, specs, conf_file, en_repos=en_repos, dis_repos=dis_repos)
+        available = batch_available(module, repoq, specs, conf_file, en_repos=en_repos, dis_repos=dis_repos)
+        provided = batch_provided(module, repoq, [ s for s in specs if s not in installed ], conf_file, en_repos=en_repos, dis_repos=dis_repos)
         for spec in items:
             # some guess work involved with groups. update @<group> will install the group if missing
             if spec.startswith('@'):
                 pkgs['update'].append(spec)
                 continue
+            # names resolved above need no per spec provides lookups
+            by_name = spec in installed or (spec in available and spec not in provided)
             # dep/pkgname  - find it
+            if spec in installed or (not by_name and is_installed(module, repoq, spec, conf_file, en_repos=en_repos, dis_repos=dis_repos)):
+                pkgs['update'].append(spec)
             else:
-                if is_installed(module, repoq, spec, conf_file, en_repos=en_repos, dis_repos=dis_repos):
-                    pkgs['update'].append(spec)
-                else:
-                    pkgs['install'].append(spec)
-            pkglist = what_provides(module, repoq, spec, conf_file, en_repos=en_repos, dis_repos=dis_repos)
+                pkgs['install'].append(spec)
+            if by_name:
+                pkglist = set(installed.get(spec, []) + available.get(spec, []))
+            else:
+                pkglist = what_provides(module, repoq, spec, conf_file, en_repos=en_repos, dis_repos=dis_repos)
             # FIXME..? may not be desirable to throw an exception here if a single package is missing
             if not pkglist:
                 res['msg'] += "No Package matching '%s' found available, installed or updated" % spec
@@ -801,9 +1129,14 @@ def latest(module, items, repoq, yum_basecmd, conf_file, en_repos, dis_repos):
 
             nothing_to_do = True
             for this in pkglist:
-                if spec in pkgs['install'] and is_available(module, repoq, this, conf_file, en_repos=en_repos, dis_repos=dis_repos):
-                    nothing_to_do = False
-                    break
+                if spec in pkgs['install']:
+                    if by_name:
+                        is_avail = this in available.get(spec, [])
+                    else:
+                        is_avail = is_available(module, repoq, this, conf_file, en_repos=en_repos, dis_repos=dis_repos)
+                    if is_avail:
+                        nothing_to_do = False
+                        break
 
                 # this contains the full NVR and spec could contain wildcards
                 # or virtual provides (like "python-*" or "smtp-daemon") while
@@ -830,6 +1163,8 @@ def latest(module, items, repoq, yum_basecmd, conf_file, en_repos, dis_repos):
                 res['msg'] += "The following packages have pending transactions: %s" % ", ".join(conflicts)
                 module.fail_json(**res)
 
+    started = record_phase(res, 'resolve', started)
+
     # check_mode output
     if module.check_mode:
         to_update = []
@@ -869,6 +1204,9 @@ def latest(module, items, repoq, yum_basecmd, conf_file, en_repos, dis_repos):
         else:
             rc2, out2, err2 = [0, '', '']
 
+    reset_yum_bases()
+    started = record_phase(res, 'transaction', started)
+
     if not update_all:
         rc += rc2
         out += out2
@@ -915,24 +1253,14 @@ def ensure(module, state, pkgs, conf_file, enablerepo, disablerepo,
         if module.params.get('update_cache'):
             module.run_command(yum_basecmd + ['makecache'])
 
-        my = yum_base(conf_file)
+        # this is the YumBase every later lookup of this run will reuse
         try:
-            if disablerepo:
-                my.repos.disableRepo(disablerepo)
-            current_repos = my.repos.repos.keys()
-            if enablerepo:
-                try:
-                    my.repos.enableRepo(enablerepo)
-                    new_repos = my.repos.repos.keys()
-                    for i in new_repos:
-                        if not i in current_repos:
-                            rid = my.repos.getRepo(i)
-                            a = rid.repoXML.repoid
-                    current_repos = new_repos
-                except yum.Errors.YumBaseError, e:
-                    module.fail_json(msg="Error setting/accessing repos: %s" % (e))
+            my = yum_base(conf_file, en_repos, dis_repos)
+            for rid in en_repos:
+                for repo in my.repos.findRepos(rid):
+                    a = repo.repoXML.repoid
         except yum.Errors.YumBaseError, e:
-            module.fail_json(msg="Error accessing repos: %s" % e)
+            module.fail_json(msg="Error setting/accessing repos: %s" % (e))
     if state in ['installed', 'present']:
         if disable_gpg_check:
             yum_basecmd.append('--nogpgcheck')
@@ -978,6 +1306,7 @@ def main():
             validate_certs=dict(required=False, defaults="yes", type='bool'),
             # this should not be needed, but exists as a failsafe
             install_repoquery=dict(required=False, default="yes", type='bool'),
+            installed_cache=dict(required=False, default=None),
         ),
         required_one_of = [['name','list']],
         mutually_exclusive = [['name','list']],
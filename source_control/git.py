@@ -77,6 +77,18 @@ options:
         version_added: "1.4"
         description:
             - Reference repository (see "git clone --reference ...")
+    cache_dir:
+        required: false
+        default: null
+        version_added: "2.1"
+        description:
+            - Directory to keep a shared bare mirror of I(repo) in. The mirror is
+              fetched first and then used as the reference repository of every
+              clone and fetch of that repo on the host, so checkouts of it into
+              many C(dest)s only download and store its objects once.
+              Mutually exclusive with I(reference).
+            - Nothing is ever pruned from the mirror, since the checkouts borrow
+              objects from it. It is repacked with C(git gc) once a week.
     remote:
         required: false
         default: "origin"
@@ -162,6 +174,14 @@ options:
               main project. This is equivalent to specifying the --remote flag
               to git submodule update.
 
+    jobs:
+        required: false
+        default: 4
+        version_added: "2.1"
+        description:
+            - How many submodules to fetch at once. With C(git) 2.9 or newer,
+              also how many to clone and check out at once.
+
     verify_commit:
         required: false
         default: "no"
@@ -200,10 +220,33 @@ EXAMPLES = '''
 
 # Example checkout a github repo and use refspec to fetch all pull requests
 - git: repo=https://github.com/ansible/ansible-examples.git dest=/src/ansible-examples refspec=+refs/pull/*:refs/heads/*
+
+# Example release per directory checkouts sharing their objects
+- git: repo=git://foosball.example.org/path/to/repo.git
+       dest=/srv/releases/{{ release }}
+       version={{ release }}
+       cache_dir=/var/cache/git
 '''
 
+import errno
+import fcntl
 import re
+import shutil
+import subprocess
 import tempfile
+import time
+
+# what ls-remote and the local branch and tag listings returned, so each
+# of them only runs once however many questions are asked about versions
+_ref_cache = {}
+
+# seconds between repacks of a cache_dir mirror
+MIRROR_GC_INTERVAL = 7 * 24 * 3600
+# no gc --auto after a fetch, and nothing pruned by any gc: checkouts
+# borrow objects that may no longer be reachable in the mirror
+MIRROR_CONFIG = (('gc.auto', '0'), ('gc.pruneExpire', 'never'))
+# git submodule update --jobs
+SUBMODULE_JOBS_VERSION = (2, 9)
 
 def get_submodule_update_params(module, git_path, cwd):
 
@@ -290,25 +333,152 @@ def get_version(module, git_path, dest, ref="HEAD"):
     sha = stdout.rstrip('\n')
     return sha
 
-def get_submodule_versions(git_path, module, dest, version='HEAD'):
-    cmd = [git_path, 'submodule', 'foreach', git_path, 'rev-parse', version]
+def get_git_version(git_path, module):
+    ''' the version of git as a tuple of ints, () if it can't be told '''
+    (rc, out, err) = module.run_command([git_path, '--version'])
+    match = re.search(r'(\d+)\.(\d+)', out)
+    if rc != 0 or not match:
+        return ()
+    return tuple([int(part) for part in match.groups()])
+
+def run_parallel(commands, jobs):
+    '''
+    Runs the {name: (cmd, cwd)} commands, up to jobs of them at once, and
+    returns {name: (rc, out, err)}. The output goes to temporary files, so
+    that no command blocks on a full pipe while another one is waited for.
+    '''
+    pending = sorted(commands.items())
+    running = []
+    results = {}
+    while pending or running:
+        while pending and len(running) < max(jobs, 1):
+            (name, (cmd, cwd)) = pending.pop(0)
+            out = tempfile.TemporaryFile()
+            err = tempfile.TemporaryFile()
+            try:
+                proc = subprocess.Popen(cmd, cwd=cwd, stdout=out, stderr=err)
+            except OSError, e:
+                out.close()
+                err.close()
+                results[name] = (127, '', str(e))
+                continue
+            running.append((name, proc, out, err))
+        if not running:
+            break
+
+        # reap whichever child finishes first, rather than polling them all
+        try:
+            (pid, status) = os.waitpid(-1, 0)
+        except OSError, e:
+            if e.errno == errno.EINTR:
+                continue
+            if e.errno != errno.ECHILD:
+                raise
+            # someone else reaped them, Popen can still tell how they ended
+            for (name, proc, out, err) in running:
+                proc.wait()
+            (pid, status) = (None, None)
+        for (name, proc, out, err) in running[:]:
+            if pid is None:
+                rc = proc.returncode
+            elif proc.pid != pid:
+                continue
+            elif os.WIFSIGNALED(status):
+                rc = -os.WTERMSIG(status)
+            else:
+                rc = os.WEXITSTATUS(status)
+            proc.returncode = rc
+            running.remove((name, proc, out, err))
+            out.seek(0)
+            err.seek(0)
+            results[name] = (rc, out.read(), err.read())
+            out.close()
+            err.close()
+    return results
+
+def get_submodule_paths(git_path, module, dest):
+    ''' the paths of the submodules listed in .gitmodules, as git submodule reads them '''
+    if not os.path.exists(os.path.join(dest, '.gitmodules')):
+        return []
+    cmd = [git_path, 'config', '-z', '-f', '.gitmodules', '--get-regexp', r'^submodule\..*\.path$']
     (rc, out, err) = module.run_command(cmd, cwd=dest)
+    # rc 1 means there is no path at all
+    if rc == 1:
+        return []
     if rc != 0:
-        module.fail_json(msg='Unable to determine hashes of submodules')
+        module.fail_json(msg='Unable to read the submodule paths from .gitmodules: %s' % out + err)
+    paths = []
+    # with -z each entry is <key>\n<value>\0
+    for entry in out.split('\0'):
+        if '\n' in entry:
+            paths.append(entry.split('\n', 1)[1])
+    return paths
+
+def get_submodule_index(git_path, module, dest, paths):
+    ''' returns {path: sha1} of the submodules as the index of dest records them '''
+    if not paths:
+        return {}
+    # -z so that paths come back raw, as git config -z gave them, and not C-quoted
+    cmd = [git_path, 'ls-files', '-z', '--stage', '--'] + paths
+    (rc, out, err) = module.run_command(cmd, cwd=dest)
+    if rc != 0:
+        module.fail_json(msg='Unable to read the submodules from the index: %s' % out + err)
+    index = {}
+    for entry in out.split('\0'):
+        if not entry:
+            continue
+        # <mode> <sha1> <stage>\t<path>, submodules have the gitlink mode
+        (info, path) = entry.split('\t', 1)
+        (mode, sha, stage) = info.split()
+        if mode == '160000':
+            index[path] = sha
+    return index
+
+def read_detached_head(path):
+    ''' the sha1 checked out in the submodule at path, None unless it is detached '''
+    gitdir = os.path.join(path, '.git')
+    try:
+        if os.path.isfile(gitdir):
+            f = open(gitdir)
+            try:
+                line = f.readline()
+            finally:
+                f.close()
+            if not line.startswith('gitdir:'):
+                return None
+            gitdir = os.path.join(path, line[len('gitdir:'):].strip())
+        f = open(os.path.join(gitdir, 'HEAD'))
+        try:
+            head = f.read().strip()
+        finally:
+            f.close()
+    except IOError:
+        return None
+    if re.match('^[0-9a-f]{40}$', head):
+        return head
+    return None
+
+def get_submodule_versions(git_path, module, dest, version='HEAD', jobs=1):
+    ''' returns {path: sha1} of version in each checked out submodule '''
     submodules = {}
-    subm_name = None
-    for line in out.splitlines():
-        if line.startswith("Entering '"):
-            subm_name = line[10:-1]
-        elif len(line.strip()) == 40:
-            if subm_name is None:
-                module.fail_json()
-            submodules[subm_name] = line.strip()
-            subm_name = None
-        else:
-            module.fail_json(msg='Unable to parse submodule hash line: %s' % line.strip())
-    if subm_name is not None:
-        module.fail_json(msg='Unable to find hash for submodule: %s' % subm_name)
+    commands = {}
+    for path in get_submodule_paths(git_path, module, dest):
+        if not os.path.exists(os.path.join(dest, path, '.git')):
+            continue
+        # submodules are usually on a detached HEAD, which can just be read
+        if version == 'HEAD':
+            sha = read_detached_head(os.path.join(dest, path))
+            if sha:
+                submodules[path] = sha
+                continue
+        commands[path] = ([git_path, 'rev-parse', version], os.path.join(dest, path))
+
+    for (path, (rc, out, err)) in run_parallel(commands, jobs).items():
+        if rc != 0:
+            module.fail_json(msg='Unable to determine hashes of submodules')
+        if len(out.strip()) != 40:
+            module.fail_json(msg='Unable to parse submodule hash line: %s' % out.strip())
+        submodules[path] = out.strip()
 
     return submodules
 
@@ -334,6 +504,7 @@ def clone(git_path, module, repo, dest, remote, depth, version, bare,
         cmd.extend([ '--reference', str(reference) ])
     cmd.extend([ repo, dest ])
     module.run_command(cmd, check_rc=True, cwd=dest_dirname)
+    forget_local_refs(dest)
     if bare:
         if remote != 'origin':
             module.run_command([git_path, 'remote', 'add', remote, repo], check_rc=True, cwd=dest)
@@ -344,6 +515,118 @@ def clone(git_path, module, repo, dest, remote, depth, version, bare,
     if verify_commit:
         verify_commit_sign(git_path, module, dest, version)
 
+def configure_mirror(git_path, module, mirror):
+    for (name, value) in MIRROR_CONFIG:
+        (rc, out, err) = module.run_command([git_path, 'config', name, value], cwd=mirror)
+        if rc != 0:
+            module.fail_json(msg="Failed to configure the mirror %s: %s %s" % (mirror, out, err))
+
+def mirror_path(cache_dir, repo):
+    # no credentials from user:token@host urls in the directory name
+    repo = re.sub(r'^([A-Za-z][A-Za-z0-9+.-]*://)[^/@]*@', r'\1', repo)
+    return os.path.join(cache_dir, re.sub(r'[^A-Za-z0-9._-]', '_', repo) + '.git')
+
+def update_mirror(git_path, module, repo, cache_dir):
+    '''
+    Creates or fetches the bare mirror of repo in cache_dir. Returns its
+    path and the lock file, which holds a shared lock on the mirror until
+    the module exits, so that no other task repacks it in the meantime.
+    Only the fetch itself is serialized, checkouts from the mirror run
+    side by side.
+    '''
+    mirror = mirror_path(cache_dir, repo)
+    try:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        fetch_lock = open(mirror + '.fetch.lock', 'w')
+        lock = open(mirror + '.lock', 'w')
+    except (IOError, OSError), e:
+        module.fail_json(msg="Unable to use cache_dir %s: %s" % (cache_dir, e))
+    fcntl.flock(fetch_lock.fileno(), fcntl.LOCK_EX)
+    try:
+        # only the branches and tags, and without --prune, since a checkout
+        # may need any object the mirror ever had
+        refspecs = ['+refs/heads/*:refs/heads/*', '+refs/tags/*:refs/tags/*']
+        if not os.path.isdir(os.path.join(mirror, 'objects')):
+            # built aside, so that a failed first fetch doesn't leave a mirror behind
+            tmp = tempfile.mkdtemp(prefix=os.path.basename(mirror) + '.', dir=cache_dir)
+            try:
+                module.run_command([git_path, 'init', '--bare', '--quiet', tmp], check_rc=True)
+                configure_mirror(git_path, module, tmp)
+                module.run_command([git_path, 'fetch', '--quiet', repo] + refspecs, check_rc=True, cwd=tmp)
+                os.rename(tmp, mirror)
+            finally:
+                if os.path.exists(tmp):
+                    shutil.rmtree(tmp, ignore_errors=True)
+            gc_stamp(mirror)
+        else:
+            # mirrors made before gc was configured get it too
+            configure_mirror(git_path, module, mirror)
+            (rc, out, err) = module.run_command([git_path, 'fetch', '--quiet', repo] + refspecs, cwd=mirror)
+            if rc != 0:
+                module.fail_json(msg="Failed to update the mirror %s: %s %s" % (mirror, out, err))
+
+            # a fetch only adds objects, but a repack must not run under a
+            # checkout reading from the mirror: it is skipped while any task
+            # holds the shared lock and left to the next update
+            if time.time() - gc_stamp(mirror, touch=False) > MIRROR_GC_INTERVAL:
+                try:
+                    fcntl.flock(lock.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except IOError, e:
+                    if e.errno not in (errno.EAGAIN, errno.EACCES):
+                        raise
+                else:
+                    # unreachable objects are kept too, a force push doesn't
+                    # make them unused by the checkouts
+                    (rc, out, err) = module.run_command([git_path, 'gc', '--quiet', '--prune=never'], cwd=mirror)
+                    if rc != 0:
+                        module.fail_json(msg="Failed to gc the mirror %s: %s %s" % (mirror, out, err))
+                    gc_stamp(mirror)
+
+        # only taken exclusively under the fetch lock, so this never waits
+        fcntl.flock(lock.fileno(), fcntl.LOCK_SH)
+    finally:
+        fetch_lock.close()
+    return (mirror, lock)
+
+def gc_stamp(mirror, touch=True):
+    ''' the time of the last gc of mirror, which is now when touch is set '''
+    stamp = os.path.join(mirror, 'ansible_gc')
+    if touch:
+        open(stamp, 'w').close()
+    try:
+        return os.path.getmtime(stamp)
+    except OSError:
+        return 0
+
+def add_alternate(dest, bare, mirror):
+    ''' lets the existing repo in dest borrow objects from mirror '''
+    if bare:
+        objects = os.path.join(dest, 'objects')
+    else:
+        objects = os.path.join(dest, '.git', 'objects')
+    if not os.path.isdir(objects):
+        # a submodule checkout, its objects are elsewhere
+        return
+    alternates = os.path.join(objects, 'info', 'alternates')
+    borrowed = os.path.join(mirror, 'objects')
+    lines = []
+    if os.path.exists(alternates):
+        f = open(alternates)
+        try:
+            lines = f.read().splitlines()
+        finally:
+            f.close()
+    if borrowed in lines:
+        return
+    if not os.path.isdir(os.path.dirname(alternates)):
+        os.makedirs(os.path.dirname(alternates))
+    f = open(alternates, 'a')
+    try:
+        f.write(borrowed + '\n')
+    finally:
+        f.close()
+
 def has_local_mods(module, git_path, dest, bare):
     if bare:
         return False
@@ -362,57 +645,70 @@ def reset(git_path, module, dest):
     tree since that commit.
     '''
     cmd = "%s reset --hard HEAD" % (git_path,)
-    return module.run_command(cmd, check_rc=True, cwd=dest)
+    result = module.run_command(cmd, check_rc=True, cwd=dest)
+    forget_local_refs(dest)
+    return result
 
-def get_remote_head(git_path, module, dest, version, remote, bare):
-    cloning = False
+def get_remote_refs(git_path, module, dest, remote):
+    '''
+    Returns {refname: sha1} of HEAD, the branches and the tags of the
+    remote, annotated tags also have their dereferenced refname^{}.
+    All of them come from one ls-remote, which is only run once.
+    '''
+    key = ('remote', dest, remote)
+    if key in _ref_cache:
+        return _ref_cache[key]
+
+    # the remote can be the url of a repo that isn't cloned yet
     cwd = None
-    tag = False
-    if remote == module.params['repo']:
-        cloning = True
-    else:
+    if dest and os.path.isdir(dest):
         cwd = dest
+    cmd = [git_path, 'ls-remote', remote, 'HEAD', 'refs/heads/*', 'refs/tags/*']
+    (rc, out, err) = module.run_command(cmd, check_rc=True, cwd=cwd)
+    refs = {}
+    for line in out.splitlines():
+        parts = line.split('\t', 1)
+        if len(parts) == 2:
+            refs[parts[1]] = parts[0]
+    _ref_cache[key] = refs
+    return refs
+
+def forget_local_refs(dest):
+    ''' drops the cached branches and tags of dest after they changed '''
+    for key in ('branches', 'tags'):
+        _ref_cache.pop((key, dest), None)
+
+def get_remote_head(git_path, module, dest, version, remote, bare):
+    refs = get_remote_refs(git_path, module, dest, remote)
     if version == 'HEAD':
-        if cloning:
+        if remote == module.params['repo']:
             # cloning the repo, just get the remote's HEAD version
-            cmd = '%s ls-remote %s -h HEAD' % (git_path, remote)
+            ref = 'HEAD'
         else:
             head_branch = get_head_branch(git_path, module, dest, remote, bare)
-            cmd = '%s ls-remote %s -h refs/heads/%s' % (git_path, remote, head_branch)
-    elif is_remote_branch(git_path, module, dest, remote, version):
-        cmd = '%s ls-remote %s -h refs/heads/%s' % (git_path, remote, version)
-    elif is_remote_tag(git_path, module, dest, remote, version):
-        tag = True
-        cmd = '%s ls-remote %s -t refs/tags/%s*' % (git_path, remote, version)
+            ref = 'refs/heads/%s' % head_branch
+    elif 'refs/heads/%s' % version in refs:
+        ref = 'refs/heads/%s' % version
+    elif 'refs/tags/%s' % version in refs:
+        # Find the dereferenced tag if this is an annotated tag.
+        ref = 'refs/tags/%s' % version
+        if ref + '^{}' in refs:
+            ref += '^{}'
     else:
         # appears to be a sha1.  return as-is since it appears
         # cannot check for a specific sha1 on remote
         return version
-    (rc, out, err) = module.run_command(cmd, check_rc=True, cwd=cwd)
-    if len(out) < 1:
+    if ref not in refs:
         module.fail_json(msg="Could not determine remote revision for %s" % version)
-
-    if tag:
-    # Find the dereferenced tag if this is an annotated tag.
-        for tag in out.split('\n'):
-            if tag.endswith(version + '^{}'):
-                out = tag
-                break
-            elif tag.endswith(version):
-                out = tag
-
-    rev = out.split()[0]
-    return rev
+    return refs[ref]
 
 def is_remote_tag(git_path, module, dest, remote, version):
-    cmd = '%s ls-remote %s -t refs/tags/%s' % (git_path, remote, version)
-    (rc, out, err) = module.run_command(cmd, check_rc=True, cwd=dest)
-    if version in out:
-        return True
-    else:
-        return False
+    return 'refs/tags/%s' % version in get_remote_refs(git_path, module, dest, remote)
 
 def get_branches(git_path, module, dest):
+    key = ('branches', dest)
+    if key in _ref_cache:
+        return _ref_cache[key]
     branches = []
     cmd = '%s branch -a' % (git_path,)
     (rc, out, err) = module.run_command(cmd, cwd=dest)
@@ -420,9 +716,13 @@ def get_branches(git_path, module, dest):
         module.fail_json(msg="Could not determine branch data - received %s" % out)
     for line in out.split('\n'):
         branches.append(line.strip())
+    _ref_cache[key] = branches
     return branches
 
 def get_tags(git_path, module, dest):
+    key = ('tags', dest)
+    if key in _ref_cache:
+        return _ref_cache[key]
     tags = []
     cmd = '%s tag' % (git_path,)
     (rc, out, err) = module.run_command(cmd, cwd=dest)
@@ -430,15 +730,11 @@ def get_tags(git_path, module, dest):
         module.fail_json(msg="Could not determine tag data - received %s" % out)
     for line in out.split('\n'):
         tags.append(line.strip())
+    _ref_cache[key] = tags
     return tags
 
 def is_remote_branch(git_path, module, dest, remote, version):
-    cmd = '%s ls-remote %s -h refs/heads/%s' % (git_path, remote, version)
-    (rc, out, err) = module.run_command(cmd, check_rc=True, cwd=dest)
-    if version in out:
-        return True
-    else:
-        return False
+    return 'refs/heads/%s' % version in get_remote_refs(git_path, module, dest, remote)
 
 def is_local_branch(git_path, module, dest, branch):
     branches = get_branches(git_path, module, dest)
@@ -526,8 +822,9 @@ def fetch(git_path, module, repo, dest, version, remote, bare, refspec):
         (rc,out,err) = module.run_command(command, cwd=dest)
         if rc != 0:
             module.fail_json(msg="Failed to %s: %s %s" % (label, out, err))
+    forget_local_refs(dest)
 
-def submodules_fetch(git_path, module, remote, track_submodules, dest):
+def submodules_fetch(git_path, module, remote, track_submodules, dest, jobs):
     changed = False
 
     if not os.path.exists(os.path.join(dest, '.gitmodules')):
@@ -555,33 +852,37 @@ def submodules_fetch(git_path, module, remote, track_submodules, dest):
     # Check for updates to existing modules
     if not changed:
         # Fetch updates
-        begin = get_submodule_versions(git_path, module, dest)
-        cmd = [git_path, 'submodule', 'foreach', git_path, 'fetch']
-        (rc, out, err) = module.run_command(cmd, check_rc=True, cwd=dest)
-        if rc != 0:
-            module.fail_json(msg="Failed to fetch submodules: %s" % out + err)
+        begin = get_submodule_versions(git_path, module, dest, jobs=jobs)
+        commands = {}
+        for path in begin:
+            commands[path] = ([git_path, 'fetch'], os.path.join(dest, path))
+        failed = []
+        for (path, (rc, out, err)) in sorted(run_parallel(commands, jobs).items()):
+            if rc != 0:
+                # fetch errors can echo the submodule url, credentials and all
+                failed.append('%s: %s' % (path, heuristic_log_sanitize(out + err)))
+        if failed:
+            module.fail_json(msg="Failed to fetch submodules: %s" % '\n'.join(failed))
 
         if track_submodules:
             # Compare against submodule HEAD
             ### FIXME: determine this from .gitmodules
             version = 'master'
             after = get_submodule_versions(git_path, module, dest, '%s/%s'
-                    % (remote, version))
+                    % (remote, version), jobs)
             if begin != after:
                 changed = True
         else:
             # Compare against the superproject's expectation
-            cmd = [git_path, 'submodule', 'status']
-            (rc, out, err) = module.run_command(cmd, check_rc=True, cwd=dest)
-            if rc != 0:
-                module.fail_json(msg='Failed to retrieve submodule status: %s' % out + err)
-            for line in out.splitlines():
-                if line[0] != ' ':
+            index = get_submodule_index(git_path, module, dest,
+                    get_submodule_paths(git_path, module, dest))
+            for (path, sha) in index.items():
+                if begin.get(path) != sha:
                     changed = True
                     break
     return changed
 
-def submodule_update(git_path, module, dest, track_submodules):
+def submodule_update(git_path, module, dest, track_submodules, jobs):
     ''' init and update any submodules '''
 
     # get the valid submodule params
@@ -596,6 +897,8 @@ def submodule_update(git_path, module, dest, track_submodules):
         cmd = [ git_path, 'submodule', 'update', '--init', '--recursive' ,'--remote' ]
     else:
         cmd = [ git_path, 'submodule', 'update', '--init', '--recursive' ]
+    if 'jobs' in params or get_git_version(git_path, module) >= SUBMODULE_JOBS_VERSION:
+        cmd.extend([ '--jobs', str(jobs) ])
     (rc, out, err) = module.run_command(cmd, cwd=dest)
     if rc != 0:
         module.fail_json(msg="Failed to init/update submodules: %s" % out + err)
@@ -622,6 +925,7 @@ def switch_version(git_path, module, dest, remote, version, verify_commit):
             module.fail_json(msg="Failed to checkout branch %s" % branch)
         cmd = "%s reset --hard %s" % (git_path, remote)
     (rc, out1, err1) = module.run_command(cmd, cwd=dest)
+    forget_local_refs(dest)
     if rc != 0:
         if version != 'HEAD':
             module.fail_json(msg="Failed to checkout %s" % (version))
@@ -652,6 +956,7 @@ def main():
             remote=dict(default='origin'),
             refspec=dict(default=None),
             reference=dict(default=None),
+            cache_dir=dict(default=None),
             force=dict(default='no', type='bool'),
             depth=dict(default=None, type='int'),
             clone=dict(default='yes', type='bool'),
@@ -664,7 +969,9 @@ def main():
             bare=dict(default='no', type='bool'),
             recursive=dict(default='yes', type='bool'),
             track_submodules=dict(default='no', type='bool'),
+            jobs=dict(default=4, type='int'),
         ),
+        mutually_exclusive=[['reference', 'cache_dir']],
         supports_check_mode=True
     )
 
@@ -680,6 +987,7 @@ def main():
     bare      = module.params['bare']
     verify_commit = module.params['verify_commit']
     reference = module.params['reference']
+    cache_dir = module.params['cache_dir']
     git_path  = module.params['executable'] or module.get_bin_path('git', True)
     key_file  = module.params['key_file']
     ssh_opts  = module.params['ssh_opts']
@@ -716,6 +1024,7 @@ def main():
 
     recursive = module.params['recursive']
     track_submodules = module.params['track_submodules']
+    jobs = module.params['jobs']
 
     rc, out, err, status = (0, None, None, None)
 
@@ -731,6 +1040,8 @@ def main():
             remote_head = get_remote_head(git_path, module, dest, version, repo, bare)
             module.exit_json(changed=True, before=before, after=remote_head)
         # there's no git config, so clone
+        if cache_dir:
+            (reference, mirror_lock) = update_mirror(git_path, module, repo, os.path.abspath(os.path.expanduser(cache_dir)))
         clone(git_path, module, repo, dest, remote, depth, version, bare, reference, refspec, verify_commit)
         repo_updated = True
     elif not update:
@@ -757,7 +1068,7 @@ def main():
             if local_mods:
                 module.exit_json(changed=True, before=before, after=remote_head,
                     msg="Local modifications exist")
-            elif is_remote_tag(git_path, module, dest, repo, version):
+            elif is_remote_tag(git_path, module, dest, remote, version):
                 # if the remote is a tag and we have the tag locally, exit early
                 if version in get_tags(git_path, module, dest):
                     repo_updated = False
@@ -766,6 +1077,9 @@ def main():
         if repo_updated is None:
             if module.check_mode:
                 module.exit_json(changed=True, before=before, after=remote_head)
+            if cache_dir:
+                (mirror, mirror_lock) = update_mirror(git_path, module, repo, os.path.abspath(os.path.expanduser(cache_dir)))
+                add_alternate(dest, bare, mirror)
             fetch(git_path, module, repo, dest, version, remote, bare, refspec)
             repo_updated = True
 
@@ -777,7 +1091,7 @@ def main():
     # Deal with submodules
     submodules_updated = False
     if recursive and not bare:
-        submodules_updated = submodules_fetch(git_path, module, remote, track_submodules, dest)
+        submodules_updated = submodules_fetch(git_path, module, remote, track_submodules, dest, jobs)
 
         if module.check_mode:
             if submodules_updated:
@@ -787,7 +1101,7 @@ def main():
 
         if submodules_updated:
             # Switch to version specified
-            submodule_update(git_path, module, dest, track_submodules)
+            submodule_update(git_path, module, dest, track_submodules, jobs)
 
     # determine if we changed anything
     after = get_version(module, git_path, dest)
@@ -61,8 +61,22 @@ options:
     required: false
     default: no
     version_added: "1.6"
+  workers:
+    description:
+      - Number of worker processes the daemon forks at startup to run modules sent with the
+        C(module) request. Module payloads are cached by their sha1 checksum and run in a child
+        of an already started interpreter, instead of a new python process per task.
+        C(0) runs cached modules with a new interpreter.
+    required: false
+    default: 2
+    version_added: "2.1"
 notes:
     - See the advanced playbooks chapter for more about using accelerated mode.
+    - Since 2.1 the daemon also speaks a binary transfer protocol for put and fetch
+      (raw encrypted frames of up to 16MB with a window of unacknowledged frames), which
+      is used when the controller asks for it. Older controllers keep using the json one.
+    - A controller can also switch a connection to multiplexed mode, where every message
+      carries a request id and several commands, puts and fetches run at the same time.
 requirements:
     - "python >= 2.6"
     - "python-keyczar"
@@ -83,23 +97,28 @@ EXAMPLES = '''
 import base64
 import errno
 import getpass
+import hashlib
 import json
 import os
 import os.path
 import pwd
+import re
+import select
 import signal
 import socket
 import struct
 import sys
 import syslog
 import tempfile
+import threading
 import time
 import traceback
 
+import Queue
 import SocketServer
 
 from datetime import datetime
-from threading import Thread, Lock
+from threading import Thread, Lock, Condition
 
 # import module snippets
 # we must import this here at the top so we can use get_module_path()
@@ -113,6 +132,26 @@ syslog.openlog('ansible-%s' % os.path.basename(__file__))
 # which leaves room for the TCP/IP header
 CHUNK_SIZE=10240
 
+# Transfer protocol 2 is used for a put or fetch when the controller asks
+# for it with "protocol": 2 in the request.  The daemon answers with the
+# negotiated chunk_size and window (and the file size for a fetch), and
+# the file is then sent as length-prefixed frames, each one holding the
+# raw bytes of a chunk encrypted together with a small header:
+#
+#   frame = Encrypt(struct.pack(FRAME_HEADER, seq, last) + chunk)
+#
+# The receiver acks with Encrypt(json.dumps(dict(ack=seq))) after every
+# window/2 frames and after the last one, and the sender never has more
+# than window frames unacknowledged, so the link is kept busy instead of
+# waiting for a round trip per chunk.
+PROTOCOL_VERSION=2
+FRAME_HEADER='!QB'
+FRAME_HEADER_LEN=struct.calcsize(FRAME_HEADER)
+DEFAULT_FRAME_SIZE=1024*1024
+MAX_FRAME_SIZE=16*1024*1024
+DEFAULT_WINDOW=8
+MAX_WINDOW=64
+
 # FIXME: this all should be moved to module_common, as it's 
 #        pretty much a copy from the callbacks/util code
 DEBUG_LEVEL=0
@@ -142,6 +181,7 @@ except ImportError:
     pass
 
 SOCKET_FILE = os.path.join(get_module_path(), '.ansible-accelerate', ".local.socket")
+MODULE_CACHE_DIR = os.path.join(get_module_path(), '.ansible-accelerate', "modules")
 
 def get_pid_location(module):
     """
@@ -197,6 +237,212 @@ def daemonize_self(module, password, port, minutes, pid_file):
     os.dup2(dev_null.fileno(), sys.stderr.fileno())
     log("daemonizing successful")
 
+def send_message(sock, data):
+    data = json.dumps(data)
+    sock.sendall(struct.pack('!Q', len(data)) + data)
+
+def recv_message(sock):
+    header_len = 8
+    data = ""
+    while len(data) < header_len:
+        d = sock.recv(header_len - len(data))
+        if not d:
+            return None
+        data += d
+    data_len = struct.unpack('!Q', data)[0]
+    pieces = []
+    received = 0
+    while received < data_len:
+        d = sock.recv(min(data_len - received, 1024*1024))
+        if not d:
+            return None
+        pieces.append(d)
+        received += len(d)
+    return json.loads(''.join(pieces))
+
+def run_module_child(code, path, request):
+    """
+    Run a compiled module in a child of the calling worker and return its
+    rc, stdout and stderr, as run_command() would for a new interpreter
+    """
+    out_fd, out_path = tempfile.mkstemp(prefix='ansible-out.')
+    err_fd, err_path = tempfile.mkstemp(prefix='ansible-err.')
+    try:
+        pid = os.fork()
+        if pid == 0:
+            rc = 1
+            try:
+                try:
+                    os.dup2(out_fd, sys.stdout.fileno())
+                    os.dup2(err_fd, sys.stderr.fileno())
+                    os.environ.update(request.get('environment') or {})
+                    sys.argv = [path] + request.get('argv', [])
+                    exec code in dict(__name__='__main__', __file__=path)
+                    rc = 0
+                except SystemExit, e:
+                    if e.code is None:
+                        rc = 0
+                    elif isinstance(e.code, int):
+                        rc = e.code
+                    else:
+                        sys.stderr.write("%s\n" % e.code)
+                except:
+                    traceback.print_exc()
+            finally:
+                try:
+                    sys.stdout.flush()
+                    sys.stderr.flush()
+                except:
+                    pass
+                os._exit(rc)
+
+        (pid, status) = os.waitpid(pid, 0)
+        if os.WIFEXITED(status):
+            rc = os.WEXITSTATUS(status)
+        else:
+            rc = -os.WTERMSIG(status)
+        stdout = open(out_path).read()
+        stderr = open(err_path).read()
+    finally:
+        os.close(out_fd)
+        os.close(err_fd)
+        os.unlink(out_path)
+        os.unlink(err_path)
+    return dict(rc=rc, stdout=stdout, stderr=stderr)
+
+def run_module_worker(sock):
+    """
+    Main loop of a pre-forked worker. Each module is compiled once per
+    checksum and then run in a fork of this (already warm) interpreter.
+    """
+    # whatever happens, this never returns into the code that forked it
+    try:
+        try:
+            signal.signal(signal.SIGALRM, signal.SIG_DFL)
+            code_cache = {}
+            while True:
+                try:
+                    request = recv_message(sock)
+                except:
+                    request = None
+                if request is None:
+                    os._exit(0)
+                try:
+                    sha1 = request['sha1']
+                    path = request['path']
+                    if sha1 not in code_cache:
+                        f = open(path)
+                        try:
+                            code_cache[sha1] = compile(f.read(), path, 'exec')
+                        finally:
+                            f.close()
+                    result = run_module_child(code_cache[sha1], path, request)
+                except:
+                    result = dict(rc=1, stdout='', stderr=traceback.format_exc())
+
+                # module output isn't always valid utf-8, which json.dumps
+                # refuses. the module already ran, so the result must get back
+                for key in ('stdout', 'stderr'):
+                    if isinstance(result.get(key), str):
+                        result[key] = result[key].decode('utf-8', 'replace')
+                try:
+                    data = json.dumps(result)
+                except:
+                    data = json.dumps(dict(rc=1, stdout='', stderr=traceback.format_exc()))
+                sock.sendall(struct.pack('!Q', len(data)) + data)
+        except:
+            pass
+    finally:
+        os._exit(1)
+
+class ModuleWorkerPool(object):
+    """
+    Worker processes forked before the server starts any thread, they are
+    handed out one request at a time to the connection handlers
+    """
+
+    # run() returns this when no worker got the request, which can then
+    # safely be run some other way
+    NO_WORKER = object()
+
+    def __init__(self, count):
+        self.idle = []
+        self.size = 0
+        self.cond = Condition()
+        for i in range(count):
+            parent_sock, child_sock = socket.socketpair()
+            pid = os.fork()
+            if pid == 0:
+                parent_sock.close()
+                for (other_pid, other_sock) in self.idle:
+                    other_sock.close()
+                run_module_worker(child_sock)
+            child_sock.close()
+            self.idle.append((pid, parent_sock))
+            self.size += 1
+        vv("started %d module workers" % self.size)
+
+    def run(self, request):
+        self.cond.acquire()
+        try:
+            while not self.idle:
+                if self.size == 0:
+                    return self.NO_WORKER
+                self.cond.wait()
+            worker = self.idle.pop()
+        finally:
+            self.cond.release()
+
+        result = None
+        died = True
+        try:
+            send_message(worker[1], request)
+        except socket.error:
+            # a partial request is never run by the worker
+            result = self.NO_WORKER
+        else:
+            try:
+                result = recv_message(worker[1])
+            except (socket.error, ValueError):
+                pass
+            if result is None:
+                # the module may have run already, running it again
+                # isn't safe for the likes of command or shell
+                result = dict(failed=True, rc=1, msg='module worker died')
+            else:
+                died = False
+
+        self.cond.acquire()
+        try:
+            if died:
+                # the worker died, the others keep going
+                log("module worker %d went away" % worker[0])
+                self.drop(worker)
+            else:
+                self.idle.append(worker)
+            self.cond.notify()
+        finally:
+            self.cond.release()
+        return result
+
+    def drop(self, worker):
+        self.size -= 1
+        try:
+            worker[1].close()
+            os.waitpid(worker[0], os.WNOHANG)
+        except:
+            pass
+
+    def shutdown(self):
+        self.cond.acquire()
+        try:
+            for worker in self.idle:
+                self.drop(worker)
+            self.idle = []
+            self.cond.notifyAll()
+        finally:
+            self.cond.release()
+
 class LocalSocketThread(Thread):
     server = None
     terminated = False
@@ -281,18 +527,43 @@ class ThreadWithReturnValue(Thread):
     def __init__(self, group=None, target=None, name=None, args=(), kwargs={}, Verbose=None):
         Thread.__init__(self, group, target, name, args, kwargs, Verbose)
         self._return = None
+        # written to when the target returns, so the caller can select() on it
+        (self._done_r, self._done_w) = os.pipe()
 
     def run(self):
-        if self._Thread__target is not None:
-            self._return = self._Thread__target(*self._Thread__args,
-                                                **self._Thread__kwargs)
+        try:
+            if self._Thread__target is not None:
+                self._return = self._Thread__target(*self._Thread__args,
+                                                    **self._Thread__kwargs)
+        finally:
+            os.write(self._done_w, 'x')
+
+    def wait(self, timeout):
+        """
+        Block until the target returned or timeout seconds passed, returns
+        True if the target is done
+        """
+        while True:
+            try:
+                (r, w, x) = select.select([self._done_r], [], [], timeout)
+                return bool(r)
+            except select.error, e:
+                if e[0] != errno.EINTR:
+                    raise
 
     def join(self,timeout=None):
         Thread.join(self, timeout=timeout)
+        if not self.isAlive():
+            for fd in (self._done_r, self._done_w):
+                try:
+                    os.close(fd)
+                except OSError:
+                    pass
         return self._return
 
 class ThreadedTCPServer(SocketServer.ThreadingTCPServer):
     key_list = []
+    module_workers = None
     last_event = datetime.now()
     last_event_lock = Lock()
     def __init__(self, server_address, RequestHandlerClass, module, password, timeout, use_ipv6=False):
@@ -310,27 +581,91 @@ class ThreadedTCPServer(SocketServer.ThreadingTCPServer):
             self.local_thread.start()
 
         SocketServer.ThreadingTCPServer.__init__(self, server_address, RequestHandlerClass)
+        self.running = True
+        (self.wakeup_r, self.wakeup_w) = os.pipe()
+
+    def serve(self):
+        """
+        Accept connections until shutdown() is called. This blocks in select()
+        instead of polling, signals interrupt it so the idle timer still runs.
+        """
+        while self.running:
+            try:
+                (r, w, x) = select.select([self, self.wakeup_r], [], [])
+            except select.error, e:
+                if e[0] == errno.EINTR:
+                    continue
+                raise
+            if self in r and self.running:
+                self._handle_request_noblock()
 
     def shutdown(self):
+        # may be called from a handler thread or the signal handler
         self.running = False
-        SocketServer.ThreadingTCPServer.shutdown(self)
+        try:
+            os.write(self.wakeup_w, 'x')
+        except OSError:
+            pass
 
 class ThreadedTCPRequestHandler(SocketServer.BaseRequestHandler):
     # the key to use for this connection
     active_key = None
 
-    def send_data(self, data):
+    # After a 'multiplex' request every message on the connection carries
+    # the id of the request it belongs to in its header, so the controller
+    # can have several requests in flight at once:
+    #
+    #   message = struct.pack('!QQ', len(data), request_id) + data
+    #
+    # Each request runs in its own thread, the messages that follow it
+    # (put chunks, fetch acks) are routed to that thread by id, and the
+    # responses are sent back as soon as they are ready, in any order.
+    multiplexed = False
+
+    def setup(self):
+        self.local = threading.local()
+        self.channels = {}
+        self.channels_lock = Lock()
+        self.send_lock = Lock()
+
+    def update_last_event(self):
         try:
             self.server.last_event_lock.acquire()
             self.server.last_event = datetime.now()
         finally:
             self.server.last_event_lock.release()
 
-        packed_len = struct.pack('!Q', len(data))
-        return self.request.sendall(packed_len + data)
+    def send_data(self, data):
+        self.update_last_event()
+
+        if self.multiplexed:
+            header = struct.pack('!QQ', len(data), self.local.request_id)
+        else:
+            header = struct.pack('!Q', len(data))
+        self.send_lock.acquire()
+        try:
+            return self.request.sendall(header + data)
+        finally:
+            self.send_lock.release()
 
     def recv_data(self):
-        header_len = 8 # size of a packed unsigned long long
+        if self.multiplexed:
+            # the reader thread hands us the messages for our request
+            self.channels_lock.acquire()
+            try:
+                channel = self.channels.get(getattr(self.local, 'request_id', None))
+            finally:
+                self.channels_lock.release()
+            if channel is None:
+                return None
+            return channel.get()
+        message = self.recv_socket('!Q')
+        if message is None:
+            return None
+        return message[-1]
+
+    def recv_socket(self, header_fmt):
+        header_len = struct.calcsize(header_fmt)
         data = ""
         vvvv("in recv_data(), waiting for the header")
         while len(data) < header_len:
@@ -345,30 +680,54 @@ class ThreadedTCPRequestHandler(SocketServer.BaseRequestHandler):
                 vvvv("exception received while waiting for recv(), returning None")
                 return None
         vvvv("in recv_data(), got the header, unpacking")
-        data_len = struct.unpack('!Q',data[:header_len])[0]
-        data = data[header_len:]
-        vvvv("data received so far (expecting %d): %d" % (data_len,len(data)))
-        while len(data) < data_len:
+        header = struct.unpack(header_fmt, data[:header_len])
+        data_len = header[0]
+        # collect the pieces in a list, as frames can be several MB
+        pieces = [data[header_len:]]
+        received = len(pieces[0])
+        vvvv("data received so far (expecting %d): %d" % (data_len,received))
+        while received < data_len:
             try:
-                d = self.request.recv(data_len - len(data))
+                d = self.request.recv(min(data_len - received, 1024*1024))
                 if not d:
                     vvv("received nothing, bailing out")
                     return None
-                data += d
-                vvvv("data received so far (expecting %d): %d" % (data_len,len(data)))
+                pieces.append(d)
+                received += len(d)
+                vvvv("data received so far (expecting %d): %d" % (data_len,received))
             except:
                 # probably got a connection reset
                 vvvv("exception received while waiting for recv(), returning None")
                 return None
+        data = ''.join(pieces)
         vvvv("received all of the data, returning")
 
-        try:
-            self.server.last_event_lock.acquire()
-            self.server.last_event = datetime.now()
-        finally:
-            self.server.last_event_lock.release()
+        self.update_last_event()
 
-        return data
+        return header[1:] + (data,)
+
+    def decrypt_request(self, data):
+        vvvv("got data, decrypting")
+        if not self.active_key:
+            for key in self.server.key_list:
+                try:
+                    data = key.Decrypt(data)
+                    self.active_key = key
+                    break
+                except:
+                    pass
+            else:
+                vv("bad decrypt, exiting the connection handler")
+                return None
+        else:
+            try:
+                data = self.active_key.Decrypt(data)
+            except:
+                vv("bad decrypt, exiting the connection handler")
+                return None
+
+        vvvv("decryption done, loading json from the data")
+        return json.loads(data)
 
     def handle(self):
         try:
@@ -378,67 +737,18 @@ class ThreadedTCPRequestHandler(SocketServer.BaseRequestHandler):
                 if not data:
                     vvvv("received nothing back from recv_data(), breaking out")
                     break
-                vvvv("got data, decrypting")
-                if not self.active_key:
-                    for key in self.server.key_list:
-                        try:
-                            data = key.Decrypt(data)
-                            self.active_key = key
-                            break
-                        except:
-                            pass
-                    else:
-                        vv("bad decrypt, exiting the connection handler")
-                        return
-                else:
-                    try:
-                        data = self.active_key.Decrypt(data)
-                    except:
-                        vv("bad decrypt, exiting the connection handler")
-                        return
-
-                vvvv("decryption done, loading json from the data")
-                data = json.loads(data)
-
-                mode = data['mode']
-                response = {}
-                last_pong = datetime.now()
-                if mode == 'command':
-                    vvvv("received a command request, running it")
-                    twrv = ThreadWithReturnValue(target=self.command, args=(data,))
-                    twrv.start()
-                    response = None
-                    while twrv.is_alive():
-                        if (datetime.now() - last_pong).seconds >= 15:
-                            last_pong = datetime.now()
-                            vvvv("command still running, sending keepalive packet")
-                            data2 = json.dumps(dict(pong=True))
-                            data2 = self.active_key.Encrypt(data2)
-                            self.send_data(data2)
-                        time.sleep(0.1)
-                    response = twrv._return
-                    vvvv("thread is done, response from join was %s" % response)
-                elif mode == 'put':
-                    vvvv("received a put request, putting it")
-                    response = self.put(data)
-                elif mode == 'fetch':
-                    vvvv("received a fetch request, getting it")
-                    response = self.fetch(data)
-                elif mode == 'validate_user':
-                    vvvv("received a request to validate the user id")
-                    response = self.validate_user(data)
-
-                vvvv("response result is %s" % str(response))
-                json_response = json.dumps(response)
-                vvvv("dumped json is %s" % json_response)
-                data2 = self.active_key.Encrypt(json_response)
-                vvvv("sending the response back to the controller")
-                self.send_data(data2)
-                vvvv("done sending the response")
-
-                if mode == 'validate_user' and response.get('rc') == 1:
-                    vvvv("detected a uid mismatch, shutting down")
-                    self.server.shutdown()
+                data = self.decrypt_request(data)
+                if data is None:
+                    return
+
+                if data['mode'] == 'multiplex':
+                    vvvv("switching the connection to multiplexed requests")
+                    self.send_json(dict(multiplex=True))
+                    self.multiplexed = True
+                    self.handle_multiplexed()
+                    return
+
+                self.process_request(data)
         except:
             tb = traceback.format_exc()
             log("encountered an unhandled exception in the handle() function")
@@ -448,6 +758,171 @@ class ThreadedTCPRequestHandler(SocketServer.BaseRequestHandler):
                 data2 = self.active_key.Encrypt(data2)
                 self.send_data(data2)
 
+    def handle_multiplexed(self):
+        try:
+            while True:
+                message = self.recv_socket('!QQ')
+                if message is None:
+                    vvvv("connection closed, stopping the multiplexed requests")
+                    break
+                (request_id, data) = message
+                self.channels_lock.acquire()
+                try:
+                    channel = self.channels.get(request_id)
+                    if channel is None:
+                        channel = self.channels[request_id] = Queue.Queue()
+                        new_request = True
+                    else:
+                        new_request = False
+                finally:
+                    self.channels_lock.release()
+
+                if new_request:
+                    vvvv("starting request %d" % request_id)
+                    Thread(target=self.handle_request, args=(request_id, data)).start()
+                else:
+                    channel.put(data)
+        finally:
+            # wake up the requests still waiting for data
+            self.channels_lock.acquire()
+            try:
+                for channel in self.channels.values():
+                    channel.put(None)
+            finally:
+                self.channels_lock.release()
+
+    def handle_request(self, request_id, data):
+        self.local.request_id = request_id
+        try:
+            try:
+                data = self.decrypt_request(data)
+                if data is None:
+                    self.send_json(dict(rc=1, failed=True, msg="could not decrypt the request"))
+                else:
+                    self.process_request(data)
+            except:
+                tb = traceback.format_exc()
+                log("encountered an unhandled exception handling request %d" % request_id)
+                log("error was:\n%s" % tb)
+                self.send_json(dict(rc=1, failed=True, msg="unhandled error in the handle() function"))
+        finally:
+            self.channels_lock.acquire()
+            try:
+                del self.channels[request_id]
+            finally:
+                self.channels_lock.release()
+
+    def process_request(self, data):
+        mode = data['mode']
+        response = {}
+        if mode in ('command', 'module'):
+            vvvv("received a %s request, running it" % mode)
+            if mode == 'module':
+                twrv = ThreadWithReturnValue(target=self.run_module, args=(data,))
+            else:
+                twrv = ThreadWithReturnValue(target=self.command, args=(data,))
+            twrv.start()
+            response = None
+            while not twrv.wait(15):
+                vvvv("command still running, sending keepalive packet")
+                data2 = json.dumps(dict(pong=True))
+                data2 = self.active_key.Encrypt(data2)
+                self.send_data(data2)
+            response = twrv.join()
+            vvvv("thread is done, response from join was %s" % response)
+        elif mode == 'put':
+            vvvv("received a put request, putting it")
+            response = self.put(data)
+        elif mode == 'fetch':
+            vvvv("received a fetch request, getting it")
+            response = self.fetch(data)
+        elif mode == 'validate_user':
+            vvvv("received a request to validate the user id")
+            response = self.validate_user(data)
+
+        vvvv("response result is %s" % str(response))
+        json_response = json.dumps(response)
+        vvvv("dumped json is %s" % json_response)
+        data2 = self.active_key.Encrypt(json_response)
+        vvvv("sending the response back to the controller")
+        self.send_data(data2)
+        vvvv("done sending the response")
+
+        if mode == 'validate_user' and response.get('rc') == 1:
+            vvvv("detected a uid mismatch, shutting down")
+            self.server.shutdown()
+
+    def send_json(self, data):
+        return self.send_data(self.active_key.Encrypt(json.dumps(data)))
+
+    def negotiate_transfer(self, data):
+        # the controller asks, the daemon decides what it is willing to use
+        try:
+            frame_size = int(data.get('chunk_size', DEFAULT_FRAME_SIZE))
+            window = int(data.get('window', DEFAULT_WINDOW))
+        except ValueError:
+            frame_size, window = DEFAULT_FRAME_SIZE, DEFAULT_WINDOW
+        frame_size = min(max(frame_size, CHUNK_SIZE), MAX_FRAME_SIZE)
+        window = min(max(window, 1), MAX_WINDOW)
+        return frame_size, window
+
+    def send_frame(self, seq, last, chunk):
+        frame = self.active_key.Encrypt(struct.pack(FRAME_HEADER, seq, last) + chunk)
+        return self.send_data(frame)
+
+    def recv_frame(self):
+        frame = self.recv_data()
+        if not frame:
+            raise IOError("connection closed during the transfer")
+        frame = self.active_key.Decrypt(frame)
+        seq, last = struct.unpack(FRAME_HEADER, frame[:FRAME_HEADER_LEN])
+        return seq, bool(last), frame[FRAME_HEADER_LEN:]
+
+    def recv_ack(self):
+        response = self.recv_data()
+        if not response:
+            raise IOError("failed to get an ack from the controller")
+        response = json.loads(self.active_key.Decrypt(response))
+        if response.get('failed', False):
+            raise IOError("controller reported failure, aborting transfer")
+        return response['ack']
+
+    def send_frames(self, fd, size, frame_size, window):
+        # keep up to window frames in flight, acks are cumulative
+        seq = 0
+        acked = -1
+        sent = 0
+        while True:
+            chunk = fd.read(frame_size)
+            sent += len(chunk)
+            last = sent >= size or not chunk
+            if self.send_frame(seq, last, chunk):
+                raise IOError("failed to send data")
+            while seq - acked >= window:
+                acked = self.recv_ack()
+            if last:
+                break
+            seq += 1
+        while acked < seq:
+            acked = self.recv_ack()
+        return sent
+
+    def recv_frames(self, out_fd, window):
+        ack_every = max(1, window / 2)
+        expected = 0
+        bytes = 0
+        while True:
+            seq, last, chunk = self.recv_frame()
+            if seq != expected:
+                raise IOError("received frame %d while expecting frame %d" % (seq, expected))
+            out_fd.write(chunk)
+            bytes += len(chunk)
+            if last or (seq + 1) % ack_every == 0:
+                self.send_json(dict(ack=seq))
+            if last:
+                return bytes
+            expected += 1
+
     def validate_user(self, data):
         if 'username' not in data:
             return dict(failed=True, msg='No username specified')
@@ -490,6 +965,63 @@ class ThreadedTCPRequestHandler(SocketServer.BaseRequestHandler):
 
         return dict(rc=rc, stdout=stdout, stderr=stderr)
 
+    def cache_module(self, sha1, module_data):
+        if isinstance(module_data, unicode):
+            module_data = module_data.encode('utf-8')
+        if hashlib.sha1(module_data).hexdigest() != sha1:
+            return False
+        if not os.path.isdir(MODULE_CACHE_DIR):
+            os.makedirs(MODULE_CACHE_DIR, 0700)
+        (fd, tmp_path) = tempfile.mkstemp(dir=MODULE_CACHE_DIR)
+        try:
+            os.write(fd, module_data)
+        finally:
+            os.close(fd)
+        os.rename(tmp_path, os.path.join(MODULE_CACHE_DIR, sha1))
+        return True
+
+    def run_module(self, data):
+        # the controller sends the sha1 of the module payload, and the
+        # payload itself only when the daemon answered missing_module
+        sha1 = data.get('sha1', '')
+        if not re.match('^[0-9a-f]{40}$', sha1):
+            return dict(failed=True, msg='internal error: a valid sha1 is required')
+
+        path = os.path.join(MODULE_CACHE_DIR, sha1)
+        if not os.path.exists(path):
+            if 'module_data' not in data:
+                return dict(failed=True, missing_module=True, msg='module %s is not cached' % sha1)
+            try:
+                if not self.cache_module(sha1, data['module_data']):
+                    return dict(failed=True, msg='module payload does not match its sha1')
+            except (IOError, OSError), e:
+                return dict(failed=True, msg='could not cache the module: %s' % str(e))
+
+        argv = []
+        args_path = None
+        if data.get('args') is not None:
+            (fd, args_path) = tempfile.mkstemp(prefix='ansible-args.')
+            args = data['args']
+            if isinstance(args, unicode):
+                args = args.encode('utf-8')
+            os.write(fd, args)
+            os.close(fd)
+            argv.append(args_path)
+
+        try:
+            request = dict(sha1=sha1, path=path, argv=argv, environment=data.get('environment'))
+            result = ModuleWorkerPool.NO_WORKER
+            if self.server.module_workers:
+                result = self.server.module_workers.run(request)
+            if result is ModuleWorkerPool.NO_WORKER:
+                vvvv("no module worker available, using a new interpreter")
+                rc, stdout, stderr = self.server.module.run_command([sys.executable, path] + argv, close_fds=True)
+                result = dict(rc=rc, stdout=stdout, stderr=stderr)
+        finally:
+            if args_path:
+                os.unlink(args_path)
+        return result
+
     def fetch(self, data):
         if 'in_path' not in data:
             return dict(failed=True, msg='internal error: in_path is required')
@@ -498,6 +1030,12 @@ class ThreadedTCPRequestHandler(SocketServer.BaseRequestHandler):
             fd = file(data['in_path'], 'rb')
             fstat = os.stat(data['in_path'])
             vvv("FETCH file is %d bytes" % fstat.st_size)
+            if data.get('protocol') == PROTOCOL_VERSION:
+                frame_size, window = self.negotiate_transfer(data)
+                self.send_json(dict(protocol=PROTOCOL_VERSION, chunk_size=frame_size, window=window, size=fstat.st_size))
+                self.send_frames(fd, fstat.st_size, frame_size, window)
+                fd.close()
+                return dict()
             while fd.tell() < fstat.st_size:
                 data = fd.read(CHUNK_SIZE)
                 last = False
@@ -530,7 +1068,8 @@ class ThreadedTCPRequestHandler(SocketServer.BaseRequestHandler):
         return dict()
 
     def put(self, data):
-        if 'data' not in data:
+        streaming = data.get('protocol') == PROTOCOL_VERSION
+        if 'data' not in data and not streaming:
             return dict(failed=True, msg='internal error: data is required')
         if 'out_path' not in data:
             return dict(failed=True, msg='internal error: out_path is required')
@@ -553,7 +1092,11 @@ class ThreadedTCPRequestHandler(SocketServer.BaseRequestHandler):
 
         try:
             bytes=0
-            while True:
+            if streaming:
+                frame_size, window = self.negotiate_transfer(data)
+                self.send_json(dict(protocol=PROTOCOL_VERSION, chunk_size=frame_size, window=window))
+                bytes = self.recv_frames(out_fd, window)
+            while not streaming:
                 out = base64.b64decode(data['data'])
                 bytes += len(out)
                 out_fd.write(out)
@@ -581,10 +1124,15 @@ class ThreadedTCPRequestHandler(SocketServer.BaseRequestHandler):
             self.server.module.atomic_move(out_path, final_path)
         return dict()
 
-def daemonize(module, password, port, timeout, minutes, use_ipv6, pid_file):
+def daemonize(module, password, port, timeout, minutes, use_ipv6, pid_file, workers):
     try:
         daemonize_self(module, password, port, minutes, pid_file)
 
+        # the workers must be forked before any thread is started
+        module_workers = None
+        if workers > 0:
+            module_workers = ModuleWorkerPool(workers)
+
         def timer_handler(signum, _):
             try:
                 try:
@@ -595,19 +1143,15 @@ def daemonize(module, password, port, timeout, minutes, use_ipv6, pid_file):
                     total_seconds = (td.microseconds + (td.seconds + td.days * 24 * 3600) * 10**6) / 10**6
                     if total_seconds >= minutes * 60:
                         log("server has been idle longer than the timeout, shutting down")
-                        server.running = False
                         server.shutdown()
                     else:
-                        # reschedule the check
-                        signal.alarm(1)
+                        # there was activity, sleep until the new deadline
+                        signal.alarm(max(1, minutes * 60 - total_seconds))
                 except:
                     pass
             finally:
                 server.last_event_lock.release()
 
-        signal.signal(signal.SIGALRM, timer_handler)
-        signal.alarm(1)
-
         tries = 5
         while tries > 0:
             try:
@@ -617,6 +1161,7 @@ def daemonize(module, password, port, timeout, minutes, use_ipv6, pid_file):
                     address = ("0.0.0.0", port)
                 server = ThreadedTCPServer(address, ThreadedTCPRequestHandler, module, password, timeout, use_ipv6=use_ipv6)
                 server.allow_reuse_address = True
+                server.module_workers = module_workers
                 break
             except Exception, e:
                 vv("Failed to create the TCP server (tries left = %d) (error: %s) " % (tries,e))
@@ -627,19 +1172,17 @@ def daemonize(module, password, port, timeout, minutes, use_ipv6, pid_file):
             vv("Maximum number of attempts to create the TCP server reached, bailing out")
             raise Exception("max # of attempts to serve reached")
 
-        # run the server in a separate thread to make signal handling work
-        server_thread = Thread(target=server.serve_forever, kwargs=dict(poll_interval=0.1))
-        server_thread.start()
-        server.running = True
+        # a single alarm at the idle deadline, it is moved forward
+        # by the handler when there was activity in the meantime
+        signal.signal(signal.SIGALRM, timer_handler)
+        signal.alarm(max(1, minutes * 60))
 
         v("serving!")
-        while server.running:
-            time.sleep(1)
-
-        # wait for the thread to exit fully
-        server_thread.join()
+        server.serve()
+        if module_workers:
+            module_workers.shutdown()
 
-        v("server thread terminated, exiting!")
+        v("server terminated, exiting!")
         sys.exit(0)
     except Exception, e:
         tb = traceback.format_exc()
@@ -656,6 +1199,7 @@ def main():
             timeout=dict(required=False, default=300),
             password=dict(required=True),
             minutes=dict(required=False, default=30),
+            workers=dict(required=False, default=2, type='int'),
             debug=dict(required=False, default=0, type='int')
         ),
         supports_check_mode=True
@@ -668,6 +1212,7 @@ def main():
     debug     = int(module.params['debug'])
     ipv6      = module.params['ipv6']
     multi_key = module.params['multi_key']
+    workers   = module.params['workers']
 
     if not HAS_KEYCZAR:
         module.fail_json(msg="keyczar is not installed (on the remote side)")
@@ -724,6 +1269,6 @@ def main():
             module.fail_json(msg="could not transfer new key: %s" % data.strip())
     else:
         # try to start up the daemon
-        daemonize(module, password, port, timeout, minutes, ipv6, pid_file)
+        daemonize(module, password, port, timeout, minutes, ipv6, pid_file, workers)
 
 main()
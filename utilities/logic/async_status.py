@@ -29,7 +29,9 @@ version_added: "0.5"
 options:
   jid:
     description:
-      - Job or task identifier
+      - Job or task identifier.
+      - Since 2.1 this can also be a list of identifiers or a glob like C(*), in which case
+        a summary of every matching job is returned in C(jobs).
     required: true
     default: null
     aliases: []
@@ -40,56 +42,231 @@ options:
     required: false
     choices: [ "status", "cleanup" ]
     default: "status"
+  stdout_offset:
+    description:
+      - While the job is still running, return the output the module has written
+        since this byte offset as C(partial_stdout), along with the new C(stdout_offset)
+        to pass to the next call.
+    required: false
+    default: null
+    version_added: "2.1"
+  age:
+    description:
+      - With I(mode=cleanup), only erase the finished jobs whose result is older than
+        this many seconds. Jobs that are still running are never erased when this is set.
+    required: false
+    default: null
+    version_added: "2.1"
 notes:
     - See also U(http://docs.ansible.com/playbooks_async.html)
+    - The summary of finished jobs is kept in C(~/.ansible_async/.index), so a status
+      sweep over many jobs doesn't parse their result files again.
 requirements: []
 author: 
     - "Ansible Core Team"
     - "Michael DeHaan"
 '''
 
+EXAMPLES = '''
+# Poll every job started by this play at once
+- async_status: jid={{ item.ansible_job_id }}
+  with_items: jobs.results
+
+# Status of all the jobs on the host
+- async_status: jid=*
+
+# Remove the results of the jobs finished more than a day ago
+- async_status: jid=* mode=cleanup age=86400
+'''
+
 import datetime
+import glob
 import traceback
 
+INDEX_FILE = '.index'
+OUTPUT_SUFFIXES = ('.stdout', '.stderr', '.tmp')
+SUMMARY_KEYS = ('finished', 'failed', 'changed', 'rc', 'msg')
+
+def read_job(log_path, jid):
+    """ returns the job record, or None if it couldn't be parsed """
+
+    data = file(log_path).read()
+    try:
+        data = json.loads(data)
+    except Exception, e:
+        if data == '':
+            # file not written yet?  That means it is running
+            return dict(results_file=log_path, ansible_job_id=jid, started=1, finished=0)
+        return None
+
+    if not 'started' in data:
+        data['finished'] = 1
+        data['ansible_job_id'] = jid
+    return data
+
+def read_index(logdir):
+    try:
+        f = open(os.path.join(logdir, INDEX_FILE))
+        try:
+            return json.loads(f.read())
+        finally:
+            f.close()
+    except (IOError, ValueError):
+        return {}
+
+def write_index(logdir, index):
+    # the index only saves time, losing an update to a concurrent
+    # writer or failing to write it just means parsing again
+    try:
+        tmp_path = os.path.join(logdir, INDEX_FILE + '.%d.tmp' % os.getpid())
+        f = open(tmp_path, 'w')
+        try:
+            f.write(json.dumps(index))
+        finally:
+            f.close()
+        os.rename(tmp_path, os.path.join(logdir, INDEX_FILE))
+    except (IOError, OSError):
+        pass
+
+def find_jobs(logdir, jids):
+    """ returns {jid: path} of the existing jobs named or matched by jids """
+
+    jobs = {}
+    for jid in jids:
+        if glob.has_magic(jid):
+            for path in glob.glob(os.path.join(logdir, jid)):
+                name = os.path.basename(path)
+                if name.startswith(INDEX_FILE) or os.path.splitext(name)[1] in OUTPUT_SUFFIXES:
+                    continue
+                jobs[name] = path
+        elif os.path.exists(os.path.join(logdir, jid)):
+            jobs[jid] = os.path.join(logdir, jid)
+    return jobs
+
+def summarize_jobs(logdir, jobs):
+    """
+    returns {jid: summary} for jobs, finished jobs are answered from the
+    index as long as their result file hasn't changed
+    """
+
+    index = read_index(logdir)
+    index_changed = False
+    summaries = {}
+    for jid, path in jobs.iteritems():
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        key = [st.st_mtime, st.st_size]
+        entry = index.get(jid)
+        if entry and entry.get('key') == key:
+            summaries[jid] = entry['summary']
+            continue
+
+        data = read_job(path, jid)
+        if data is None:
+            summaries[jid] = dict(failed=1, finished=0, msg="Could not parse job output")
+            continue
+        summary = dict((k, data[k]) for k in SUMMARY_KEYS if k in data)
+        for k in ('started', 'heartbeat', 'stdout_offset'):
+            if k in data:
+                summary[k] = data[k]
+        summaries[jid] = summary
+        if summary.get('finished'):
+            index[jid] = dict(key=key, summary=summary)
+            index_changed = True
+
+    # forget the jobs that were removed by hand
+    for jid in index.keys():
+        if not os.path.exists(os.path.join(logdir, jid)):
+            del index[jid]
+            index_changed = True
+
+    if index_changed:
+        write_index(logdir, index)
+    return summaries
+
+def erase_job(log_path):
+    os.unlink(log_path)
+    for suffix in ('.stdout', '.stderr'):
+        if os.path.exists(log_path + suffix):
+            os.unlink(log_path + suffix)
+
 def main():
 
     module = AnsibleModule(argument_spec=dict(
-        jid=dict(required=True),
+        jid=dict(required=True, type='list'),
         mode=dict(default='status', choices=['status','cleanup']),
+        stdout_offset=dict(default=None, type='int'),
+        age=dict(default=None, type='int'),
     ))
 
     mode = module.params['mode']
-    jid  = module.params['jid']
+    jids = module.params['jid']
+    stdout_offset = module.params['stdout_offset']
+    age = module.params['age']
 
     # setup logging directory
     logdir = os.path.expanduser("~/.ansible_async")
+
+    if len(jids) > 1 or glob.has_magic(jids[0]) or age is not None:
+        jobs = find_jobs(logdir, jids)
+
+        if mode == 'cleanup':
+            erased = []
+            if age is not None:
+                summaries = summarize_jobs(logdir, jobs)
+                now = time.time()
+                for jid, path in jobs.items():
+                    if not summaries.get(jid, {}).get('finished'):
+                        del jobs[jid]
+                    elif now - os.path.getmtime(path) < age:
+                        del jobs[jid]
+            for jid, path in jobs.iteritems():
+                erase_job(path)
+                erased.append(path)
+            if jobs:
+                summarize_jobs(logdir, {})
+            module.exit_json(ansible_job_id=jids, erased=erased)
+
+        summaries = summarize_jobs(logdir, jobs)
+        pending = [jid for jid, summary in summaries.iteritems() if not summary.get('finished')]
+        module.exit_json(jobs=summaries, pending=pending, finished=int(not pending))
+
+    jid = jids[0]
     log_path = os.path.join(logdir, jid)
 
     if not os.path.exists(log_path):
         module.fail_json(msg="could not find job", ansible_job_id=jid)
 
     if mode == 'cleanup':
-        os.unlink(log_path)
+        erase_job(log_path)
         module.exit_json(ansible_job_id=jid, erased=log_path)
 
     # NOT in cleanup mode, assume regular status mode
     # no remote kill mode currently exists, but probably should
     # consider log_path + ".pid" file and also unlink that above
 
-    data = file(log_path).read()
-    try:
-        data = json.loads(data)
-    except Exception, e:
-        if data == '':
-            # file not written yet?  That means it is running
-            module.exit_json(results_file=log_path, ansible_job_id=jid, started=1, finished=0)
-        else:
-            module.fail_json(ansible_job_id=jid, results_file=log_path,
-                msg="Could not parse job output: %s" % data)
+    data = read_job(log_path, jid)
+    if data is None:
+        module.fail_json(ansible_job_id=jid, results_file=log_path,
+            msg="Could not parse job output: %s" % file(log_path).read())
 
-    if not 'started' in data:
-        data['finished'] = 1
-        data['ansible_job_id'] = jid
+    if 'started' in data and stdout_offset is not None and data.get('stdout_file'):
+        # only read what was appended since the caller's last poll
+        data['partial_stdout'] = ''
+        data['stdout_offset'] = stdout_offset
+        try:
+            f = open(data['stdout_file'])
+            try:
+                f.seek(stdout_offset)
+                data['partial_stdout'] = f.read()
+                data['stdout_offset'] = f.tell()
+            finally:
+                f.close()
+        except IOError:
+            # the job finished and removed its output in the meantime
+            pass
 
     # Fix error: TypeError: exit_json() keywords must be strings
     data = dict([(str(k), v) for k, v in data.iteritems()])
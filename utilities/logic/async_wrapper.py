@@ -25,10 +25,12 @@ except ImportError:
     import simplejson as json
 import shlex
 import os
-import subprocess
 import sys
 import traceback
 import signal
+import select
+import errno
+import fcntl
 import time
 import syslog
 
@@ -71,41 +73,131 @@ def daemonize_self():
     os.dup2(dev_null.fileno(), sys.stderr.fileno())
 
 
-def _run_module(wrapped_cmd, jid, job_path):
+def _write_record(job_path, record):
+    # replace the job file in one step, so async_status never
+    # reads a half written record
+    tmp_path = job_path + '.tmp'
+    jobfile = open(tmp_path, "w")
+    try:
+        jobfile.write(json.dumps(record))
+    finally:
+        jobfile.close()
+    os.rename(tmp_path, job_path)
 
-    jobfile = open(job_path, "w")
-    jobfile.write(json.dumps({ "started" : 1, "ansible_job_id" : jid }))
-    jobfile.close()
-    jobfile = open(job_path, "w")
-    result = {}
+def _output_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
 
-    outdata = ''
+def _read_output(path):
+    try:
+        f = open(path)
+        try:
+            return f.read()
+        finally:
+            f.close()
+    except IOError:
+        return ''
+
+# the SIGCHLD handler writes to this pipe, so the supervisor can sleep
+# in select() until either the module exits or the next heartbeat is due
+_sigchld_r, _sigchld_w = os.pipe()
+for fd in (_sigchld_r, _sigchld_w):
+    fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+
+def _sigchld_handler(signum, frame):
+    try:
+        os.write(_sigchld_w, 'x')
+    except OSError:
+        pass
+
+def _wait_for_sigchld(timeout):
+    try:
+        (r, w, x) = select.select([_sigchld_r], [], [], timeout)
+    except select.error, e:
+        if e[0] != errno.EINTR:
+            raise
+        return
+    if r:
+        try:
+            os.read(_sigchld_r, 4096)
+        except OSError:
+            pass
+
+def _exec_module(wrapped_cmd, stdout_path, stderr_path):
+    # runs in the forked child, which becomes the module itself
+    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+    os.setpgid(0, 0)
+    for (path, fd) in ((stdout_path, sys.stdout.fileno()), (stderr_path, sys.stderr.fileno())):
+        out = os.open(path, os.O_WRONLY|os.O_CREAT|os.O_TRUNC, 0600)
+        os.dup2(out, fd)
+        os.close(out)
     try:
         cmd = shlex.split(wrapped_cmd)
-        script = subprocess.Popen(cmd, shell=False, stdin=None, stdout=jobfile, stderr=jobfile)
-        script.communicate()
-        outdata = file(job_path).read()
-        result = json.loads(outdata)
+        os.execvp(cmd[0], cmd)
+    except Exception, e:
+        os.write(sys.stderr.fileno(), str(e))
+    os._exit(127)
 
-    except (OSError, IOError), e:
-        result = {
-            "failed": 1,
-            "cmd" : wrapped_cmd,
-            "msg": str(e),
-        }
-        result['ansible_job_id'] = jid
-        jobfile.write(json.dumps(result))
-    except:
+def _supervise(sub_pid, jid, job_path, record, time_limit, step):
+    """
+    Wait for the module until the time limit, writing a heartbeat record
+    with the current stdout size every step seconds. Returns the wait
+    status of the module, or None if it had to be killed.
+    """
+    deadline = time.time() + time_limit
+    next_heartbeat = time.time() + step
+    while True:
+        (pid, status) = os.waitpid(sub_pid, os.WNOHANG)
+        if pid:
+            return status
+
+        now = time.time()
+        if now >= deadline:
+            notice("Now killing %s"%(sub_pid))
+            os.killpg(sub_pid, signal.SIGKILL)
+            notice("Sent kill to group %s"%sub_pid)
+            os.waitpid(sub_pid, 0)
+            return None
+
+        if now >= next_heartbeat:
+            record['heartbeat'] = now
+            record['stdout_offset'] = _output_size(record['stdout_file'])
+            _write_record(job_path, record)
+            next_heartbeat = now + step
+
+        _wait_for_sigchld(min(deadline, next_heartbeat) - now)
+
+def _finish(wrapped_cmd, jid, job_path, record, status, time_limit):
+    outdata = _read_output(record['stdout_file'])
+    errdata = _read_output(record['stderr_file'])
+
+    if status is None:
         result = {
             "failed" : 1,
             "cmd" : wrapped_cmd,
-            "data" : outdata, # temporary notice only
-            "msg" : traceback.format_exc()
+            "msg" : "Job reached maximum time limit of %s seconds." % time_limit,
         }
-        result['ansible_job_id'] = jid
-        jobfile.write(json.dumps(result))
-    jobfile.close()
+    else:
+        try:
+            result = json.loads(outdata)
+        except:
+            result = {
+                "failed" : 1,
+                "cmd" : wrapped_cmd,
+                "data" : outdata, # temporary notice only
+                "stderr" : errdata,
+                "msg" : traceback.format_exc()
+            }
+    result['ansible_job_id'] = jid
+    _write_record(job_path, result)
 
+    for path in (record['stdout_file'], record['stderr_file']):
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
 
 ####################
 ##      main      ##
@@ -120,10 +212,11 @@ if __name__ == '__main__':
         sys.exit(1)
 
     jid = "%s.%d" % (sys.argv[1], os.getpid())
-    time_limit = sys.argv[2]
+    time_limit = int(sys.argv[2])
     wrapped_module = sys.argv[3]
     argsfile = sys.argv[4]
     cmd = "%s %s" % (wrapped_module, argsfile)
+    # seconds between heartbeat records, the end of the job is noticed right away
     step = 5
 
     # setup job output directory
@@ -138,6 +231,27 @@ if __name__ == '__main__':
                 "failed" : 1,
                 "msg" : "could not create: %s" % jobdir
             })
+            sys.exit(1)
+
+    # the record async_status sees until the job is done, the module
+    # output goes to separate files so partial output can be read back
+    record = {
+        "started" : 1,
+        "finished" : 0,
+        "ansible_job_id" : jid,
+        "results_file" : job_path,
+        "stdout_file" : job_path + ".stdout",
+        "stderr_file" : job_path + ".stderr",
+        "stdout_offset" : 0,
+    }
+    try:
+        _write_record(job_path, record)
+    except (IOError, OSError), e:
+        print json.dumps({
+            "failed" : 1,
+            "msg" : "could not write the job record %s: %s" % (job_path, str(e))
+        })
+        sys.exit(1)
     # immediately exit this process, leaving an orphaned process
     # running which immediately forks a supervisory timing process
 
@@ -164,34 +278,30 @@ if __name__ == '__main__':
             # we are now daemonized, create a supervisory process
             notice("Starting module and watcher")
 
+            # installed before the fork so an early exit can't be missed
+            signal.signal(signal.SIGCHLD, _sigchld_handler)
+
             sub_pid = os.fork()
             if sub_pid:
                 # the parent stops the process after the time limit
-                remaining = int(time_limit)
 
                 # set the child process group id to kill all children
-                os.setpgid(sub_pid, sub_pid)
-
-                notice("Start watching %s (%s)"%(sub_pid, remaining))
-                time.sleep(step)
-                while os.waitpid(sub_pid, os.WNOHANG) == (0, 0):
-                    notice("%s still running (%s)"%(sub_pid, remaining))
-                    time.sleep(step)
-                    remaining = remaining - step
-                    if remaining <= 0:
-                        notice("Now killing %s"%(sub_pid))
-                        os.killpg(sub_pid, signal.SIGKILL)
-                        notice("Sent kill to group %s"%sub_pid)
-                        time.sleep(1)
-                        sys.exit(0)
+                try:
+                    os.setpgid(sub_pid, sub_pid)
+                except OSError:
+                    # the child already did it, or is already gone
+                    pass
+
+                notice("Start watching %s (%s)"%(sub_pid, time_limit))
+                record['pid'] = sub_pid
+                status = _supervise(sub_pid, jid, job_path, record, time_limit, step)
+                _finish(cmd, jid, job_path, record, status, time_limit)
                 notice("Done in kid B.")
                 sys.exit(0)
             else:
                 # the child process runs the actual module
                 notice("Start module (%s)"%os.getpid())
-                _run_module(cmd, jid, job_path)
-                notice("Module complete (%s)"%os.getpid())
-                sys.exit(0)
+                _exec_module(cmd, record['stdout_file'], record['stderr_file'])
 
     except Exception, err:
         notice("error: %s"%(err))
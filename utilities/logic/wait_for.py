@@ -20,11 +20,16 @@
 
 import binascii
 import datetime
+import errno
+import fcntl
 import math
+import random
 import re
 import select
 import socket
+import struct
 import sys
+import threading
 import time
 
 HAS_PSUTIL = False
@@ -35,6 +40,19 @@ try:
 except ImportError:
     pass
 
+HAS_INOTIFY = False
+try:
+    import ctypes
+    import ctypes.util
+    _libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+    _inotify_init = _libc.inotify_init
+    _inotify_add_watch = _libc.inotify_add_watch
+    _inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+    HAS_INOTIFY = True
+except (ImportError, OSError, AttributeError, TypeError):
+    # no ctypes before python 2.5, no inotify outside of Linux
+    pass
+
 DOCUMENTATION = '''
 ---
 module: wait_for
@@ -100,8 +118,26 @@ options:
     required: false
     description:
       - list of hosts or IPs to ignore when looking for active TCP connections for C(drained) state
+  endpoints:
+    version_added: "2.1"
+    required: false
+    description:
+      - list of C(host:port) endpoints (C([address]:port) for IPv6) to wait for at the same time,
+        with C(state=started) or C(stopped). C(port) is used for items without a port.
+      - All endpoints are probed concurrently, each retrying with its own jittered backoff.
+        How long each took is returned in C(endpoints).
+  require:
+    version_added: "2.1"
+    required: false
+    default: "all"
+    description:
+      - With C(endpoints), how many of them must reach C(state); C(all), C(any) or C(quorum:N)
+        for at least N of them.
 notes:
   - The ability to use search_regex with a port connection was added in 1.7.
+  - Since 2.1, a file is only read from where the previous check stopped, so a
+    large log isn't read again every time. On Linux, the module sleeps until inotify
+    reports a change to the file; elsewhere it polls, more often while the file is growing.
 requirements: []
 author:
     - "Jeroen Hoekx (@jhoekx)"
@@ -132,6 +168,10 @@ EXAMPLES = '''
 # wait until the process is finished and pid was destroyed
 - wait_for: path=/proc/3466/status state=absent
 
+# wait for a majority of the etcd members and all the database servers
+- wait_for: endpoints=etcd1:2379,etcd2:2379,etcd3:2379 require=quorum:2
+- wait_for: endpoints="{{ groups['db'] | map('regex_replace', '$', ':5432') | list }}"
+
 # wait 300 seconds for port 22 to become open and contain "OpenSSH", don't assume the inventory_hostname is resolvable
 # and don't start checking for 10 seconds
 - local_action: wait_for port=22 host="{{ ansible_ssh_host | default(inventory_hostname) }}" search_regex=OpenSSH delay=10
@@ -206,6 +246,10 @@ class LinuxTCPConnectionInfo(TCPConnectionInfo):
     This is a TCP Connection Info evaluation strategy class
     that utilizes information from Linux's procfs. While less universal,
     does allow Linux targets to not require an additional library.
+
+    Where the kernel supports it (3.3+), the sockets are asked for over
+    netlink sock_diag instead, which filters on state and local port in
+    the kernel so only the candidates are returned.
     """
     platform = 'Linux'
     distribution = None
@@ -222,35 +266,512 @@ class LinuxTCPConnectionInfo(TCPConnectionInfo):
     remote_address_field = 2
     connection_state_field = 3
 
+    # netlink sock_diag, see linux/sock_diag.h and linux/inet_diag.h
+    NETLINK_SOCK_DIAG = 4
+    SOCK_DIAG_BY_FAMILY = 20
+    NLM_F_REQUEST = 0x1
+    NLM_F_DUMP = 0x300
+    NLMSG_ERROR = 2
+    NLMSG_DONE = 3
+    INET_DIAG_REQ_BYTECODE = 1
+    INET_DIAG_BC_S_GE = 2
+    INET_DIAG_BC_S_LE = 3
+    nlmsghdr = '=IHHII'
+    # family, protocol, ext, pad, states, sport, dport, src, dst, if, cookie
+    inet_diag_req_v2 = '=BBBxIHH16s16sI8s'
+    # family, state, timer, retrans, sport, dport, src, dst, ... (ports are big endian)
+    inet_diag_msg = '=BBBBHH16s16s'
+
     def __init__(self, module):
         self.module = module
         (self.family, self.ip) = _convert_host_to_hex(module.params['host'])
         self.port = "%0.4X" % int(module.params['port'])
         self.exclude_ips = self._get_exclude_ips()
 
+        # everything a line is compared with is worked out once
+        self.any_ip = self.ip == self.match_all_ips[self.family]
+        self.states = frozenset(self.connection_states)
+        self.ip_len = len(self.match_all_ips[self.family])
+
+        (family, ip) = _convert_host_to_ip(module.params['host'])
+        self.packed_ip = None
+        if ip != {socket.AF_INET: '0.0.0.0', socket.AF_INET6: '::'}[family]:
+            self.packed_ip = socket.inet_pton(family, ip)
+        self.packed_exclude_ips = frozenset()
+        if module.params['exclude_hosts'] is not None:
+            self.packed_exclude_ips = frozenset([socket.inet_pton(*_convert_host_to_ip(h))
+                                                 for h in module.params['exclude_hosts']])
+        self.use_netlink = hasattr(socket, 'AF_NETLINK')
+
     def _get_exclude_ips(self):
         if self.module.params['exclude_hosts'] is None:
-            return []
+            return frozenset()
         exclude_hosts = self.module.params['exclude_hosts']
-        return [ _convert_host_to_hex(h) for h in exclude_hosts ]
+        return frozenset([ hexed for (family, hexed) in [ _convert_host_to_hex(h) for h in exclude_hosts ]
+                           if family == self.family ])
 
     def get_active_connections_count(self):
+        if self.use_netlink:
+            try:
+                return self._get_active_connections_count_netlink()
+            except (socket.error, struct.error, ValueError):
+                # old kernel or no permission, /proc always works
+                self.use_netlink = False
+        return self._get_active_connections_count_proc()
+
+    def _get_active_connections_count_proc(self):
         active_connections = 0
         f = open(self.source_file[self.family])
-        for tcp_connection in f.readlines():
-            tcp_connection = tcp_connection.strip().split()
-            if tcp_connection[self.local_address_field] == 'local_address':
+        try:
+            lines = f.read().splitlines()
+        finally:
+            f.close()
+
+        # the kernel prints fixed width fields after the "sl:" column, so
+        # everything can be sliced relative to the first colon
+        ip_len = self.ip_len
+        local_port_slice = (ip_len + 3, ip_len + 7)
+        remote_start = ip_len + 8
+        state_start = 2 * ip_len + 14
+        port = self.port
+        for line in lines[1:]:
+            c = line.find(':')
+            if line[c + local_port_slice[0]:c + local_port_slice[1]] != port:
+                if line[c + ip_len + 2:c + ip_len + 3] == ':':
+                    continue
+                # not the layout we expected, do it the slow way
+                if self._count_line(line.split()):
+                    active_connections += 1
                 continue
-            if tcp_connection[self.connection_state_field] not in self.connection_states:
+            if line[c + state_start:c + state_start + 2] not in self.states:
                 continue
-            (local_ip, local_port) = tcp_connection[self.local_address_field].split(':')
-            if self.port == local_port and self.ip in [self.match_all_ips[self.family], local_ip]:
-                 (remote_ip, remote_port) = tcp_connection[self.remote_address_field].split(':')
-                 if remote_ip not in self.exclude_ips:
-                     active_connections += 1
-        f.close()
+            if not self.any_ip and line[c + 2:c + 2 + ip_len] != self.ip:
+                continue
+            if line[c + remote_start:c + remote_start + ip_len] not in self.exclude_ips:
+                active_connections += 1
         return active_connections
 
+    def _count_line(self, tcp_connection):
+        if len(tcp_connection) <= self.connection_state_field:
+            return False
+        if tcp_connection[self.connection_state_field] not in self.states:
+            return False
+        (local_ip, local_port) = tcp_connection[self.local_address_field].split(':')
+        if self.port == local_port and (self.any_ip or local_ip == self.ip):
+            (remote_ip, remote_port) = tcp_connection[self.remote_address_field].split(':')
+            return remote_ip not in self.exclude_ips
+        return False
+
+    def _get_active_connections_count_netlink(self):
+        port = int(self.module.params['port'])
+        states = 0
+        for state in self.connection_states:
+            states |= 1 << int(state, 16)
+
+        # only sockets with port <= sport <= port, i.e. our local port
+        bytecode = struct.pack('=BBHBBH', self.INET_DIAG_BC_S_GE, 8, 20, 0, 0, port)
+        bytecode += struct.pack('=BBHBBH', self.INET_DIAG_BC_S_LE, 8, 12, 0, 0, port)
+        attr = struct.pack('=HH', 4 + len(bytecode), self.INET_DIAG_REQ_BYTECODE) + bytecode
+        req = struct.pack(self.inet_diag_req_v2, self.family, socket.IPPROTO_TCP, 0, states,
+                                         0, 0, '', '', 0, '\0' * 8) + attr
+        hdr_len = struct.calcsize(self.nlmsghdr)
+        msg_len = struct.calcsize(self.inet_diag_msg)
+        msg = struct.pack(self.nlmsghdr, hdr_len + len(req), self.SOCK_DIAG_BY_FAMILY,
+                                 self.NLM_F_REQUEST | self.NLM_F_DUMP, 1, 0) + req
+
+        addr_len = {socket.AF_INET: 4, socket.AF_INET6: 16}[self.family]
+        active_connections = 0
+        s = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, self.NETLINK_SOCK_DIAG)
+        try:
+            s.sendto(msg, (0, 0))
+            while True:
+                data = s.recv(65536)
+                if not data:
+                    raise ValueError("netlink socket closed")
+                offset = 0
+                while offset + hdr_len <= len(data):
+                    (length, msg_type, flags, seq, pid) = struct.unpack(self.nlmsghdr, data[offset:offset + hdr_len])
+                    if msg_type == self.NLMSG_DONE:
+                        return active_connections
+                    if msg_type == self.NLMSG_ERROR or length < hdr_len + msg_len:
+                        raise ValueError("sock_diag request failed")
+                    (family, state, timer, retrans, sport, dport, src, dst) = \
+                        struct.unpack(self.inet_diag_msg, data[offset + hdr_len:offset + hdr_len + msg_len])
+                    if self.packed_ip is None or src[:addr_len] == self.packed_ip:
+                        if dst[:addr_len] not in self.packed_exclude_ips:
+                            active_connections += 1
+                    # messages are padded to 4 bytes
+                    offset += (length + 3) & ~3
+        finally:
+            s.close()
+
+
+# ===========================================
+# File watching
+
+class FileSearcher(object):
+    """
+    Searches a file for a regex, reading only what was appended since
+    the previous check. The end of the data already searched is kept
+    so a match across the boundary is still found. If the file was
+    replaced or truncated, it is searched again from the start.
+    """
+    block_size = 1024 * 1024
+    overlap = 64 * 1024
+
+    def __init__(self, path, compiled_re):
+        self.path = path
+        self.compiled_re = compiled_re
+        self.inode = None
+        self.offset = 0
+        self.tail = ''
+
+    def search(self):
+        """
+        Returns:
+            True if the regex matched, False if it didn't, including when
+            the file can't be read (yet)
+        """
+        try:
+            f = open(self.path)
+        except IOError:
+            return False
+        try:
+            st = os.fstat(f.fileno())
+            if (st.st_dev, st.st_ino) != self.inode or st.st_size < self.offset:
+                self.inode = (st.st_dev, st.st_ino)
+                self.offset = 0
+                self.tail = ''
+            f.seek(self.offset)
+            while True:
+                block = f.read(self.block_size)
+                if not block:
+                    return False
+                data = self.tail + block
+                # the first character of the tail only gives context to ^ and \b
+                start = 0
+                if self.offset > len(self.tail):
+                    start = 1
+                if self.compiled_re.search(data, start):
+                    return True
+                self.offset += len(block)
+                self.tail = data[-(self.overlap + 1):]
+        finally:
+            f.close()
+
+
+class FileChangeWaiter(object):
+    """
+    Sleeps until a file changes or the interval passes, whichever comes
+    first. The interval backs off while nothing changes. With inotify
+    both the file and its directory are watched, so creating, writing,
+    moving or removing the file all wake us up; without it, this just
+    polls.
+    """
+    min_interval = 0.05
+    max_interval = 1.0
+
+    IN_MODIFY = 0x002
+    IN_ATTRIB = 0x004
+    IN_CLOSE_WRITE = 0x008
+    IN_MOVED_FROM = 0x040
+    IN_MOVED_TO = 0x080
+    IN_CREATE = 0x100
+    IN_DELETE = 0x200
+    IN_DELETE_SELF = 0x400
+    IN_MOVE_SELF = 0x800
+
+    def __init__(self, path):
+        self.path = path
+        self.interval = self.min_interval
+        self.fd = None
+        if HAS_INOTIFY:
+            fd = _inotify_init()
+            if fd >= 0:
+                fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+                self.fd = fd
+                self._watch(os.path.dirname(os.path.abspath(path)),
+                            self.IN_CREATE | self.IN_DELETE | self.IN_MOVED_FROM | self.IN_MOVED_TO)
+
+    def _watch(self, path, mask):
+        # fails harmlessly while the file doesn't exist, and watching the
+        # same file again just returns its existing watch
+        try:
+            if isinstance(path, unicode):
+                path = path.encode(sys.getfilesystemencoding() or 'utf-8')
+            _inotify_add_watch(self.fd, path, mask)
+        except (UnicodeError, ctypes.ArgumentError):
+            # a path ctypes can't pass on is still polled
+            self.close()
+
+    def changed(self):
+        """Call when progress was seen, so the next wait is short again"""
+        self.interval = self.min_interval
+
+    def wait(self, timeout):
+        timeout = max(0, min(timeout, self.interval))
+        self.interval = min(self.interval * 2, self.max_interval)
+        if self.fd is None:
+            time.sleep(timeout)
+            return
+
+        self._watch(self.path, self.IN_MODIFY | self.IN_ATTRIB | self.IN_CLOSE_WRITE |
+                    self.IN_DELETE_SELF | self.IN_MOVE_SELF)
+        if self.fd is None:
+            time.sleep(timeout)
+            return
+        try:
+            (readable, w, e) = select.select([self.fd], [], [], timeout)
+        except select.error, e:
+            if e[0] != errno.EINTR:
+                raise
+            return
+        if readable:
+            # what changed doesn't matter, the caller looks again
+            try:
+                while os.read(self.fd, 65536):
+                    pass
+            except OSError:
+                pass
+            self.changed()
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+# ===========================================
+# Endpoint probing
+
+class Endpoint(object):
+    """
+    One host:port being waited for. Connection attempts are retried
+    with a jittered exponential backoff so many endpoints (and many
+    hosts waiting for them) don't retry in lockstep.
+    """
+    min_backoff = 0.1
+    max_backoff = 2.0
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.sock = None
+        self.attempt_started = None
+        self.next_attempt = 0
+        self.backoff = self.min_backoff
+        self.attempts = 0
+        self.ready = False
+        self.elapsed = None
+        self.resolved = False
+        self.addrinfo = None
+        self.lookup = None
+
+    def name(self):
+        if ':' in self.host:
+            return '[%s]:%s' % (self.host, self.port)
+        return '%s:%s' % (self.host, self.port)
+
+    def start_resolve(self):
+        """
+        Look up the address in the background so connect() never blocks
+        on the resolver. resolved turns True once the lookup finished.
+        """
+        self.resolved = False
+        self.addrinfo = None
+        self.lookup = threading.Thread(target=self.resolve)
+        self.lookup.setDaemon(True)
+        self.lookup.start()
+
+    def resolve(self):
+        try:
+            self.addrinfo = socket.getaddrinfo(self.host, self.port, 0, socket.SOCK_STREAM)[0]
+        except socket.error:
+            self.addrinfo = None
+        self.resolved = True
+
+    def connect(self, now):
+        """
+        Start a non-blocking connect.
+
+        Returns:
+            True if the connection is in progress or established, False if
+            it failed right away (including name resolution)
+        """
+        if self.addrinfo is None:
+            return False
+        self.attempts += 1
+        self.attempt_started = now
+        try:
+            (family, socktype, proto, canonname, addr) = self.addrinfo
+            self.sock = socket.socket(family, socktype, proto)
+            self.sock.setblocking(0)
+            err = self.sock.connect_ex(addr)
+        except socket.error:
+            self.close()
+            return False
+        if err not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EALREADY):
+            self.close()
+            return False
+        return True
+
+    def connect_result(self):
+        """
+        Returns:
+            True if the connection in progress succeeded
+        """
+        try:
+            return self.sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR) == 0
+        except socket.error:
+            return False
+
+    def retry_later(self, now):
+        self.close()
+        if self.resolved and self.addrinfo is None:
+            # the name may resolve later (a DNS record that shows up after
+            # a VM boots), so the next attempt looks it up again
+            self.resolved = False
+            self.lookup = None
+        self.next_attempt = now + self.backoff * random.uniform(0.5, 1.5)
+        self.backoff = min(self.backoff * 2, self.max_backoff)
+
+    def close(self):
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            except socket.error:
+                pass
+            self.sock = None
+
+
+def _parse_endpoint(endpoint, default_port):
+    """
+    Split host:port, [ipv6]:port, or a bare host using default_port
+
+    Returns:
+        Tuple containing host and port, port is None if there is none
+    """
+    endpoint = endpoint.strip()
+    if endpoint.startswith('['):
+        (host, rest) = endpoint[1:].split(']', 1)
+        port = rest.lstrip(':') or default_port
+    elif endpoint.count(':') == 1:
+        (host, port) = endpoint.split(':')
+    else:
+        (host, port) = (endpoint, default_port)
+    if port is None:
+        return (host, None)
+    return (host, int(port))
+
+def _required_endpoints(require, count):
+    """
+    Returns:
+        The number of endpoints that must be ready for require, or None
+        if require is invalid
+    """
+    if require == 'all':
+        return count
+    if require == 'any':
+        return min(1, count)
+    m = re.match('^quorum:(\d+)$', require)
+    if m and 0 < int(m.group(1)) <= count:
+        return int(m.group(1))
+    return None
+
+def _resolve_endpoints(endpoints):
+    """
+    Start looking up all endpoints at once without waiting for them, each
+    endpoint is probed as soon as its own lookup finished. getaddrinfo has
+    no timeout of its own, so a lookup still running at the deadline is
+    left behind and its endpoint stays unresolved.
+    """
+    for ep in endpoints:
+        ep.start_resolve()
+
+def _wait_for_endpoints(endpoints, state, needed, connect_timeout, end):
+    """
+    Probe endpoints concurrently until needed of them reached state
+    (connectable for started, refusing for stopped) or end passes.
+
+    Returns:
+        The number of endpoints that reached state
+    """
+    start = time.time()
+    deadline = start + _timedelta_total_seconds(end - datetime.datetime.now())
+    ready = 0
+    _resolve_endpoints(endpoints)
+    try:
+        while True:
+            now = time.time()
+
+            for ep in endpoints:
+                if ep.ready or ep.sock is not None or now < ep.next_attempt:
+                    continue
+                if not ep.resolved:
+                    if ep.lookup is None:
+                        ep.start_resolve()
+                    # still being looked up, check on it again shortly
+                    ep.next_attempt = now + ep.min_backoff
+                    continue
+                if not ep.connect(now):
+                    if state == 'stopped':
+                        ep.ready = True
+                    else:
+                        ep.retry_later(now)
+
+            # connects that are taking too long count as failures
+            for ep in endpoints:
+                if ep.sock is not None and now - ep.attempt_started >= connect_timeout:
+                    if state == 'stopped':
+                        ep.ready = True
+                        ep.close()
+                    else:
+                        ep.retry_later(now)
+
+            # counted after the connects that finished by the last select
+            # were looked at, so connects made right before end count too
+            ready = 0
+            for ep in endpoints:
+                if ep.ready:
+                    ready += 1
+                    if ep.elapsed is None:
+                        ep.elapsed = now - start
+            if ready >= needed or now >= deadline:
+                break
+
+            # sleep until a connect finishes, times out, or a retry is due
+            pending = [ep for ep in endpoints if ep.sock is not None]
+            wake = [deadline]
+            wake.extend([ep.attempt_started + connect_timeout for ep in pending])
+            wake.extend([ep.next_attempt for ep in endpoints if not ep.ready and ep.sock is None])
+            timeout = max(0, min(wake) - time.time())
+            try:
+                (r, writable, x) = select.select([], [ep.sock for ep in pending], [], timeout)
+            except select.error, e:
+                if e[0] != errno.EINTR:
+                    raise
+                continue
+
+            now = time.time()
+            for ep in pending:
+                if ep.sock not in writable:
+                    continue
+                connected = ep.connect_result()
+                if connected == (state == 'started'):
+                    ep.ready = True
+                    ep.elapsed = now - start
+                    if connected:
+                        try:
+                            ep.sock.shutdown(socket.SHUT_RDWR)
+                        except socket.error:
+                            pass
+                    ep.close()
+                else:
+                    ep.retry_later(now)
+    finally:
+        for ep in endpoints:
+            ep.close()
+    return ready
 
 def _convert_host_to_ip(host):
     """
@@ -339,7 +860,9 @@ def main():
             path=dict(default=None),
             search_regex=dict(default=None),
             state=dict(default='started', choices=['started', 'stopped', 'present', 'absent', 'drained']),
-            exclude_hosts=dict(default=None, type='list')
+            exclude_hosts=dict(default=None, type='list'),
+            endpoints=dict(default=None, type='list'),
+            require=dict(default='all'),
         ),
     )
 
@@ -370,128 +893,174 @@ def main():
     if params['exclude_hosts'] is not None and state != 'drained':
         module.fail_json(msg="exclude_hosts should only be with state=drained")
 
+    endpoints = None
+    if params['endpoints'] is not None:
+        if path:
+            module.fail_json(msg="endpoints and path parameter can not both be passed to wait_for")
+        if state not in ['started', 'stopped']:
+            module.fail_json(msg="endpoints can only be used with state=started or state=stopped")
+        if search_regex:
+            module.fail_json(msg="search_regex can not be used with endpoints")
+        endpoints = []
+        for endpoint in params['endpoints']:
+            try:
+                (ep_host, ep_port) = _parse_endpoint(endpoint, port)
+            except ValueError:
+                module.fail_json(msg="endpoint %s is not host:port" % endpoint)
+            if ep_port is None:
+                module.fail_json(msg="endpoint %s has no port and no port parameter was given" % endpoint)
+            endpoints.append(Endpoint(ep_host, ep_port))
+        needed = _required_endpoints(params['require'], len(endpoints))
+        if needed is None:
+            module.fail_json(msg="require must be all, any or quorum:N with N between 1 and %d" % len(endpoints))
+
 
     start = datetime.datetime.now()
 
     if delay:
         time.sleep(delay)
 
-    if not port and not path and state != 'drained':
+    if endpoints is not None:
+        end = start + datetime.timedelta(seconds=timeout)
+        ready = _wait_for_endpoints(endpoints, state, needed, connect_timeout, end)
+        results = {}
+        for ep in endpoints:
+            results[ep.name()] = dict(ready=ep.ready, elapsed=ep.elapsed, attempts=ep.attempts)
+        elapsed = datetime.datetime.now() - start
+        if ready < needed:
+            waiting = [ep.name() for ep in endpoints if not ep.ready]
+            module.fail_json(msg="Timeout when waiting for %s of %s (%d of %d ready)" % (params['require'], ', '.join(waiting), ready, needed),
+                             endpoints=results, elapsed=elapsed.seconds)
+        module.exit_json(state=state, endpoints=results, ready=ready, elapsed=elapsed.seconds)
+    elif not port and not path and state != 'drained':
         time.sleep(timeout)
     elif state in [ 'stopped', 'absent' ]:
         ### first wait for the stop condition
         end = start + datetime.timedelta(seconds=timeout)
+        if path:
+            waiter = FileChangeWaiter(path)
 
-        while datetime.datetime.now() < end:
-            if path:
-                try:
-                    f = open(path)
-                    f.close()
-                    time.sleep(1)
-                    pass
-                except IOError:
-                    break
-            elif port:
-                try:
-                    s = _create_connection( (host, port), connect_timeout)
-                    s.shutdown(socket.SHUT_RDWR)
-                    s.close()
+        try:
+            while datetime.datetime.now() < end:
+                if path:
+                    try:
+                        f = open(path)
+                        f.close()
+                        waiter.wait(_timedelta_total_seconds(end - datetime.datetime.now()))
+                    except IOError:
+                        break
+                elif port:
+                    try:
+                        s = _create_connection( (host, port), connect_timeout)
+                        s.shutdown(socket.SHUT_RDWR)
+                        s.close()
+                        time.sleep(1)
+                    except:
+                        break
+                else:
                     time.sleep(1)
-                except:
-                    break
             else:
-                time.sleep(1)
-        else:
-            elapsed = datetime.datetime.now() - start
-            if port:
-                module.fail_json(msg="Timeout when waiting for %s:%s to stop." % (host, port), elapsed=elapsed.seconds)
-            elif path:
-                module.fail_json(msg="Timeout when waiting for %s to be absent." % (path), elapsed=elapsed.seconds)
+                elapsed = datetime.datetime.now() - start
+                if port:
+                    module.fail_json(msg="Timeout when waiting for %s:%s to stop." % (host, port), elapsed=elapsed.seconds)
+                elif path:
+                    module.fail_json(msg="Timeout when waiting for %s to be absent." % (path), elapsed=elapsed.seconds)
+        finally:
+            if path:
+                waiter.close()
 
     elif state in ['started', 'present']:
         ### wait for start condition
         end = start + datetime.timedelta(seconds=timeout)
-        while datetime.datetime.now() < end:
-            if path:
-                try:
-                    os.stat(path)
-                except OSError, e:
-                    # If anything except file not present, throw an error
-                    if e.errno != 2:
-                        elapsed = datetime.datetime.now() - start
-                        module.fail_json(msg="Failed to stat %s, %s" % (path, e.strerror), elapsed=elapsed.seconds)
-                    # file doesn't exist yet, so continue
-                else:
-                    # File exists.  Are there additional things to check?
-                    if not compiled_search_re:
-                        # nope, succeed!
-                        break
+        if path:
+            waiter = FileChangeWaiter(path)
+            if compiled_search_re:
+                searcher = FileSearcher(path, compiled_search_re)
+        try:
+            while datetime.datetime.now() < end:
+                if path:
                     try:
-                        f = open(path)
-                        try:
-                            if re.search(compiled_search_re, f.read()):
-                                # String found, success!
-                                break
-                        finally:
-                            f.close()
-                    except IOError:
-                        pass
-            elif port:
-                alt_connect_timeout = math.ceil(_timedelta_total_seconds(end - datetime.datetime.now()))
-                try:
-                    s = _create_connection((host, port), min(connect_timeout, alt_connect_timeout))
-                except:
-                    # Failed to connect by connect_timeout. wait and try again
-                    pass
-                else:
-                    # Connected -- are there additional conditions?
-                    if compiled_search_re:
-                        data = ''
-                        matched = False
-                        while datetime.datetime.now() < end:
-                            max_timeout = math.ceil(_timedelta_total_seconds(end - datetime.datetime.now()))
-                            (readable, w, e) = select.select([s], [], [], max_timeout)
-                            if not readable:
-                                # No new data.  Probably means our timeout
-                                # expired
-                                continue
-                            response = s.recv(1024)
-                            if not response:
-                                # Server shutdown
-                                break
-                            data += response
-                            if re.search(compiled_search_re, data):
-                                matched = True
-                                break
-
-                        # Shutdown the client socket
-                        s.shutdown(socket.SHUT_RDWR)
-                        s.close()
-                        if matched:
-                            # Found our string, success!
+                        os.stat(path)
+                    except OSError, e:
+                        # If anything except file not present, throw an error
+                        if e.errno != 2:
+                            elapsed = datetime.datetime.now() - start
+                            module.fail_json(msg="Failed to stat %s, %s" % (path, e.strerror), elapsed=elapsed.seconds)
+                        # file doesn't exist yet, so continue
+                    else:
+                        # File exists.  Are there additional things to check?
+                        if not compiled_search_re:
+                            # nope, succeed!
+                            break
+                        offset = searcher.offset
+                        if searcher.search():
+                            # String found, success!
                             break
+                        if searcher.offset != offset:
+                            # the file is growing, look again soon
+                            waiter.changed()
+                elif port:
+                    alt_connect_timeout = math.ceil(_timedelta_total_seconds(end - datetime.datetime.now()))
+                    try:
+                        s = _create_connection((host, port), min(connect_timeout, alt_connect_timeout))
+                    except:
+                        # Failed to connect by connect_timeout. wait and try again
+                        pass
                     else:
-                        # Connection established, success!
-                        s.shutdown(socket.SHUT_RDWR)
-                        s.close()
-                        break
+                        # Connected -- are there additional conditions?
+                        if compiled_search_re:
+                            data = ''
+                            matched = False
+                            while datetime.datetime.now() < end:
+                                max_timeout = math.ceil(_timedelta_total_seconds(end - datetime.datetime.now()))
+                                (readable, w, e) = select.select([s], [], [], max_timeout)
+                                if not readable:
+                                    # No new data.  Probably means our timeout
+                                    # expired
+                                    continue
+                                response = s.recv(1024)
+                                if not response:
+                                    # Server shutdown
+                                    break
+                                data += response
+                                if re.search(compiled_search_re, data):
+                                    matched = True
+                                    break
 
-            # Conditions not yet met, wait and try again
-            time.sleep(1)
+                            # Shutdown the client socket
+                            s.shutdown(socket.SHUT_RDWR)
+                            s.close()
+                            if matched:
+                                # Found our string, success!
+                                break
+                        else:
+                            # Connection established, success!
+                            s.shutdown(socket.SHUT_RDWR)
+                            s.close()
+                            break
 
-        else:   # while-else
-            # Timeout expired
-            elapsed = datetime.datetime.now() - start
-            if port:
-                if search_regex:
-                    module.fail_json(msg="Timeout when waiting for search string %s in %s:%s" % (search_regex, host, port), elapsed=elapsed.seconds)
+                # Conditions not yet met, wait and try again
+                if path:
+                    waiter.wait(_timedelta_total_seconds(end - datetime.datetime.now()))
                 else:
-                    module.fail_json(msg="Timeout when waiting for %s:%s" % (host, port), elapsed=elapsed.seconds)
-            elif path:
-                if search_regex:
-                    module.fail_json(msg="Timeout when waiting for search string %s in %s" % (search_regex, path), elapsed=elapsed.seconds)
-                else:
-                    module.fail_json(msg="Timeout when waiting for file %s" % (path), elapsed=elapsed.seconds)
+                    time.sleep(1)
+
+            else:   # while-else
+                # Timeout expired
+                elapsed = datetime.datetime.now() - start
+                if port:
+                    if search_regex:
+                        module.fail_json(msg="Timeout when waiting for search string %s in %s:%s" % (search_regex, host, port), elapsed=elapsed.seconds)
+                    else:
+                        module.fail_json(msg="Timeout when waiting for %s:%s" % (host, port), elapsed=elapsed.seconds)
+                elif path:
+                    if search_regex:
+                        module.fail_json(msg="Timeout when waiting for search string %s in %s" % (search_regex, path), elapsed=elapsed.seconds)
+                    else:
+                        module.fail_json(msg="Timeout when waiting for file %s" % (path), elapsed=elapsed.seconds)
+        finally:
+            if path:
+                waiter.close()
 
     elif state == 'drained':
         ### wait until all active connections are gone